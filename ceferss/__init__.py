@@ -0,0 +1,6 @@
+"""
+Host-side support library for the CEFERSS soft sensor.
+
+Shared by the Pi display scripts, the terminal visualizers and the serial
+forwarder so that every consumer speaks the same wire protocol.
+"""
@@ -0,0 +1,394 @@
+"""
+Throughput benchmarks for the host pipeline.
+
+Each benchmark pushes a stream of frames through one host component at
+several grid sizes and reports frames/s, microseconds per frame and the
+peak bytes allocated while handling one frame (tracemalloc, measured in
+a separate pass so it does not skew the timing).
+
+    parse_csv        FrameReader on legacy CSV lines (terminal_visualizer)
+    parse_binary     FrameReader on binary keyframes and deltas
+    parse_analog     FrameReader on 10-bit analog keyframes and deltas
+    socket_read      FrameReader.read_socket over a socket pair
+                     (remote_visualizer)
+    oled_render      grid_renderer() on a luma dummy device (soft_sense_*)
+    oled_heatmap     render_intensity of the same on analog frames
+    terminal_nano    nano/terminal_visualizer.render
+    terminal_pico    pico/basic_scanner/pico_visualizer.render
+    touches          TouchTracker.update: blobs, centroids and tracking
+    forward          serial_forwarder.broadcast_to_clients with --clients
+                     connected TCP clients
+    recording        FrameReader over the chunks of --recording, as
+                     recorded (grid size taken from the file)
+
+Streams come from ceferss.simulator with a fixed seed, so runs are
+comparable. --save writes the results as a baseline; --compare reports
+the change against one and exits with status 1 when anything got slower
+(or its allocation peak grew) by more than --threshold. The peak is the
+most memory live at once while handling a frame: buffers allocated and
+freed within the step count, their number does not.
+
+Usage: python3 -m ceferss.bench [--sizes 5x5,9x9,13x13,32x32]
+           [--only parse_csv,forward] [--save FILE | --compare FILE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import socket
+import sys
+import time
+import tracemalloc
+
+from .protocol import SUB_DELTA, encode_subscription
+from .recording import Recording
+from .simulator import FrameEncoder, TouchModel
+from .stream import FrameReader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = "5x5,9x9,13x13,32x32"
+STREAM_FRAMES = 1000
+WARMUP_FRAMES = 100
+ALLOC_FRAMES = 200
+FORWARD_FLUSH = 16      # frames between event loop turns in `forward`
+SEED = 1
+
+
+def _load_script(relpath, name):
+    """Import one of the repo's scripts as a module."""
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(ROOT, relpath))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Stream:
+    """A simulated session at one grid size, in every form needed."""
+
+    def __init__(self, rows, cols, count=STREAM_FRAMES):
+        self.rows = rows
+        self.cols = cols
+        model = TouchModel(rows, cols, fingers=3, radius=max(0.8, rows / 8),
+                           noise=0.002, seed=SEED)
+        binary = FrameEncoder(rows, cols, keyframe_interval=50)
+        csv = FrameEncoder(rows, cols, binary=False)
+        analog = FrameEncoder(rows, cols, keyframe_interval=50, analog=True,
+                              seed=SEED)
+        self.binary = []
+        self.csv = []
+        self.analog = []
+        for _ in range(count):
+            bits = model.step(0.02)
+            data = binary.encode(bits)
+            if data:
+                self.binary.append(data)
+            self.csv.append(csv.encode(bits))
+            data = analog.encode(bits)
+            if data:
+                self.analog.append(data)
+        reader = FrameReader()
+        self.frames = [f for data in self.binary for f in reader.feed(data)]
+        reader = FrameReader()
+        self.analog_frames = [f for data in self.analog
+                              for f in reader.feed(data)]
+
+
+# --- Benchmarks ---
+# Each takes a Stream and returns (step(i), close()); step handles frame
+# i modulo the stream length.
+
+def bench_parse_csv(stream):
+    reader = FrameReader()
+    chunks = stream.csv
+    return (lambda i: reader.feed(chunks[i % len(chunks)])), None
+
+
+def bench_parse_binary(stream):
+    reader = FrameReader()
+    chunks = stream.binary
+    return (lambda i: reader.feed(chunks[i % len(chunks)])), None
+
+
+def bench_parse_analog(stream):
+    reader = FrameReader()
+    chunks = stream.analog
+    return (lambda i: reader.feed(chunks[i % len(chunks)])), None
+
+
+def bench_socket_read(stream):
+    tx, rx = socket.socketpair()
+    reader = FrameReader()
+    chunks = stream.binary
+
+    def step(i):
+        tx.sendall(chunks[i % len(chunks)])
+        reader.read_socket(rx)
+
+    def close():
+        tx.close()
+        rx.close()
+
+    return step, close
+
+
+def _oled_renderer(stream):
+    from luma.core.device import dummy
+
+    from .oled import grid_renderer
+    device = dummy(width=128, height=64, mode="1")
+    return grid_renderer(device, stream.rows, stream.cols)
+
+
+def bench_oled_render(stream):
+    renderer = _oled_renderer(stream)
+    frames = stream.frames
+    return (lambda i: renderer.render(frames[i % len(frames)].bits)), None
+
+
+def bench_oled_heatmap(stream):
+    renderer = _oled_renderer(stream)
+    frames = stream.analog_frames
+
+    def step(i):
+        renderer.render_intensity(frames[i % len(frames)].intensity())
+
+    return step, None
+
+
+def _bench_terminal(stream, relpath, name):
+    module = _load_script(relpath, name)
+    module.GRID_ROWS = stream.rows
+    module.GRID_COLS = stream.cols
+    devnull = open(os.devnull, "w")
+    frames = stream.frames
+
+    def step(i):
+        with contextlib.redirect_stdout(devnull):
+            module.render(frames[i % len(frames)])
+
+    return step, devnull.close
+
+
+def bench_terminal_nano(stream):
+    return _bench_terminal(stream, "nano/terminal_visualizer.py",
+                           "terminal_visualizer")
+
+
+def bench_terminal_pico(stream):
+    return _bench_terminal(stream, "pico/basic_scanner/pico_visualizer.py",
+                           "pico_visualizer")
+
+
+def bench_touches(stream):
+    from .touches import TouchTracker
+    tracker = TouchTracker(stream.rows, stream.cols)
+    frames = stream.frames
+    return (lambda i: tracker.update(frames[i % len(frames)])), None
+
+
+async def _drain(reader):
+    while await reader.read(65536):
+        pass
+
+
+def bench_forward(stream, clients=8):
+    forwarder = _load_script("nano/serial_forwarder.py", "serial_forwarder")
+    loop = asyncio.new_event_loop()
+    quiet = open(os.devnull, "w")
+
+    async def connect():
+        server = await asyncio.start_server(forwarder.handle_client,
+                                            "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        sinks = []
+        for _ in range(clients):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(encode_subscription(SUB_DELTA))
+            sinks.append((asyncio.create_task(_drain(reader)), writer))
+        while len(forwarder.delta_clients) < clients:
+            await asyncio.sleep(0.01)
+        return server, sinks
+
+    with contextlib.redirect_stdout(quiet):
+        server, sinks = loop.run_until_complete(connect())
+    frames = stream.frames
+
+    def step(i):
+        forwarder.broadcast_to_clients(frames[i % len(frames)])
+        if i % FORWARD_FLUSH == 0:
+            loop.run_until_complete(asyncio.sleep(0))
+
+    def close():
+        with contextlib.redirect_stdout(quiet):
+            # Let the clients read everything first, or closing resets
+            loop.run_until_complete(asyncio.sleep(0.05))
+            for task, writer in sinks:
+                writer.close()
+            server.close()
+            loop.run_until_complete(asyncio.sleep(0.05))
+            for task, _ in sinks:
+                task.cancel()
+            loop.run_until_complete(server.wait_closed())
+        loop.close()
+        quiet.close()
+
+    return step, close
+
+
+BENCHMARKS = {
+    "parse_csv": bench_parse_csv,
+    "parse_binary": bench_parse_binary,
+    "parse_analog": bench_parse_analog,
+    "socket_read": bench_socket_read,
+    "oled_render": bench_oled_render,
+    "oled_heatmap": bench_oled_heatmap,
+    "terminal_nano": bench_terminal_nano,
+    "terminal_pico": bench_terminal_pico,
+    "touches": bench_touches,
+    "forward": bench_forward,
+}
+
+
+# --- Measurement ---
+
+def measure(step, frames, repeat=3):
+    """(frames/s, us/frame, peak bytes/frame) for a step function."""
+    for i in range(WARMUP_FRAMES):
+        step(i)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for i in range(frames):
+            step(i)
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    us = best / frames / 1000
+
+    tracemalloc.start()
+    total = 0
+    for i in range(ALLOC_FRAMES):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        step(i)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return 1e6 / us, us, total / ALLOC_FRAMES
+
+
+def run_recording(path, frames):
+    with Recording(path) as recording:
+        chunks = [bytes(chunk) for _, chunk in recording.chunks()]
+    if not chunks:
+        return None
+    reader = FrameReader()
+    decoded = sum(len(reader.feed(chunk)) for chunk in chunks)
+    reader = FrameReader()
+    fps, us, peak = measure(lambda i: reader.feed(chunks[i % len(chunks)]),
+                            frames)
+    # Chunks are reads, not frames: scale to decoded frames
+    ratio = decoded / len(chunks) if decoded else 1
+    return fps * ratio, us / ratio, peak / ratio
+
+
+def compare(results, baseline, threshold):
+    """Print the change against a baseline; returns the regressed keys."""
+    regressions = []
+    print(f"\n{'benchmark':<24}{'us/frame':>12}{'baseline':>12}"
+          f"{'change':>9}{'peak B':>10}{'baseline':>10}")
+    for key, row in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<24}{row['us']:>12.2f}{'-':>12}")
+            continue
+        change = row["us"] / base["us"] - 1
+        # Older baselines stored the same peak as "alloc"
+        base_peak = base.get("peak", base.get("alloc", 0))
+        worse = change > threshold or (
+            row["peak"] > base_peak * (1 + threshold)
+            and row["peak"] - base_peak > 64)
+        print(f"{key:<24}{row['us']:>12.2f}{base['us']:>12.2f}"
+              f"{change:>+9.0%}{row['peak']:>10.0f}{base_peak:>10.0f}"
+              f"{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m ceferss.bench",
+                                     description="Host pipeline benchmarks.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma-separated RxC grid sizes")
+    parser.add_argument("--only", help="comma-separated benchmark names: "
+                        + ", ".join(BENCHMARKS))
+    parser.add_argument("--frames", type=int, default=2000,
+                        help="frames per timed run")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="socket clients for the forward benchmark")
+    parser.add_argument("--recording", help="also benchmark parsing a .cfr")
+    parser.add_argument("--save", metavar="FILE",
+                        help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+    sizes = [tuple(int(n) for n in size.lower().split("x"))
+             for size in args.sizes.split(",")]
+
+    results = {}
+    print(f"{'benchmark':<24}{'frames/s':>12}{'us/frame':>12}"
+          f"{'peak B/frame':>15}")
+    for rows, cols in sizes:
+        stream = Stream(rows, cols)
+        for name in names:
+            setup = BENCHMARKS[name]
+            if name == "forward":
+                step, close = setup(stream, args.clients)
+                label = f"forward[{args.clients}]"
+            else:
+                step, close = setup(stream)
+                label = name
+            try:
+                fps, us, peak = measure(step, args.frames)
+            finally:
+                if close is not None:
+                    close()
+            key = f"{label}@{rows}x{cols}"
+            results[key] = {"fps": fps, "us": us, "peak": peak}
+            print(f"{key:<24}{fps:>12.0f}{us:>12.2f}{peak:>15.0f}")
+    if args.recording:
+        measured = run_recording(args.recording, args.frames)
+        if measured is not None:
+            fps, us, peak = measured
+            key = f"recording@{os.path.basename(args.recording)}"
+            results[key] = {"fps": fps, "us": us, "peak": peak}
+            print(f"{key:<24}{fps:>12.0f}{us:>12.2f}{peak:>15.0f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results},
+                      f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over "
+                  f"{args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Per-cell calibration of analog frames on the host.
+
+The host-side twin of AUTO_CALIBRATE in nano_grid.ino, for analog
+streams (Frame.values). A single touch threshold cannot fit every cell
+as the fabric drifts with humidity, stretch and wear. Calibrator
+instead tracks each cell's baseline (resting reading) and noise floor
+(mean absolute deviation):
+
+  * over the first `warmup` frames as a plain mean, with no touches
+    reported (keep hands off the fabric at startup);
+  * afterwards as an exponential moving average with weight `alpha`,
+    updated only while the cell is untouched.
+
+A cell is touched once its reading falls below the baseline by
+`noise_k` times its noise (at least `min_drop` counts), and released
+when the drop is back under `release` times that. The hysteresis stops
+a cell sitting on its threshold from flickering, which would otherwise
+send a delta and a redraw on every frame.
+
+Everything is vectorized over the whole (rows, cols) array:
+
+    calibrator = Calibrator()
+    for frame in reader.feed(data):
+        calibrator.apply(frame)        # frame.bits now per-cell
+        heat = calibrator.intensity(frame.values)
+"""
+
+import numpy as np
+
+from .protocol import mask_bits
+
+WARMUP = 64
+ALPHA = 1 / 32
+NOISE_K = 4.0
+MIN_DROP = 16.0
+RELEASE = 0.5
+
+
+class Calibrator:
+    """Per-cell baseline and noise; classifies touches with hysteresis."""
+
+    def __init__(self, warmup=WARMUP, alpha=ALPHA, noise_k=NOISE_K,
+                 min_drop=MIN_DROP, release=RELEASE):
+        self.warmup = warmup
+        self.alpha = alpha
+        self.noise_k = noise_k
+        self.min_drop = min_drop
+        self.release = release
+        self.reset()
+
+    def reset(self):
+        """Forget everything and calibrate again from the next frame."""
+        self.baseline = None
+        self.noise = None
+        self.touched = None
+        self.frames = 0
+
+    @property
+    def calibrated(self):
+        return self.frames >= self.warmup
+
+    def thresholds(self):
+        """Drop below baseline that counts as a touch, per cell."""
+        return np.maximum(self.noise * self.noise_k, self.min_drop)
+
+    def update(self, values):
+        """Feed one frame of readings; returns the touched cells (bool)."""
+        v = np.asarray(values, dtype=np.float32)
+        if self.baseline is None or self.baseline.shape != v.shape:
+            self.reset()
+            self.baseline = v.copy()
+            self.noise = np.zeros_like(v)
+            self.touched = np.zeros(v.shape, dtype=bool)
+            self.frames = 1
+            return self.touched
+
+        if self.calibrated:
+            drop = self.baseline - v
+            on = self.thresholds()
+            self.touched = np.where(self.touched, drop > on * self.release,
+                                    drop > on)
+            weight = self.alpha
+        else:
+            weight = 1 / (self.frames + 1)
+        # Only untouched cells move their baseline
+        idle = ~self.touched
+        self.baseline[idle] += weight * (v[idle] - self.baseline[idle])
+        deviation = np.abs(v - self.baseline)
+        self.noise[idle] += weight * (deviation[idle] - self.noise[idle])
+        self.frames += 1
+        return self.touched
+
+    def apply(self, frame):
+        """Replace an analog frame's touch bits with calibrated ones."""
+        if frame.values is not None:
+            frame.bits = mask_bits(self.update(frame.values))
+        return frame
+
+    def intensity(self, values):
+        """Pressure per cell, 0..1, with the touch threshold at 0.5."""
+        if self.baseline is None:
+            return np.zeros(np.shape(values), dtype=np.float32)
+        drop = self.baseline - np.asarray(values, dtype=np.float32)
+        return np.clip(drop / (2 * self.thresholds()), 0.0, 1.0)
@@ -0,0 +1,206 @@
+"""
+Per-cell debouncing of digital frames on the host.
+
+The host-side twin of DEBOUNCE_SCANS in the Pico scanners, for scanners
+that send every raw change (nano_grid.ino, or Pico firmware with it off).
+A contact settling or a noisy cell flips its bit for a scan or two; each
+flip is a delta and a redraw. Debouncer holds back every change until it
+has lasted:
+
+  * every cell has an integrate-and-threshold counter, all in one
+    preallocated array. Each scan where the raw level differs from the
+    debounced one counts up, each scan where they agree counts down, and
+    the debounced level flips when the counter reaches `depth`;
+  * scans are counted from the time between frames at the scanner's rate
+    (Frame.scan_hz, once a status frame has reported it), since a delta
+    stream is silent while nothing changes. poll() integrates up to now,
+    so a change that has held is released without waiting for the next
+    frame (ingest_serial does this with a debouncer).
+
+A clean change is delayed by depth - 1 scans. depth is capped so that
+this stays within max_latency_ms at the current rate; the delay actually
+added to each released change is recorded as the "debounce" stage of a
+LatencyStats, and `glitches` counts the changes that were filtered out.
+
+    debouncer = Debouncer(rows, cols)
+    for frame in reader.feed(data):
+        frame = debouncer.update(frame)    # None: nothing changed
+        if frame is not None:
+            draw(frame)
+"""
+
+import numpy as np
+
+from .latency import now_us
+from .protocol import (
+    TYPE_DELTA,
+    TYPE_KEYFRAME,
+    TYPE_STATUS,
+    Frame,
+    bits_mask,
+    mask_bits,
+)
+
+DEPTH = 3               # scans a new level must hold
+MAX_LATENCY_MS = 50     # cap on the delay that adds
+SCAN_HZ = 20            # assumed until a status frame reports the rate
+
+
+class Debouncer:
+    """Integrate-and-threshold counters per cell; update() filters frames."""
+
+    def __init__(self, rows, cols, depth=DEPTH, max_latency_ms=MAX_LATENCY_MS,
+                 scan_hz=SCAN_HZ, stats=None):
+        self.rows = rows
+        self.cols = cols
+        self.count = rows * cols
+        self.max_depth = depth
+        self.max_latency_ms = max_latency_ms
+        self.stats = stats
+        self.counts = np.zeros(self.count, dtype=np.int32)
+        # Raw level of the latest frame and when each counter started, us
+        self._raw = np.zeros(self.count, dtype=bool)
+        self._since_us = np.zeros(self.count, dtype=np.int64)
+        self.glitches = 0
+        self.limit(scan_hz)
+        self.reset()
+
+    def reset(self):
+        """Forget the state; the next frame is taken as it is."""
+        self.counts[:] = 0
+        self.stable = None
+        self.bits = 0
+        self._last_us = None
+        self._latest = None
+
+    def limit(self, scan_hz):
+        """Cap depth for scanning at scan_hz; returns the new depth."""
+        self.scan_hz = scan_hz
+        self.depth = max(1, min(self.max_depth,
+                                1 + int(self.max_latency_ms * scan_hz) // 1000))
+        return self.depth
+
+    @property
+    def latency_ms(self):
+        """Delay added to a clean change at the current rate."""
+        return (self.depth - 1) * 1000 / self.scan_hz
+
+    @property
+    def pending(self):
+        """True while some cell's change is still being counted."""
+        return self.stable is not None and bool(self.counts.any())
+
+    def _scans(self, now):
+        # Whole scans since the last one integrated
+        return int((now - self._last_us) * self.scan_hz // 1_000_000)
+
+    def _integrate(self, scans, now):
+        # `scans` scans of the latest raw level; returns the flipped cells
+        counts = self.counts
+        differs = self._raw != self.stable
+        agrees = ~differs
+        self._since_us[differs & (counts == 0)] = now
+        winding = agrees & (counts > 0)
+        np.add(counts, scans, out=counts, where=differs)
+        np.subtract(counts, scans, out=counts, where=agrees)
+        np.maximum(counts, 0, out=counts)
+        flipped = np.flatnonzero(counts >= self.depth)
+        counts[flipped] = 0
+        self.glitches += int(np.count_nonzero(winding & (counts == 0)))
+        if len(flipped):
+            self.stable[flipped] = self._raw[flipped]
+            self.bits = mask_bits(self.stable)
+            if self.stats is not None:
+                self.stats.record(
+                    "debounce", now - int(self._since_us[flipped].min()))
+        return flipped
+
+    def due_us(self):
+        """When the next pending change would be released, or None."""
+        if not self.pending:
+            return None
+        differs = self._raw != self.stable
+        if not differs.any():
+            # Only counters winding down: no change can come of them
+            return None
+        left = self.depth - int(self.counts[differs].max())
+        return self._last_us + left * 1_000_000 // self.scan_hz
+
+    def _frame(self, frame_type, flipped, source):
+        changed = None if flipped is None else flipped.tolist()
+        out = Frame(frame_type, source.seq, self.rows, self.cols, self.count,
+                    self.bits, changed)
+        out.device_us = source.device_us
+        out.scan_us = source.scan_us
+        out.recv_us = source.recv_us
+        out.scan_hz = source.scan_hz
+        out.scan_mode = source.scan_mode
+        out.debounce = self.depth
+        return out
+
+    def update(self, frame):
+        """Debounce one frame: the frame to show, or None.
+
+        Frames with no grid of this size (analog, touch or other) pass
+        through unchanged, as does everything from a scanner that reports
+        debouncing of its own. A status frame always comes back, with the
+        debounced grid.
+        """
+        if frame.count != self.count or frame.values is not None:
+            return frame
+        if frame.debounce is not None and frame.debounce > 1:
+            self.reset()
+            return frame
+        now = frame.recv_us if frame.recv_us is not None else now_us()
+        if frame.scan_hz:
+            self.limit(frame.scan_hz)
+        if self.stable is None:
+            self.stable = bits_mask(frame.bits, self.count).copy()
+            self._raw[:] = self.stable
+            self.bits = frame.bits
+            self._last_us = now
+            self._latest = frame
+            return self._frame(TYPE_KEYFRAME, None, frame)
+
+        # The previous level held until this frame, which is one scan
+        scans = self._scans(now)
+        flipped = self._integrate(scans - 1, now) if scans > 1 else None
+        self._raw[:] = bits_mask(frame.bits, self.count)
+        more = self._integrate(1, now)
+        if flipped is not None and len(flipped):
+            more = np.union1d(flipped, more)
+        self._last_us = now
+        self._latest = frame
+        if frame.frame_type == TYPE_STATUS:
+            return self._frame(TYPE_STATUS, more, frame)
+        if not len(more):
+            return None
+        return self._frame(TYPE_DELTA, more, frame)
+
+    def scan(self, bits):
+        """Debounce one scan of raw bits, as scanner firmware would;
+        returns the debounced bits."""
+        now = now_us()
+        if self.stable is None:
+            self.stable = bits_mask(bits, self.count).copy()
+            self.bits = bits
+        else:
+            self._raw[:] = bits_mask(bits, self.count)
+            self._integrate(1, now)
+        self._last_us = now
+        return self.bits
+
+    def poll(self, now=None):
+        """Integrate the scans since the last frame; a frame if it changed."""
+        if not self.pending:
+            return None
+        if now is None:
+            now = now_us()
+        scans = self._scans(now)
+        if scans < 1:
+            return None
+        flipped = self._integrate(scans, now)
+        self._last_us += scans * 1_000_000 // self.scan_hz
+        if not len(flipped):
+            return None
+        return self._frame(TYPE_DELTA, flipped, self._latest)
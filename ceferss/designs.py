@@ -0,0 +1,59 @@
+"""
+Strip geometry of the sensor designs in designs_info.txt.
+
+Each design is a grid of row and column strips, all `width` inches
+wide with `gap` inches between them, so cell centres sit one pitch
+(width + gap) apart. sensor_visualizer.py draws them; the host uses them
+to place touches in inches (ceferss.touches).
+"""
+
+import os
+
+PRESETS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "designs_info.txt")
+
+
+def load_presets(path=PRESETS_FILE):
+    """Parse designs_info.txt into a list of (name, dict) presets.
+
+    Format: blank-line-separated blocks; first non-empty line is the
+    preset name, remaining lines are 'key: value' pairs.
+    """
+    presets = []
+    if not os.path.exists(path):
+        return presets
+    with open(path) as f:
+        blocks = f.read().split("\n\n")
+    for block in blocks:
+        lines = [ln.strip() for ln in block.splitlines() if ln.strip()]
+        if not lines:
+            continue
+        name = lines[0]
+        data = {}
+        for ln in lines[1:]:
+            if ":" not in ln:
+                continue
+            k, v = ln.split(":", 1)
+            try:
+                data[k.strip()] = float(v.strip())
+            except ValueError:
+                pass
+        try:
+            presets.append((name, {
+                "rows": int(data["rows"]),
+                "cols": int(data["cols"]),
+                "width": data["strip width (in)"],
+                "gap": data["strip gap (in)"],
+            }))
+        except KeyError:
+            continue
+    return presets
+
+
+def find_preset(rows, cols, path=PRESETS_FILE):
+    """The first preset with this grid size, or None."""
+    for _name, preset in load_presets(path):
+        if preset["rows"] == rows and preset["cols"] == cols:
+            return preset
+    return None
@@ -0,0 +1,374 @@
+"""
+Software fakes of the GPIO expanders behind pico/expander.py.
+
+The expander scanners only talk to the bus and pin objects they are
+given, so on the host they run unchanged (CPython, no `machine`) against
+these fakes, wired to a Matrix of contacts:
+
+  * FakeI2C serves MCP23017 register maps (IODIR, GPPU, GPIO, OLAT, with
+    the address pointer stepping through sequential registers). Output
+    pins drive row lines; pulled-up input pins read a column line LOW
+    where a driven row touches it;
+  * FakeShiftChains is a 74HC595 chain on MOSI and a 74HC165 chain on
+    MISO sharing one clock, with latch (RCLK) and load (SH/LD) pins.
+
+Both count transfers, bytes and bus clocks, so the cost of a scan on
+real hardware can be read off without it:
+
+    matrix = Matrix(16, 16)
+    bus = FakeI2C.for_grid(matrix)
+    scanner = load_firmware().Mcp23017Scanner(bus, 16, 16)
+    matrix.contacts[3, 4] = True
+    assert not (scanner.scan()[3] >> 4) & 1
+
+`python3 -m ceferss.expander` scans simulated touches (ceferss.simulator)
+with both backends at several grid sizes. It checks every scan and
+any_contact() against the contacts, checks that no row is left driven,
+and reports bus transfers, bytes and bus time per scan. Exits with
+status 1 on any mismatch.
+
+Usage: python3 -m ceferss.expander [--sizes 13x13,16x16,24x32,32x32]
+           [--scans 200]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+from .protocol import bits_mask, mask_bits
+from .simulator import TouchModel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRMWARE = os.path.join(ROOT, "pico", "expander.py")
+
+DEFAULT_SIZES = "13x13,16x16,24x32,32x32"
+I2C_HZ = 400_000
+SPI_HZ = 10_000_000
+SEED = 1
+
+# MCP23017 register map with IOCON.BANK = 0
+MCP23017_REGISTERS = 0x16
+IODIRA = 0x00
+GPPUA = 0x0C
+GPIOA = 0x12
+OLATA = 0x14
+ENODEV = 19
+
+# Bytes in an array word on the RP2040: the widest row a scan can hold
+TARGET_WORD_SIZE = 4
+
+
+def load_firmware():
+    """Import pico/expander.py as a module."""
+    spec = importlib.util.spec_from_file_location("expander", FIRMWARE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Matrix:
+    """Row and column lines of the fabric and the contacts between them."""
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.contacts = np.zeros((rows, cols), dtype=bool)
+        # Rows currently driven LOW
+        self.driven = np.zeros(rows, dtype=bool)
+
+    def columns(self):
+        """Column levels: False (LOW) where a driven row touches."""
+        return ~self.contacts[self.driven].any(axis=0)
+
+
+class FakePin:
+    """machine.Pin stand-in; calls on_change(level) when set to a new level."""
+
+    def __init__(self, on_change=None, level=0):
+        self.level = level
+        self.on_change = on_change
+        self.toggles = 0
+
+    def value(self, level=None):
+        if level is None:
+            return self.level
+        level = 1 if level else 0
+        if level != self.level:
+            self.level = level
+            self.toggles += 1
+            if self.on_change is not None:
+                self.on_change(level)
+
+
+class FakeMcp23017:
+    """One MCP23017 whose 16 pins are row or column lines first..first+15."""
+
+    def __init__(self, matrix, role, first):
+        self.matrix = matrix
+        self.role = role
+        self.first = first
+        self.regs = bytearray(MCP23017_REGISTERS)
+        # Power-on state: all pins inputs
+        self.regs[IODIRA] = self.regs[IODIRA + 1] = 0xFF
+
+    def _word(self, reg):
+        return self.regs[reg] | (self.regs[reg + 1] << 8)
+
+    def _lines(self):
+        count = self.matrix.rows if self.role == "rows" else self.matrix.cols
+        return range(self.first, min(self.first + 16, count))
+
+    def _drive(self):
+        # Output pins latched LOW pull their row lines LOW
+        inputs = self._word(IODIRA)
+        latch = self._word(OLATA)
+        for pin, line in enumerate(self._lines()):
+            bit = 1 << pin
+            self.matrix.driven[line] = not inputs & bit and not latch & bit
+
+    def write(self, reg, data):
+        for byte in data:
+            # Writing GPIO writes the output latch
+            target = reg + OLATA - GPIOA if GPIOA <= reg < OLATA else reg
+            self.regs[target] = byte
+            reg = (reg + 1) % MCP23017_REGISTERS
+        if self.role == "rows":
+            self._drive()
+
+    def read(self, reg, size):
+        if self.role == "cols":
+            inputs = self._word(IODIRA)
+            pullups = self._word(GPPUA)
+            # A floating input reads LOW here, so a missing pull-up shows
+            # up as contact everywhere
+            levels = 0
+            columns = self.matrix.columns()
+            for pin in range(16):
+                bit = 1 << pin
+                if not inputs & bit:
+                    levels |= self._word(OLATA) & bit
+                    continue
+                line = self.first + pin
+                if line < self.matrix.cols:
+                    high = pullups & bit and columns[line]
+                else:
+                    high = pullups & bit
+                if high:
+                    levels |= bit
+            self.regs[GPIOA] = levels & 0xFF
+            self.regs[GPIOA + 1] = levels >> 8
+        else:
+            self.regs[GPIOA] = self.regs[OLATA]
+            self.regs[GPIOA + 1] = self.regs[OLATA + 1]
+        out = bytearray(size)
+        for i in range(size):
+            out[i] = self.regs[reg]
+            reg = (reg + 1) % MCP23017_REGISTERS
+        return out
+
+
+class FakeI2C:
+    """machine.I2C stand-in serving FakeMcp23017 chips by address."""
+
+    def __init__(self, chips, freq=I2C_HZ):
+        self.chips = chips
+        self.freq = freq
+        self.reset_counts()
+
+    @classmethod
+    def for_grid(cls, matrix, address=0x20, freq=I2C_HZ):
+        """Row chips from `address` on, then column chips, as
+        Mcp23017Scanner expects them."""
+        chips = {}
+        for first in range(0, matrix.rows, 16):
+            chips[address] = FakeMcp23017(matrix, "rows", first)
+            address += 1
+        for first in range(0, matrix.cols, 16):
+            chips[address] = FakeMcp23017(matrix, "cols", first)
+            address += 1
+        return cls(chips, freq)
+
+    def reset_counts(self):
+        self.transfers = 0
+        self.bytes = 0
+        self.clocks = 0
+
+    @property
+    def bus_us(self):
+        """Time the counted transfers take on the wire."""
+        return self.clocks * 1_000_000 / self.freq
+
+    def _chip(self, addr):
+        chip = self.chips.get(addr)
+        if chip is None:
+            raise OSError(ENODEV, "ENODEV")
+        return chip
+
+    def writeto_mem(self, addr, memaddr, buf):
+        self._chip(addr).write(memaddr, buf)
+        # START, address, register, data, STOP: 9 clocks a byte
+        self.transfers += 1
+        self.bytes += 2 + len(buf)
+        self.clocks += 9 * (2 + len(buf)) + 2
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        buf[:] = self._chip(addr).read(memaddr, len(buf))
+        # Register write, repeated START, address, data
+        self.transfers += 1
+        self.bytes += 3 + len(buf)
+        self.clocks += 9 * (3 + len(buf)) + 3
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        buf = bytearray(nbytes)
+        self.readfrom_mem_into(addr, memaddr, buf)
+        return bytes(buf)
+
+
+class FakeShiftChains:
+    """74HC595 (rows) and 74HC165 (columns) chains on one fake SPI bus.
+
+    Pass the object itself as the spi, with its latch and load pins.
+    """
+
+    def __init__(self, matrix, baudrate=SPI_HZ):
+        self.matrix = matrix
+        self.baudrate = baudrate
+        self.row_bytes = -(-matrix.rows // 8)
+        self.col_bytes = -(-matrix.cols // 8)
+        # 595 shift register and output latch, by chip from MOSI on;
+        # outputs power up LOW until the first latch
+        self._shift = bytearray(self.row_bytes)
+        self.outputs = bytearray(self.row_bytes)
+        # 165 shift register, by chip from MISO on
+        self._inputs = bytearray(self.col_bytes)
+        self.latch = FakePin(self._on_latch)
+        self.load = FakePin(self._on_load, level=1)
+        self._on_latch(1)
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.transfers = 0
+        self.bytes = 0
+
+    @property
+    def bus_us(self):
+        return self.bytes * 8 * 1_000_000 / self.baudrate
+
+    @property
+    def toggles(self):
+        return self.latch.toggles + self.load.toggles
+
+    def _on_latch(self, level):
+        # Rising RCLK copies the shift register to the outputs
+        if not level:
+            return
+        self.outputs[:] = self._shift
+        for r in range(self.matrix.rows):
+            self.matrix.driven[r] = not (self.outputs[r // 8] >> (r % 8)) & 1
+
+    def _on_load(self, level):
+        # SH/LD LOW loads the column levels; unwired inputs pulled up
+        if level:
+            return
+        columns = self.matrix.columns()
+        for chip in range(self.col_bytes):
+            byte = 0
+            for bit in range(8):
+                c = chip * 8 + bit
+                if c >= self.matrix.cols or columns[c]:
+                    byte |= 1 << bit
+            self._inputs[chip] = byte
+
+    def write_readinto(self, write_buf, read_buf):
+        self.transfers += 1
+        self.bytes += len(write_buf)
+        for i, byte in enumerate(write_buf):
+            # MSB first both ways; the 165's SER input is tied LOW
+            read_buf[i] = self._inputs[0]
+            self._inputs[:] = self._inputs[1:] + b"\x00"
+            self._shift[:] = bytes((byte,)) + self._shift[:-1]
+
+    def write(self, buf):
+        self.write_readinto(buf, bytearray(len(buf)))
+
+
+def expected_rows(contacts):
+    """Row ints the scan should return: bit c set where (r, c) is open."""
+    return [mask_bits(~row) for row in contacts]
+
+
+def check(name, matrix, bus, scanner, scans):
+    """Scan `scans` simulated frames; prints the costs, returns failures."""
+    rows = matrix.rows
+    cols = matrix.cols
+    model = TouchModel(rows, cols, fingers=3, radius=max(0.8, rows / 8),
+                       noise=0.002, seed=SEED)
+    # The row words must be no wider than on the target
+    failures = int(scanner.rows.itemsize > TARGET_WORD_SIZE)
+    bus.reset_counts()
+    host_ns = 0
+    for _ in range(scans):
+        bits = model.step(0.01)
+        matrix.contacts[:] = bits_mask(bits, rows * cols).reshape(rows, cols)
+        start = time.perf_counter_ns()
+        got = scanner.scan()
+        host_ns += time.perf_counter_ns() - start
+        if list(got) != expected_rows(matrix.contacts):
+            failures += 1
+        if matrix.driven.any():
+            failures += 1
+    transfers = bus.transfers / scans
+    size = bus.bytes / scans
+    bus_us = bus.bus_us / scans
+    for contact in (False, True):
+        matrix.contacts[:] = False
+        matrix.contacts[rows - 1, cols - 1] = contact
+        if scanner.any_contact() != contact or matrix.driven.any():
+            failures += 1
+    print(f"{name:<10} {rows:>3}x{cols:<3} {transfers:>9.0f} {size:>8.0f} "
+          f"{bus_us:>9.0f} {host_ns / scans / 1000:>9.0f}  "
+          f"{'ok' if not failures else f'{failures} FAILED'}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python3 -m ceferss.expander",
+        description="Run pico/expander.py against fake expanders.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma-separated RxC grid sizes")
+    parser.add_argument("--scans", type=int, default=200,
+                        help="scans per backend and size")
+    args = parser.parse_args()
+    sizes = [tuple(int(n) for n in size.lower().split("x"))
+             for size in args.sizes.split(",")]
+
+    firmware = load_firmware()
+    for rows, cols in sizes:
+        if not 0 < cols <= firmware.MAX_COLS:
+            parser.error(f"{rows}x{cols}: the scanners take 1 to "
+                         f"{firmware.MAX_COLS} columns")
+    print(f"{'backend':<10} {'grid':<7} {'transfers':>9} {'bytes':>8} "
+          f"{'bus us':>9} {'host us':>9}   (per scan; I2C {I2C_HZ // 1000} "
+          f"kHz, SPI {SPI_HZ // 1_000_000} MHz)")
+    failures = 0
+    for rows, cols in sizes:
+        matrix = Matrix(rows, cols)
+        bus = FakeI2C.for_grid(matrix)
+        scanner = firmware.Mcp23017Scanner(bus, rows, cols, settle_us=0)
+        failures += check("mcp23017", matrix, bus, scanner, args.scans)
+
+        matrix = Matrix(rows, cols)
+        chains = FakeShiftChains(matrix)
+        scanner = firmware.ShiftScanner(chains, chains.latch, chains.load,
+                                        rows, cols, settle_us=0)
+        failures += check("shift", matrix, chains, scanner, args.scans)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
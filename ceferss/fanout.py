@@ -0,0 +1,103 @@
+"""
+Fan-out of encoded frames to many asyncio stream clients.
+
+Frames are written straight to a client's socket while its transport
+keeps up. Once the socket buffer passes `buffer_limit` they go into a
+bounded per-client queue drained by that client's own task, so a slow
+client only ever delays itself.
+"""
+
+import asyncio
+import collections
+
+DROP_OLDEST = "drop-oldest"
+LATEST = "latest"
+
+
+class Packet:
+    """One frame to fan out, encoded at most once per representation.
+
+    `keyframe` overrides what keyframe() sends: bytes, or a function
+    returning them on first use. By default it is the frame re-encoded
+    as a keyframe, or `data` itself when there is no frame. Descriptor
+    frames carry no grid (grid is False), so they cannot resync a client.
+    """
+
+    __slots__ = ("frame", "data", "_keyframe")
+
+    def __init__(self, frame, data=None, keyframe=None):
+        self.frame = frame
+        self.data = frame.encode() if data is None else data
+        self._keyframe = keyframe
+
+    def keyframe(self):
+        """Self-contained encoding, sent after frames were dropped."""
+        if self._keyframe is None:
+            if self.frame is None:
+                self._keyframe = self.data
+            else:
+                self._keyframe = self.frame.encode(keyframe=True)
+        elif callable(self._keyframe):
+            self._keyframe = self._keyframe()
+        return self._keyframe
+
+    @property
+    def grid(self):
+        return self.frame is None or self.frame.descriptor is None
+
+
+class Client:
+    """A connected stream client and its bounded send queue."""
+
+    def __init__(self, writer, queue_size=32, buffer_limit=16 * 1024,
+                 policy=DROP_OLDEST):
+        self.writer = writer
+        self.transport = writer.transport
+        self.address = writer.get_extra_info("peername")
+        self.queue_size = queue_size
+        self.buffer_limit = buffer_limit
+        self.policy = policy
+        self.queue = collections.deque()
+        self.wakeup = asyncio.Event()
+        # Set after dropping frames: the next frame must be a keyframe,
+        # since a delta no longer applies on the client side
+        self.resync = False
+        self.dropped = 0
+
+    def offer(self, packet, keyframe=False):
+        """Send a frame now if the socket keeps up, otherwise queue it."""
+        if self.transport.is_closing():
+            return
+        if (not self.queue and not self.resync
+                and self.transport.get_write_buffer_size() < self.buffer_limit):
+            self.transport.write(packet.keyframe() if keyframe else packet.data)
+            return
+        if self.policy == LATEST:
+            if self.queue:
+                self.dropped += len(self.queue)
+                self.queue.clear()
+                self.resync = True
+        elif len(self.queue) >= self.queue_size:
+            self.queue.popleft()
+            self.dropped += 1
+            self.resync = True
+        if keyframe:
+            self.resync = True
+        self.queue.append(packet)
+        self.wakeup.set()
+
+    async def send_queued(self):
+        """Drain the queue at the pace the socket accepts."""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue:
+                await self.writer.drain()
+                if not self.queue:
+                    break
+                packet = self.queue.popleft()
+                if self.resync and packet.grid:
+                    self.resync = False
+                    self.writer.write(packet.keyframe())
+                else:
+                    self.writer.write(packet.data)
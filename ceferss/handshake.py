@@ -0,0 +1,202 @@
+"""
+Descriptor handshake: learn the sensor's geometry and pick its encoding.
+
+Right after opening a port the host writes REQUEST_DESCRIPTOR. Scanners
+answer with a descriptor frame (see ceferss/protocol.py): grid size,
+spare leading rows, scan rate, supported encodings and the one in use,
+firmware version and strip geometry. The host then
+
+  * takes rows and cols from the descriptor instead of constants, so
+    parsers, debouncers and renderers are built for what is attached;
+  * asks for the first encoding of `accepted` (FASTEST: delta frames
+    where supported) that the scanner supports, if it is not already
+    sending it, and waits for the descriptor confirming the switch;
+  * raises GeometryError at once when the scanner does not have the
+    grid the caller requires, and check_geometry() does the same for a
+    frame of the wrong size later on (instead of every frame being
+    reported as invalid).
+
+Firmware that predates the descriptor never answers. The request is
+repeated every RETRY_INTERVAL, for HANDSHAKE_TIMEOUT at most (the Nano
+resets when its port opens and takes a couple of seconds to boot), or
+until frames have flowed for GRACE without an answer; the caller then
+falls back to its constants. Recordings replay what the scanner sent and
+cannot be asked anything, so they are not handshaken either.
+
+    reader = FrameReader()
+    descriptor = handshake(ser, reader)     # None: old firmware
+    rows, cols = (descriptor.rows, descriptor.cols) if descriptor else ...
+    start_ingest(ser, mailbox, reader)
+
+Handshake is the same negotiation driven by frames, for readers that
+cannot block (pump_serial on an event loop): start() it, then pass it
+every frame until update() returns True.
+"""
+
+from .latency import now_us
+from .protocol import (
+    ENC_CSV,
+    ENC_NAMES,
+    FASTEST,
+    REQUEST_DESCRIPTOR,
+    REQUEST_KEYFRAME,
+    SELECT_ENCODING,
+)
+from .recording import ReplayPort
+
+HANDSHAKE_TIMEOUT = 3.0     # seconds without a descriptor before giving up
+RETRY_INTERVAL = 0.25       # seconds between descriptor requests
+GRACE = 1.0                 # seconds of frames without an answer: old firmware
+
+
+class GeometryError(ValueError):
+    """The sensor's grid is not the one the host was set up for."""
+
+
+def choose_encoding(supported, accepted=FASTEST):
+    """First ENC_* of `accepted` among the `supported` bits, or None."""
+    for encoding in accepted:
+        if supported & encoding:
+            return encoding
+    return None
+
+
+def _size(rows, cols, count):
+    if rows is None:
+        return f"{count}-cell"
+    return f"{rows}x{cols}"
+
+
+def check_geometry(frame, rows, cols):
+    """Raise GeometryError if `frame` carries a grid other than rows x cols.
+
+    Frames without a grid (touches, descriptors) pass. CSV frames have no
+    header, so only their cell count is checked.
+    """
+    if frame.count == 0 or (frame.count == rows * cols
+                            and frame.rows in (None, rows)):
+        return
+    raise GeometryError(
+        f"Sensor sends {_size(frame.rows, frame.cols, frame.count)} "
+        f"frames, expected {rows}x{cols}")
+
+
+def describe(descriptor):
+    """One line on a handshake's outcome, for the console."""
+    d = descriptor
+    if d is None:
+        return "No descriptor from the sensor (old firmware?)"
+    return (f"Sensor: {d.rows}x{d.cols}, {d.scan_hz} Hz, "
+            f"{ENC_NAMES.get(d.encoding, '?')} frames, firmware "
+            f"{d.firmware[0]}.{d.firmware[1]}")
+
+
+class Handshake:
+    """Descriptor request and encoding selection, one frame at a time.
+
+    rows and cols, if given, are the scanned grid the caller requires.
+    done is set once the negotiation is over; descriptor is the latest
+    one received (None if the scanner never answered).
+    """
+
+    def __init__(self, accepted=FASTEST, rows=None, cols=None,
+                 timeout=HANDSHAKE_TIMEOUT):
+        self.accepted = accepted
+        self.rows = rows
+        self.cols = cols
+        self.timeout_us = int(timeout * 1_000_000)
+        self.descriptor = None
+        self.selected = None
+        self.done = False
+        self._start_us = None
+        self._sent_us = None
+        self._frames_us = None
+
+    def _request(self, port, now):
+        port.write(REQUEST_DESCRIPTOR)
+        self._sent_us = now
+
+    def start(self, port):
+        """Ask for the descriptor."""
+        now = now_us()
+        self._start_us = now
+        self._request(port, now)
+
+    def _check(self, descriptor):
+        if self.rows is None:
+            return
+        if (descriptor.rows, descriptor.cols) != (self.rows, self.cols):
+            raise GeometryError(
+                f"Sensor scans {descriptor.rows}x{descriptor.cols}, "
+                f"expected {self.rows}x{self.cols}")
+
+    def update(self, frame, port, now=None):
+        """Handle one frame from the port; True once negotiation is over."""
+        if self.done:
+            return True
+        if now is None:
+            now = now_us()
+        descriptor = frame.descriptor
+        if descriptor is None:
+            if self._frames_us is None and frame.count:
+                self._frames_us = now
+            return self.poll(port, now)
+        self._check(descriptor)
+        self.descriptor = descriptor
+        best = choose_encoding(descriptor.encodings, self.accepted)
+        if (best is None or descriptor.encoding == best
+                or self.selected is not None):
+            # In use already, or the switch was asked for once: settled
+            self.done = True
+            return True
+        port.write(SELECT_ENCODING[best])
+        self.selected = best
+        self._sent_us = now
+        return False
+
+    def poll(self, port, now=None):
+        """Repeat the request if due, or give up; True once over."""
+        if self.done:
+            return True
+        if now is None:
+            now = now_us()
+        if (now - self._start_us >= self.timeout_us
+                or self._frames_us is not None and self.descriptor is None
+                and now - self._frames_us >= GRACE * 1_000_000):
+            self.done = True
+            return True
+        if now - self._sent_us >= RETRY_INTERVAL * 1_000_000:
+            self._request(port, now)
+        return False
+
+
+def handshake(port, reader, accepted=FASTEST, rows=None, cols=None,
+              timeout=HANDSHAKE_TIMEOUT):
+    """Negotiate with the scanner on a serial port; its Descriptor or None.
+
+    Frames read meanwhile go through `reader` (pass the same one on to
+    the ingest loop, so its state carries over) and are dropped; a
+    keyframe is asked for at the end so the caller starts from a full
+    grid. Raises GeometryError if rows and cols are given and differ
+    from the sensor's. A recording returns None straight away.
+    """
+    if isinstance(port, ReplayPort):
+        return None
+    saved = port.timeout
+    # Short reads, so requests go out on time even while the port is quiet
+    port.timeout = min(saved or RETRY_INTERVAL, RETRY_INTERVAL)
+    state = Handshake(accepted, rows, cols, timeout)
+    try:
+        state.start(port)
+        while not state.done:
+            for frame in reader.read_serial(port):
+                if state.update(frame, port):
+                    break
+            else:
+                state.poll(port)
+    finally:
+        port.timeout = saved
+    descriptor = state.descriptor
+    if descriptor is not None and descriptor.encoding != ENC_CSV:
+        port.write(REQUEST_KEYFRAME)
+    return descriptor
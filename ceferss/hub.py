@@ -0,0 +1,179 @@
+"""
+Multi-sensor hub: one process for every scanner attached to the Pi.
+
+Discovers Pico and Nano ports by VID/PID (ceferss.ports), reads all of
+them on one asyncio loop and publishes a single merged stream over TCP.
+Ports that appear later are picked up, and ports that vanish are dropped
+and retried on the next rescan.
+
+Each message is one CBOR map, back to back on the socket:
+
+    {"sensor": id, "kind": "pico" | "nano", "t": unix time of receipt,
+     "seq": frame seq or None, "rows": int or None, "cols": int or None,
+     "count": cells, "bits": grid bitset, little-endian bytes,
+     "scan_hz": scanner rate from its status frames, or None,
+     "values": analog readings as uint16 little-endian bytes, or None}
+
+For analog sensors "bits" come from per-cell calibration of the readings
+(ceferss.calibration), not the scanner's single threshold.
+
+The sensor id is the USB serial number when the adapter has one, so it
+stays stable across replugging; otherwise it is the device path.
+
+Usage: python3 -m ceferss.hub [serial_port ...]
+  Without ports, every recognised scanner is used.
+"""
+
+import asyncio
+import sys
+import time
+
+import cbor2
+import serial
+
+from .calibration import Calibrator
+from .fanout import DROP_OLDEST, Client, Packet
+from .ports import find_sensor_ports
+from .stream import pump_serial
+
+# --- Configuration ---
+BAUD_RATE = 115200
+TCP_HOST = '0.0.0.0'
+TCP_PORT = 5556
+RESCAN_INTERVAL = 2.0   # seconds between port discovery passes
+
+CLIENT_QUEUE_SIZE = 256
+CLIENT_BUFFER_LIMIT = 64 * 1024
+
+
+def encode_message(sensor_id, kind, frame, timestamp):
+    """CBOR message for one frame from one sensor."""
+    return cbor2.dumps({
+        "sensor": sensor_id,
+        "kind": kind,
+        "t": timestamp,
+        "seq": frame.seq,
+        "rows": frame.rows,
+        "cols": frame.cols,
+        "count": frame.count,
+        "bits": frame.bits.to_bytes((frame.count + 7) // 8, "little"),
+        "scan_hz": frame.scan_hz,
+        "values": (None if frame.values is None
+                   else frame.values.astype("<u2").tobytes()),
+    })
+
+
+def read_messages(sock):
+    """Yield decoded hub messages from a connected socket until it closes."""
+    with sock.makefile("rb") as f:
+        decoder = cbor2.CBORDecoder(f)
+        while True:
+            try:
+                message = decoder.decode()
+            except cbor2.CBORDecodeEOF:
+                return
+            message["bits"] = int.from_bytes(message["bits"], "little")
+            yield message
+
+
+class SensorHub:
+    """Reads every scanner port and fans the tagged frames out to clients."""
+
+    def __init__(self, ports=None, baud=BAUD_RATE):
+        # Fixed list of devices, or None to auto-discover
+        self.ports = ports
+        self.baud = baud
+        self.readers = {}     # device -> task
+        self.latest = {}      # sensor id -> last Packet
+        self.clients = set()
+        self.frame_counts = {}
+
+    def _discover(self):
+        if self.ports is not None:
+            return [(device, "unknown", None) for device in self.ports]
+        return find_sensor_ports()
+
+    async def watch_ports(self):
+        """Start a reader for every new port, forever."""
+        while True:
+            for device, kind, serial_number in self._discover():
+                if device not in self.readers:
+                    sensor_id = serial_number or device
+                    self.readers[device] = asyncio.create_task(
+                        self._read_sensor(device, kind, sensor_id))
+            await asyncio.sleep(RESCAN_INTERVAL)
+
+    async def _read_sensor(self, device, kind, sensor_id):
+        try:
+            ser = serial.Serial(device, self.baud, timeout=0)
+        except serial.SerialException as e:
+            print(f"{device}: could not open ({e})")
+            del self.readers[device]
+            return
+
+        print(f"Reading {kind} sensor {sensor_id} on {device}")
+        calibrator = Calibrator()
+
+        def on_frame(frame):
+            calibrator.apply(frame)
+            self.publish(sensor_id, kind, frame)
+
+        try:
+            await pump_serial(ser, on_frame)
+        except OSError as e:
+            print(f"{device}: read error ({e})")
+        finally:
+            ser.close()
+            del self.readers[device]
+            print(f"Sensor {sensor_id} on {device} gone")
+
+    def publish(self, sensor_id, kind, frame):
+        """Tag a frame with its sensor and receive time and fan it out."""
+        packet = Packet(None, encode_message(sensor_id, kind, frame,
+                                             time.time()))
+        self.latest[sensor_id] = packet
+        self.frame_counts[sensor_id] = self.frame_counts.get(sensor_id, 0) + 1
+        for client in self.clients:
+            client.offer(packet)
+
+    async def handle_client(self, reader, writer):
+        """Serve one subscriber until it disconnects."""
+        client = Client(writer, CLIENT_QUEUE_SIZE, CLIENT_BUFFER_LIMIT,
+                        DROP_OLDEST)
+        print(f"New client connected: {client.address}")
+        self.clients.add(client)
+        sender = asyncio.create_task(client.send_queued())
+        # Current state of every sensor first
+        for packet in list(self.latest.values()):
+            client.offer(packet)
+        try:
+            while await reader.read(64):
+                pass
+        except (ConnectionError, OSError) as e:
+            print(f"Client {client.address} error: {e}")
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            writer.close()
+            print(f"Client disconnected: {client.address}")
+
+    async def serve(self, host=TCP_HOST, port=TCP_PORT):
+        server = await asyncio.start_server(self.handle_client, host, port,
+                                            reuse_address=True)
+        print(f"Hub listening on {host}:{port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch_ports())
+
+
+def main():
+    hub = SensorHub(sys.argv[1:] or None)
+    try:
+        asyncio.run(hub.serve())
+    except KeyboardInterrupt:
+        print("\nStopping hub...")
+        for sensor_id, count in hub.frame_counts.items():
+            print(f"  {sensor_id}: {count} frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+End-to-end latency measurement, from the scan on the sensor to pixels.
+
+Stages, all in microseconds:
+
+    scan        row strobing on the scanner (timestamped frames only)
+    transfer    scanner send -> host read, beyond the fastest frame seen
+                recently (timestamped frames only)
+    parse       host read -> frame decoded
+    debounce    delay a ceferss.debounce.Debouncer added to a change
+    queue       posted to the Mailbox -> taken by the renderer
+    render      GridRenderer.render(), I2C push included
+    i2c         pushing pixels to the OLED
+    host        host read -> pixels
+    end_to_end  scan start -> pixels (timestamped frames only)
+
+The scanner clock is mapped onto the host clock by ClockOffset. Each
+timestamped frame gives host_read - scanner_send = offset + delay with
+delay >= 0, so the minimum over a sliding window of frames estimates the
+offset; the window keeps it following the drift between the two crystals.
+The one-way delay of that fastest frame cannot be observed, so transfer
+is relative to it.
+
+Each stage feeds a RollingHistogram: log-spaced buckets (8 per power of
+two, under 7% error) covering the last `window` seconds, so recording is
+one increment and p50/p95/p99 are cheap to read at any time.
+
+Typical use:
+
+    stats = LatencyStats()
+    stats.install_dump_signal()     # kill -USR1 <pid> prints the table
+    ...
+    stats.frame_received(frame)     # right after decoding
+    stats.record("render", us)
+    stats.frame_shown(frame)        # after the pixels went out
+"""
+
+import collections
+import signal
+import time
+from array import array
+
+STAGES = ("scan", "transfer", "parse", "debounce", "queue", "render", "i2c",
+          "host", "end_to_end")
+
+WINDOW = 10.0           # seconds of history in the percentiles
+CLOCK_WINDOW = 256      # frames in the clock offset minimum filter
+
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_US = (1 << 40) - 1
+BUCKETS = (MAX_US.bit_length() - SUB_BITS + 1) << SUB_BITS
+
+
+def now_us():
+    """Host clock used for every stage: perf counter in microseconds."""
+    return time.perf_counter_ns() // 1000
+
+
+def bucket_index(us):
+    """Histogram bucket for a duration; exact below 16 us."""
+    value = min(max(int(us), 0), MAX_US)
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (value >> shift)
+
+
+def bucket_value(index):
+    """Midpoint of a histogram bucket, in microseconds."""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    low = ((index & (SUB_BUCKETS - 1)) | SUB_BUCKETS) << shift
+    return low + (1 << shift) // 2
+
+
+class RollingHistogram:
+    """Log-bucketed histogram of the last `window` seconds of samples.
+
+    Two generations of counts are kept and rotated every window / 2, so
+    the percentiles always cover between half and all of the window.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._current = array("L", bytes(BUCKETS * array("L").itemsize))
+        self._previous = array("L", self._current)
+        self._rotate_at = time.monotonic() + window / 2
+        self.total = 0
+
+    def _rotate(self, now):
+        if now - self._rotate_at >= self.window / 2:
+            # Idle for more than a generation: both are stale
+            self._previous = array("L", bytes(len(self._current)
+                                              * self._current.itemsize))
+        else:
+            self._previous = self._current
+        self._current = array("L", bytes(len(self._previous)
+                                         * self._previous.itemsize))
+        self._rotate_at = now + self.window / 2
+
+    def record(self, us):
+        now = time.monotonic()
+        if now >= self._rotate_at:
+            self._rotate(now)
+        self._current[bucket_index(us)] += 1
+        self.total += 1
+
+    def count(self):
+        """Samples currently in the window."""
+        now = time.monotonic()
+        if now >= self._rotate_at:
+            self._rotate(now)
+        return sum(self._current) + sum(self._previous)
+
+    def percentiles(self, *ps):
+        """Values at the given percentiles (0-100); None when empty."""
+        count = self.count()
+        if not count:
+            return [None] * len(ps)
+        current = self._current
+        previous = self._previous
+        targets = sorted((p * count / 100, i) for i, p in enumerate(ps))
+        results = [None] * len(ps)
+        seen = 0
+        t = 0
+        for index in range(len(current)):
+            seen += current[index] + previous[index]
+            while t < len(targets) and seen >= targets[t][0] and seen:
+                results[targets[t][1]] = bucket_value(index)
+                t += 1
+            if t == len(targets):
+                break
+        return results
+
+
+class ClockOffset:
+    """Maps the scanner's 32-bit microsecond clock onto now_us()."""
+
+    def __init__(self, window=CLOCK_WINDOW):
+        self.window = window
+        self._raw = None        # last scanner timestamp as received
+        self._device = 0        # the same, unwrapped
+        self._index = 0
+        # (frame index, offset) with increasing offsets: front is the min
+        self._mins = collections.deque()
+
+    def _unwrap(self, device_us):
+        if self._raw is None:
+            self._device = device_us
+        else:
+            delta = (device_us - self._raw) & 0xFFFFFFFF
+            # A stamp slightly older than the last one is not a wrap
+            if delta >= 1 << 31:
+                delta -= 1 << 32
+            self._device += delta
+        self._raw = device_us & 0xFFFFFFFF
+        return self._device
+
+    def update(self, device_us, host_us):
+        """Add one observation (scanner send time, host read time).
+
+        Returns the delay of this frame beyond the fastest in the window.
+        """
+        sample = host_us - self._unwrap(device_us)
+        mins = self._mins
+        while mins and mins[-1][1] >= sample:
+            mins.pop()
+        mins.append((self._index, sample))
+        while mins[0][0] <= self._index - self.window:
+            mins.popleft()
+        self._index += 1
+        return sample - mins[0][1]
+
+    @property
+    def offset(self):
+        """Current estimate of host clock minus scanner clock."""
+        return self._mins[0][1] if self._mins else None
+
+    def to_host(self, device_us):
+        """Host time of a recent scanner timestamp, or None before sync."""
+        if not self._mins:
+            return None
+        delta = (device_us - self._raw) & 0xFFFFFFFF
+        if delta >= 1 << 31:
+            delta -= 1 << 32
+        return self._device + delta + self._mins[0][1]
+
+
+class LatencyStats:
+    """Per-stage rolling histograms plus the scanner clock mapping."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.histograms = {}
+        self.clock = ClockOffset()
+
+    def record(self, stage, us):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = RollingHistogram(self.window)
+        histogram.record(us)
+
+    def frame_received(self, frame, now=None):
+        """Record scan, transfer and parse for a freshly decoded frame."""
+        if now is None:
+            now = now_us()
+        if frame.recv_us is not None:
+            self.record("parse", now - frame.recv_us)
+        if frame.device_us is not None and frame.recv_us is not None:
+            self.record("scan", frame.scan_us)
+            # The frame goes out right after its scan
+            sent = (frame.device_us + frame.scan_us) & 0xFFFFFFFF
+            self.record("transfer", self.clock.update(sent, frame.recv_us))
+
+    def frame_shown(self, frame, now=None):
+        """Record host and end-to-end latency once a frame is displayed."""
+        if now is None:
+            now = now_us()
+        if frame.recv_us is not None:
+            self.record("host", now - frame.recv_us)
+        if frame.device_us is not None:
+            start = self.clock.to_host(frame.device_us)
+            if start is not None:
+                self.record("end_to_end", now - start)
+
+    def snapshot(self):
+        """{stage: {"count", "p50", "p95", "p99"}} for stages with data."""
+        ordered = [s for s in STAGES if s in self.histograms]
+        ordered += sorted(s for s in self.histograms if s not in STAGES)
+        result = {}
+        for stage in ordered:
+            histogram = self.histograms[stage]
+            p50, p95, p99 = histogram.percentiles(50, 95, 99)
+            result[stage] = {"count": histogram.count(),
+                             "p50": p50, "p95": p95, "p99": p99}
+        return result
+
+    def format(self):
+        """Snapshot as a printable table (microseconds)."""
+        lines = [f"{'stage':<12}{'count':>8}{'p50':>10}{'p95':>10}"
+                 f"{'p99':>10}  (us, last {self.window:g} s)"]
+        for stage, row in self.snapshot().items():
+            if not row["count"]:
+                continue
+            lines.append(f"{stage:<12}{row['count']:>8}{row['p50']:>10}"
+                         f"{row['p95']:>10}{row['p99']:>10}")
+        return "\n".join(lines)
+
+    def install_dump_signal(self, signum=getattr(signal, "SIGUSR1", None)):
+        """Print the table whenever the process receives `signum`."""
+        if signum is None:
+            return
+        signal.signal(signum, lambda *_: print(self.format(), flush=True))
@@ -0,0 +1,203 @@
+"""
+Latest-frame-wins handoff between a serial ingest thread and a renderer.
+
+The ingest thread reads and decodes as fast as data arrives and posts
+every frame to a single-slot Mailbox. The renderer takes whatever is in
+the slot when it is ready; frames posted in between are coalesced (every
+frame already carries the full grid). The serial buffer therefore never
+backs up, and what is on screen is at most one render behind the sensor.
+
+DisplayScheduler caps the renderer at a frame rate: it waits out the
+rest of each frame slot before taking the next frame, so whatever the
+sensor sends meanwhile coalesces into one render.
+
+    mailbox = Mailbox()
+    reader = FrameReader()
+    start_ingest(ser, mailbox, reader)      # a serial port or a socket
+    scheduler = DisplayScheduler(mailbox, max_fps=30, reader=reader)
+    while True:
+        render(scheduler.next_frame())
+"""
+
+import socket
+import threading
+import time
+
+from .latency import now_us
+from .protocol import REQUEST_KEYFRAME
+from .stream import FrameReader
+
+MAX_FPS = 30
+
+
+class Mailbox:
+    """Single-slot mailbox: put() overwrites, get() takes the newest item."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._full = False
+        self._error = None
+        self.posted = 0
+        self.coalesced = 0
+        # Time the last item taken by get() sat in the slot, in us
+        self.wait_us = 0
+        self._put_ns = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._full:
+                self.coalesced += 1
+            self._item = item
+            self._put_ns = time.perf_counter_ns()
+            self._full = True
+            self.posted += 1
+            self._cond.notify()
+
+    def fail(self, error):
+        """Hand an exception from the producer to the consumer."""
+        with self._cond:
+            self._error = error
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Newest item, waiting up to timeout; None if nothing arrived.
+
+        Once the mailbox is empty, re-raises an exception passed to fail().
+        """
+        with self._cond:
+            if not self._full and self._error is None:
+                self._cond.wait(timeout)
+            if not self._full:
+                if self._error is not None:
+                    raise self._error
+                return None
+            item = self._item
+            self._item = None
+            self._full = False
+            self.wait_us = (time.perf_counter_ns() - self._put_ns) // 1000
+            return item
+
+
+class DisplayScheduler:
+    """Paces a render loop fed by a Mailbox to at most max_fps.
+
+    next_frame() sleeps out the rest of the current frame slot, then takes
+    the newest frame; everything posted in between is coalesced, so the
+    render cost is capped however fast the sensor sends. With the ingest
+    thread's reader, frames lost before decoding are counted as dropped.
+    """
+
+    def __init__(self, mailbox, max_fps=MAX_FPS, reader=None):
+        self.mailbox = mailbox
+        self.max_fps = max_fps
+        self.reader = reader
+        self._interval_ns = int(1e9 / max_fps) if max_fps else 0
+        self._due_ns = 0
+        self.shown = 0
+
+    def next_frame(self, timeout=None):
+        """Newest frame once the frame slot is over (None on timeout)."""
+        delay = self._due_ns - time.perf_counter_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        frame = self.mailbox.get(timeout)
+        if frame is not None:
+            self.shown += 1
+            self._due_ns = time.perf_counter_ns() + self._interval_ns
+        return frame
+
+    @property
+    def coalesced(self):
+        return self.mailbox.coalesced
+
+    @property
+    def dropped(self):
+        """Frames lost on the link (sequence gaps, unusable deltas)."""
+        if self.reader is None:
+            return 0
+        return self.reader.lost_frames + self.reader.dropped_deltas
+
+    def summary(self):
+        return (f"Shown {self.shown} of {self.mailbox.posted} frames "
+                f"(max {self.max_fps} fps): {self.coalesced} coalesced, "
+                f"{self.dropped} dropped")
+
+
+def ingest_serial(ser, mailbox, stop=None, reader=None, stats=None,
+                  debouncer=None):
+    """Thread target: decode frames from `ser` into `mailbox` until stopped.
+
+    Any read error is passed on through mailbox.fail() and ends the thread.
+    With a LatencyStats, every frame's scan/transfer/parse time is recorded.
+    With a ceferss.debounce.Debouncer, only debounced frames are posted; a
+    change still being counted is released as soon as it is due, even if
+    no more data arrives.
+    """
+    if reader is None:
+        reader = FrameReader()
+    try:
+        while stop is None or not stop.is_set():
+            if debouncer is not None and not ser.in_waiting:
+                due = debouncer.due_us()
+                if due is not None:
+                    wait = due - now_us()
+                    if wait > 0:
+                        time.sleep(wait / 1_000_000)
+                    frame = debouncer.poll()
+                    if frame is not None:
+                        mailbox.put(frame)
+                    continue
+            for frame in reader.read_serial(ser):
+                if stats is not None:
+                    stats.frame_received(frame)
+                if debouncer is not None:
+                    frame = debouncer.update(frame)
+                    if frame is None:
+                        continue
+                mailbox.put(frame)
+            if reader.resync_needed:
+                ser.write(REQUEST_KEYFRAME)
+                reader.resync_needed = False
+    except Exception as e:
+        mailbox.fail(e)
+
+
+def ingest_socket(sock, mailbox, stop=None, reader=None, stats=None):
+    """ingest_serial for a TCP stream, e.g. from serial_forwarder.py.
+
+    The server closing the connection is passed on as a ConnectionError.
+    """
+    if reader is None:
+        reader = FrameReader()
+    try:
+        while stop is None or not stop.is_set():
+            frames = reader.read_socket(sock)
+            if frames is None:
+                raise ConnectionError("Connection closed by server")
+            for frame in frames:
+                if stats is not None:
+                    stats.frame_received(frame)
+                mailbox.put(frame)
+            if reader.resync_needed:
+                sock.sendall(REQUEST_KEYFRAME)
+                reader.resync_needed = False
+    except Exception as e:
+        mailbox.fail(e)
+
+
+def start_ingest(ser, mailbox, reader=None, stats=None, debouncer=None):
+    """Start ingest_serial (ingest_socket for a socket) on a daemon thread.
+
+    Returns (thread, stop event).
+    """
+    stop = threading.Event()
+    if isinstance(ser, socket.socket):
+        target = ingest_socket
+        args = (ser, mailbox, stop, reader, stats)
+    else:
+        target = ingest_serial
+        args = (ser, mailbox, stop, reader, stats, debouncer)
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread, stop
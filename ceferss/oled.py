@@ -0,0 +1,308 @@
+"""
+Partial-update grid renderer for the SH1106 OLED.
+
+The SH1106 framebuffer is organised in 8 pages of 8 pixel rows; each
+page is written with a page/column address command followed by one byte
+per column. GridRenderer keeps a persistent PIL image of the grid,
+redraws only the cells whose bit changed since the last frame and
+writes only the column span of the pages those cells touch. A single-cell
+change on the 5x5 layout is two page writes of 11 bytes instead of the
+whole 1 KB framebuffer.
+
+render_intensity() draws analog frames (Frame.intensity()) the same way:
+each cell fills from the bottom in proportion to its pressure, and only
+cells whose fill height changed are redrawn.
+
+Devices other than the SH1106 (e.g. luma's dummy device) fall back to
+device.display(image) with the same incremental drawing.
+
+Outlined cells stop fitting the 128x64 panel beyond about 16 rows.
+PixelRenderer draws such grids as a bitmap in NumPy instead: each cell is
+a square block of pixels, down to a single pixel, and grids of more than
+64 rows (or 128 columns) are downsampled, a pixel showing whether any
+cell of its block is touched, or their mean pressure ordered-dithered
+for heatmaps. Changed pages and column spans come from one comparison
+with the last bitmap, and page bytes are packed straight from the array,
+so a frame costs the same whether the grid has 25 cells or 16384.
+grid_renderer() picks GridRenderer when cells of at least MIN_CELL pixels
+fit, and PixelRenderer otherwise.
+"""
+
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+from luma.oled.device import sh1106
+
+from .protocol import bit_indices, bits_mask
+
+SET_PAGE_ADDRESS = 0xB0
+SET_LOW_COLUMN = 0x00
+SET_HIGH_COLUMN = 0x10
+# The SH1106 has 132 columns of RAM; the 128 visible start at column 2
+SH1106_COLUMN_OFFSET = 2
+
+MIN_CELL = 3            # smallest outlined cell that still shows a fill
+
+# 4x4 Bayer matrix: pressure thresholds for the dithered heatmap
+BAYER = (np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9],
+                   [15, 7, 13, 5]], dtype=np.float32) + 0.5) / 16
+
+
+class GridRenderer:
+    """Draws a rows x cols touch grid, pushing only what changed."""
+
+    def __init__(self, device, rows, cols, cell_size=10, cell_gap=2):
+        self.device = device
+        self.rows = rows
+        self.cols = cols
+        self.cell_size = cell_size
+        self.cell_gap = cell_gap
+        width = cell_size * cols + cell_gap * (cols - 1)
+        height = cell_size * rows + cell_gap * (rows - 1)
+        self.offset_x = (device.width - width) // 2
+        self.offset_y = (device.height - height) // 2
+        self.image = Image.new(device.mode, device.size)
+        self.draw = ImageDraw.Draw(self.image)
+        self.bits = None
+        self.levels = None      # fill height per cell, render_intensity()
+        # Direct page writes need the SH1106 command set and no rotation
+        self.partial = isinstance(device, sh1106) and device.rotate == 0
+        self.pages_sent = 0
+        # Time spent sending pixels to the device by the last render(), us
+        self.push_us = 0
+
+    def _cell_box(self, index):
+        r, c = divmod(index, self.cols)
+        x1 = self.offset_x + c * (self.cell_size + self.cell_gap)
+        y1 = self.offset_y + r * (self.cell_size + self.cell_gap)
+        return x1, y1, x1 + self.cell_size, y1 + self.cell_size
+
+    def _draw_cell(self, index, touched):
+        box = self._cell_box(index)
+        # A touched cell is filled, an open one is just outlined
+        self.draw.rectangle(box, outline="white",
+                            fill="white" if touched else "black")
+        return box
+
+    def _draw_level(self, index, level):
+        box = self._cell_box(index)
+        # Outline, filled from the bottom up to `level` pixels
+        self.draw.rectangle(box, outline="white", fill="black")
+        if level:
+            x1, y1, x2, y2 = box
+            self.draw.rectangle((x1, y2 - level, x2, y2), fill="white")
+        return box
+
+    def _mark(self, dirty, box):
+        # Extend the dirty column span of every page the box covers
+        x1, y1, x2, y2 = box
+        for page in range(y1 // 8, y2 // 8 + 1):
+            span = dirty.get(page)
+            if span is None:
+                dirty[page] = [x1, x2]
+            else:
+                span[0] = min(span[0], x1)
+                span[1] = max(span[1], x2)
+
+    def render_intensity(self, intensity):
+        """Show per-cell pressure (0..1, e.g. Frame.intensity()) as fill."""
+        levels = np.rint(np.clip(np.ravel(intensity), 0, 1)
+                         * self.cell_size).astype(np.int16)
+        self.push_us = 0
+        self.bits = None
+        if self.levels is None or len(self.levels) != len(levels):
+            for index, level in enumerate(levels.tolist()):
+                self._draw_level(index, level)
+            self.levels = levels
+            self._display()
+            return
+        changed = np.flatnonzero(levels != self.levels)
+        if not len(changed):
+            return
+        self.levels = levels
+        dirty = {}
+        for index in changed.tolist():
+            self._mark(dirty, self._draw_level(index, int(levels[index])))
+        if not self.partial:
+            self._display()
+            return
+        self._push_pages(dirty)
+
+    def render(self, bits):
+        """Show grid `bits` (bit i set = cell i touched)."""
+        count = self.rows * self.cols
+        bits &= (1 << count) - 1
+        self.push_us = 0
+        self.levels = None
+        if self.bits is None:
+            for index in range(count):
+                self._draw_cell(index, (bits >> index) & 1)
+            self.bits = bits
+            self._display()
+            return
+
+        changed = bits ^ self.bits
+        if not changed:
+            return
+        self.bits = bits
+
+        # page -> [min x, max x] touched by redrawn cells
+        dirty = {}
+        for index in bit_indices(changed, count):
+            self._mark(dirty, self._draw_cell(index, (bits >> index) & 1))
+
+        if not self.partial:
+            self._display()
+            return
+        self._push_pages(dirty)
+
+    def _display(self):
+        start = time.perf_counter_ns()
+        self.device.display(self.image)
+        self.pages_sent += self.device.height // 8
+        self.push_us = (time.perf_counter_ns() - start) // 1000
+
+    def _push_pages(self, dirty):
+        start = time.perf_counter_ns()
+        device = self.device
+        for page, (x1, x2) in sorted(dirty.items()):
+            x1 = max(0, x1)
+            x2 = min(device.width - 1, x2)
+            band = self.image.crop((x1, page * 8, x2 + 1, page * 8 + 8))
+            # Rotating the 8-row band turns each column into one byte,
+            # top pixel in the least significant bit as the SH1106 expects
+            data = band.transpose(Image.Transpose.ROTATE_270).tobytes()
+            column = x1 + SH1106_COLUMN_OFFSET
+            device.command(SET_PAGE_ADDRESS + page,
+                           SET_LOW_COLUMN | (column & 0x0F),
+                           SET_HIGH_COLUMN | (column >> 4))
+            device.data(list(data))
+            self.pages_sent += 1
+        self.push_us = (time.perf_counter_ns() - start) // 1000
+
+    def clear(self):
+        """Blank the display and forget the drawn state."""
+        self.bits = None
+        self.levels = None
+        self.draw.rectangle((0, 0, self.device.width, self.device.height),
+                            fill="black")
+        self.device.clear()
+
+
+class PixelRenderer:
+    """Draws a rows x cols grid as a bitmap of pixel blocks, pushing only
+    the changed page spans. Same interface as GridRenderer."""
+
+    def __init__(self, device, rows, cols):
+        self.device = device
+        self.rows = rows
+        self.cols = cols
+        width = device.width
+        height = device.height
+        # Cells per pixel along each axis, then pixels per (pooled) cell
+        self.factor = max(-(-rows // height), -(-cols // width))
+        pooled_rows = -(-rows // self.factor)
+        pooled_cols = -(-cols // self.factor)
+        self.scale = max(1, min(height // pooled_rows, width // pooled_cols))
+        self.offset_x = (width - pooled_cols * self.scale) // 2
+        self.offset_y = (height - pooled_rows * self.scale) // 2
+        self._cells = np.zeros((pooled_rows * self.factor,
+                                pooled_cols * self.factor), dtype=np.float32)
+        self._pooled = self._cells.reshape(pooled_rows, self.factor,
+                                           pooled_cols, self.factor)
+        self._area = (slice(self.offset_y,
+                            self.offset_y + pooled_rows * self.scale),
+                      slice(self.offset_x,
+                            self.offset_x + pooled_cols * self.scale))
+        # Dither threshold of every pixel in the grid area
+        h = pooled_rows * self.scale
+        w = pooled_cols * self.scale
+        self._dither = np.tile(BAYER, (-(-h // 4), -(-w // 4)))[:h, :w]
+        self.pixels = None
+        self.bits = None
+        self.partial = isinstance(device, sh1106) and device.rotate == 0
+        self.pages_sent = 0
+        self.push_us = 0
+
+    def _expand(self, pooled):
+        scale = self.scale
+        if scale > 1:
+            pooled = np.repeat(np.repeat(pooled, scale, axis=0), scale, axis=1)
+        return pooled
+
+    def _show(self, area):
+        pixels = np.zeros((self.device.height, self.device.width), dtype=bool)
+        pixels[self._area] = area
+        if self.pixels is None or not self.partial:
+            self.pixels = pixels
+            self._display()
+            return
+        # (page, x) bands with any pixel changed
+        changed = (pixels != self.pixels).reshape(-1, 8, pixels.shape[1])
+        dirty = changed.any(axis=1)
+        self.pixels = pixels
+        start = time.perf_counter_ns()
+        device = self.device
+        for page in np.flatnonzero(dirty.any(axis=1)).tolist():
+            xs = np.flatnonzero(dirty[page])
+            x1 = int(xs[0])
+            x2 = int(xs[-1]) + 1
+            # Top pixel of each column in the least significant bit
+            data = np.packbits(pixels[page * 8:page * 8 + 8, x1:x2], axis=0,
+                               bitorder="little")[0]
+            column = x1 + SH1106_COLUMN_OFFSET
+            device.command(SET_PAGE_ADDRESS + page,
+                           SET_LOW_COLUMN | (column & 0x0F),
+                           SET_HIGH_COLUMN | (column >> 4))
+            device.data(data.tolist())
+            self.pages_sent += 1
+        self.push_us = (time.perf_counter_ns() - start) // 1000
+
+    def render(self, bits):
+        """Show grid `bits`; a pixel is lit if any of its cells is touched."""
+        count = self.rows * self.cols
+        bits &= (1 << count) - 1
+        self.push_us = 0
+        if bits == self.bits:
+            return
+        self.bits = bits
+        self._cells[:self.rows, :self.cols] = bits_mask(bits, count).reshape(
+            self.rows, self.cols)
+        self._show(self._expand(self._pooled.max(axis=(1, 3)) > 0))
+
+    def render_intensity(self, intensity):
+        """Show per-cell pressure (0..1) as a dithered heatmap."""
+        self.push_us = 0
+        self.bits = None
+        self._cells[:self.rows, :self.cols] = np.reshape(
+            np.clip(intensity, 0, 1), (self.rows, self.cols))
+        self._show(self._expand(self._pooled.mean(axis=(1, 3)))
+                   > self._dither)
+
+    def _display(self):
+        start = time.perf_counter_ns()
+        image = Image.fromarray(self.pixels)
+        if image.mode != self.device.mode:
+            image = image.convert(self.device.mode)
+        self.device.display(image)
+        self.pages_sent += self.device.height // 8
+        self.push_us = (time.perf_counter_ns() - start) // 1000
+
+    def clear(self):
+        """Blank the display and forget the drawn state."""
+        self.pixels = None
+        self.bits = None
+        self.device.clear()
+
+
+def grid_renderer(device, rows, cols, cell_size=10, cell_gap=2):
+    """GridRenderer with the largest cells up to cell_size that fit, or a
+    PixelRenderer if not even MIN_CELL pixel cells do."""
+    for gap in (cell_gap, 1):
+        # A cell box spans cell_size + 1 pixels, hence the 1
+        size = min(cell_size, (device.height - 1 - gap * (rows - 1)) // rows,
+                   (device.width - 1 - gap * (cols - 1)) // cols)
+        if size >= MIN_CELL:
+            return GridRenderer(device, rows, cols, size, gap)
+    return PixelRenderer(device, rows, cols)
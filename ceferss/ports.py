@@ -0,0 +1,57 @@
+"""
+Serial port discovery for Pico and Nano scanners.
+
+Matches on the USB description and hardware id (which carries VID:PID),
+falling back to the usual device name patterns.
+"""
+
+import glob
+import serial.tools.list_ports
+
+# Substrings of the description / hwid, lower-case
+PICO_IDS = ("pico", "rp2", "2e8a", "micropython")
+NANO_IDS = ("1a86:7523", "ch340", "0403:6001", "ft232", "2341:", "arduino")
+
+PICO_PATTERNS = ["/dev/tty.usbmodem*", "/dev/ttyACM*"]
+NANO_PATTERNS = ["/dev/tty.usbserial-*", "/dev/ttyUSB*"]
+
+
+def _kind(port):
+    desc = (port.description or "").lower()
+    hwid = (port.hwid or "").lower()
+    if any(k in desc or k in hwid for k in PICO_IDS):
+        return "pico"
+    if any(k in desc or k in hwid for k in NANO_IDS):
+        return "nano"
+    return None
+
+
+def find_sensor_ports():
+    """List (device, kind, serial_number) for every recognised scanner."""
+    found = []
+    for p in serial.tools.list_ports.comports():
+        kind = _kind(p)
+        if kind is not None:
+            found.append((p.device, kind, p.serial_number))
+    return found
+
+
+def find_serial_port(kind=None):
+    """Return the first scanner port, preferring VID/PID matches.
+
+    kind limits the search to "pico" or "nano"; device name patterns for
+    that kind (Pico first when unspecified) are tried when nothing matches.
+    """
+    for device, found_kind, _ in find_sensor_ports():
+        if kind is None or found_kind == kind:
+            return device
+
+    if kind == "nano":
+        patterns = NANO_PATTERNS + PICO_PATTERNS
+    else:
+        patterns = PICO_PATTERNS + NANO_PATTERNS
+    for pattern in patterns:
+        ports = glob.glob(pattern)
+        if ports:
+            return ports[0]
+    return None
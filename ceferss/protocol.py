@@ -0,0 +1,747 @@
+"""
+Wire protocol for grid frames sent by the scanner firmware.
+
+Two formats can arrive on the same serial link:
+
+  * legacy CSV lines: one value per cell, '0' = touch, '1' = no touch
+    Example: 1,1,0,1,1,...\\n
+
+  * binary frames (version 1), all multi-byte fields little-endian:
+
+        offset  size  field
+        0       2     sync bytes 0xA5 0x5A
+        2       1     version (high nibble) | frame type (low nibble)
+        3       1     sequence number (wraps at 256)
+        4       1     rows
+        5       1     cols
+        6       2     payload length
+        8       n     payload
+        8+n     1     CRC-8 (poly 0x07, init 0) over bytes 2 .. 8+n-1
+
+    A keyframe payload is the whole grid bit-packed row-major, LSB first,
+    with a set bit meaning touch. An 81-cell 9x9 grid is 11 payload bytes,
+    20 bytes on the wire instead of 162 for the CSV line.
+
+    A delta payload lists the indices of the cells that flipped since the
+    previous frame: one byte each for grids up to 256 cells, two bytes
+    (little-endian) above that. It only applies on top of the frame with
+    the previous sequence number, so after a gap the host drops deltas
+    until the next keyframe and may ask for one by writing
+    REQUEST_KEYFRAME to the scanner.
+
+    With FLAG_TIMESTAMP set in the type nibble, the payload starts with a
+    6-byte timestamp before the keyframe or delta data:
+
+        0       4     scan start, microseconds on the scanner clock
+                      (wraps at 2**32)
+        4       2     scan duration in microseconds (saturates at 65535)
+
+    Hosts use it for end-to-end latency measurement (ceferss/latency.py).
+
+    A status frame reports the scanner's adaptive scan rate, whenever it
+    changes and after each keyframe:
+
+        0       2     scans per second
+        2       1     mode: MODE_ACTIVE, MODE_IDLE (low-rate full scans)
+                      or MODE_WAKE (all rows driven, waiting for any
+                      column to change)
+        3       1     optional: debounce depth, the scans a new cell
+                      level must hold before it is sent (1 = none)
+
+    Status frames sit outside the sequence: they repeat the number of the
+    next grid frame, and readers ignore it, so a delta that follows one
+    still applies.
+
+    Analog frames carry the raw 10-bit ADC reading of every cell instead
+    of one bit (nano_grid.ino with ANALOG_FRAMES). Values are bit-packed
+    LSB first, 4 cells in 5 bytes (pack_values):
+
+        analog keyframe   2 bytes touch threshold (a cell reading below
+                          it is touched), then every cell's value
+        analog delta      a bitmap of the cells that moved by more than
+                          the scanner's deadband (as a keyframe, set bit
+                          = cell), then the new values of those cells
+
+    The host keeps the readings as a NumPy uint16 array (Frame.values)
+    and derives the usual touch bits from the threshold. That is the
+    firmware's fixed TOUCH_THRESHOLD: with AUTO_CALIBRATE the scanner
+    decides touches per cell, and those decisions are not sent. Hosts
+    redo them with ceferss.calibration.Calibrator (apply(frame) replaces
+    the bits), as every consumer in this repo does.
+
+    Touch frames never come from a scanner: the forwarder sends them to
+    clients subscribed to touch events (see SUBSCRIBE), computed by
+    ceferss.touches. The payload is 8 bytes per TouchEvent:
+
+        0       1     kind: 0 down, 1 move, 2 up
+        1       1     touch id
+        2       2     x, 1/1000 inch (1/1000 cell without a design)
+        4       2     y, same units
+        6       1     cells in the blob (saturates at 255)
+        7       1     pressure, 0..255
+
+    A touch events frame lists what changed since the previous one; a
+    touch snapshot frame lists every current touch as "down" (sent on
+    subscribing and after dropped frames), so anything else is gone. Like
+    status frames they sit outside the sequence and repeat the number of
+    the grid frame they came from.
+
+    A descriptor frame is the scanner's answer to REQUEST_DESCRIPTOR:
+    what it scans and how it can send it. rows and cols in the header are
+    the scanned grid, every frame the scanner sends has that size.
+
+        0       2     firmware version: major, minor
+        2       2     scans per second
+        4       1     encodings supported, ENC_* bits
+        5       1     encoding in use, one ENC_* bit
+        6       1     leading rows scanned but not part of the fabric
+                      (pico_grid.py scans a spare row first)
+        7       2     strip width, 1/1000 inch (0 = unknown)
+        9       2     strip gap, 1/1000 inch
+
+    Writing SELECT_ENCODING[enc] switches a scanner to one of the
+    encodings it supports; it answers with a descriptor showing the
+    encoding now in use, followed by a keyframe. Descriptor frames sit
+    outside the sequence like status frames. ceferss/handshake.py asks
+    for one when a consumer opens the port and picks the encoding.
+
+Forwarder subscriptions: a client may write SUBSCRIBE, a name and a
+newline to choose what it receives (encode_subscription):
+
+    delta           frames as the scanner sent them (the default)
+    full            every frame as a keyframe
+    touches         touch frames only
+    decimate:<hz>   keyframes of the newest frame, at most hz per second
+
+Decoding lives in ceferss/stream.py. The MicroPython encoder lives in
+pico/wire_format.py and the Arduino one in nano/nano_grid/nano_grid.ino;
+keep all three in step.
+"""
+
+from array import array
+
+import struct
+
+import numpy as np
+
+SYNC0 = 0xA5
+SYNC1 = 0x5A
+VERSION = 1
+
+TYPE_KEYFRAME = 0x0
+TYPE_DELTA = 0x1
+TYPE_STATUS = 0x2
+TYPE_ANALOG_KEYFRAME = 0x3
+TYPE_ANALOG_DELTA = 0x4
+TYPE_TOUCH_EVENTS = 0x5
+TYPE_TOUCH_SNAPSHOT = 0x6
+TYPE_DESCRIPTOR = 0x7
+TYPE_MASK = 0x7
+FLAG_TIMESTAMP = 0x8
+
+# Host -> scanner command: send a keyframe now
+REQUEST_KEYFRAME = b"K"
+# Host -> scanner command: send a descriptor frame
+REQUEST_DESCRIPTOR = b"?"
+
+# Encodings in descriptor frames
+ENC_CSV = 0x01          # CSV lines
+ENC_KEYFRAMES = 0x02    # binary keyframes only
+ENC_DELTA = 0x04        # binary keyframes and deltas
+ENC_ANALOG = 0x08       # analog keyframes and deltas
+ENC_NAMES = {ENC_CSV: "csv", ENC_KEYFRAMES: "keyframes", ENC_DELTA: "delta",
+             ENC_ANALOG: "analog"}
+# Host -> scanner command: switch to an encoding
+SELECT_ENCODING = {ENC_CSV: b"c", ENC_KEYFRAMES: b"k", ENC_DELTA: b"d",
+                   ENC_ANALOG: b"a"}
+# Fewest bytes per scan first. Analog frames are larger than digital
+# deltas but carry more, so only scanners built for them offer them.
+FASTEST = (ENC_DELTA, ENC_ANALOG, ENC_KEYFRAMES, ENC_CSV)
+
+# Client -> forwarder: SUBSCRIBE + name + b"\n"
+SUBSCRIBE = b"S:"
+SUB_DELTA = "delta"
+SUB_FULL = "full"
+SUB_TOUCHES = "touches"
+SUB_DECIMATE = "decimate"
+
+HEADER_SIZE = 8
+CRC_SIZE = 1
+TIMESTAMP_SIZE = 6
+STATUS_SIZE = 3
+DESCRIPTOR = struct.Struct("<BBHBBBHH")
+
+# Scan modes in status frames
+MODE_ACTIVE = 0
+MODE_IDLE = 1
+MODE_WAKE = 2
+MODE_NAMES = {MODE_ACTIVE: "active", MODE_IDLE: "idle", MODE_WAKE: "wake"}
+
+ADC_BITS = 10
+ADC_MAX = (1 << ADC_BITS) - 1
+THRESHOLD_SIZE = 2
+
+# Touch events
+DOWN = "down"
+MOVE = "move"
+UP = "up"
+TOUCH_KINDS = (DOWN, MOVE, UP)
+TOUCH_EVENT = struct.Struct("<BBHHBB")
+TOUCH_SCALE = 1000      # x, y units per inch
+
+# Bitsets with at most this many bits set are walked in Python; NumPy's
+# per-call overhead (~6 us) only pays off above it
+SPARSE_BITS = 12
+
+TOUCH = "0"
+NO_TOUCH = "1"
+
+
+def _build_crc_table():
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+_CRC_TABLE = _build_crc_table()
+
+
+def crc8(data, start=0, end=None):
+    """CRC-8 (poly 0x07) of data[start:end]."""
+    if end is None:
+        end = len(data)
+    crc = 0
+    table = _CRC_TABLE
+    for i in range(start, end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+
+def pack_cells(states):
+    """Bit-pack a row-major list of '0'/'1' states (set bit = touch)."""
+    payload = bytearray((len(states) + 7) // 8)
+    for i, s in enumerate(states):
+        if s == TOUCH:
+            payload[i >> 3] |= 1 << (i & 7)
+    return payload
+
+
+def unpack_cells(payload, count):
+    """Expand a bit-packed payload into a list of '0'/'1' states."""
+    return [TOUCH if payload[i >> 3] >> (i & 7) & 1 else NO_TOUCH
+            for i in range(count)]
+
+
+def packed_size(count):
+    """Bytes taken by `count` packed 10-bit values."""
+    return (count * ADC_BITS + 7) // 8
+
+
+def pack_values(values):
+    """Bit-pack 10-bit values, LSB first: 4 values in 5 bytes."""
+    v = np.asarray(values, dtype=np.uint16).ravel() & ADC_MAX
+    count = len(v)
+    v = np.pad(v, (0, -count % 4)).reshape(-1, 4)
+    out = np.empty((len(v), 5), dtype=np.uint8)
+    out[:, 0] = v[:, 0] & 0xFF
+    out[:, 1] = (v[:, 0] >> 8) | ((v[:, 1] & 0x3F) << 2)
+    out[:, 2] = (v[:, 1] >> 6) | ((v[:, 2] & 0x0F) << 4)
+    out[:, 3] = (v[:, 2] >> 4) | ((v[:, 3] & 0x03) << 6)
+    out[:, 4] = v[:, 3] >> 2
+    return out.tobytes()[:packed_size(count)]
+
+
+def unpack_values(payload, count):
+    """Inverse of pack_values: a uint16 array of `count` values."""
+    b = np.frombuffer(payload, dtype=np.uint8, count=packed_size(count))
+    b = np.pad(b, (0, -len(b) % 5)).reshape(-1, 5).astype(np.uint16)
+    v = np.empty((len(b), 4), dtype=np.uint16)
+    v[:, 0] = b[:, 0] | ((b[:, 1] & 0x03) << 8)
+    v[:, 1] = (b[:, 1] >> 2) | ((b[:, 2] & 0x0F) << 6)
+    v[:, 2] = (b[:, 2] >> 4) | ((b[:, 3] & 0x3F) << 4)
+    v[:, 3] = (b[:, 3] >> 6) | (b[:, 4] << 2)
+    return v.ravel()[:count]
+
+
+def mask_bits(mask):
+    """Bitset of a boolean cell array, row-major (bit i set = cell i true)."""
+    packed = np.packbits(np.asarray(mask, dtype=bool).ravel(),
+                         bitorder="little")
+    return int.from_bytes(packed.tobytes(), "little")
+
+
+def bits_mask(bits, count):
+    """Inverse of mask_bits: a bool array of `count` cells."""
+    raw = np.frombuffer(bits.to_bytes((count + 7) // 8, "little"),
+                        dtype=np.uint8)
+    return np.unpackbits(raw, count=count, bitorder="little").view(bool)
+
+
+def bit_indices(bits, count):
+    """Indices of the set bits below `count`, as an ascending list."""
+    bits &= (1 << count) - 1
+    if bits.bit_count() > SPARSE_BITS:
+        return np.flatnonzero(bits_mask(bits, count)).tolist()
+    # A few bits: peeling off the lowest beats NumPy's fixed overhead
+    indices = []
+    while bits:
+        low = bits & -bits
+        indices.append(low.bit_length() - 1)
+        bits ^= low
+    return indices
+
+
+def touch_bits(values, threshold):
+    """Touch bitset of analog values (bit i set = value i below threshold)."""
+    return mask_bits(np.asarray(values) < threshold)
+
+
+def encode_frame(frame_type, seq, rows, cols, payload, timestamp=None):
+    """Wrap a payload in a binary frame header and CRC.
+
+    `timestamp` is an optional (scan start us, scan duration us) pair.
+    """
+    if timestamp is not None:
+        start_us, scan_us = timestamp
+        frame_type |= FLAG_TIMESTAMP
+        payload = ((start_us & 0xFFFFFFFF).to_bytes(4, "little")
+                   + min(scan_us, 0xFFFF).to_bytes(2, "little")
+                   + bytes(payload))
+    length = len(payload)
+    buf = bytearray(HEADER_SIZE + length + CRC_SIZE)
+    buf[0] = SYNC0
+    buf[1] = SYNC1
+    buf[2] = (VERSION << 4) | frame_type
+    buf[3] = seq & 0xFF
+    buf[4] = rows
+    buf[5] = cols
+    buf[6] = length & 0xFF
+    buf[7] = length >> 8
+    buf[HEADER_SIZE:HEADER_SIZE + length] = payload
+    buf[-1] = crc8(buf, 2, HEADER_SIZE + length)
+    return bytes(buf)
+
+
+def encode_keyframe(states, rows, cols, seq=0):
+    """Encode a full grid ('0' = touch) as a binary keyframe."""
+    return encode_frame(TYPE_KEYFRAME, seq, rows, cols, pack_cells(states))
+
+
+def index_size(cells):
+    """Bytes per cell index in a delta payload."""
+    return 1 if cells <= 256 else 2
+
+
+def max_payload(frame_type, rows, cols):
+    """Largest payload a frame of this type and grid can carry.
+
+    Includes the timestamp if FLAG_TIMESTAMP is set in frame_type. A
+    header claiming more is corrupt, so readers need not wait for it.
+    """
+    count = rows * cols
+    base = frame_type & TYPE_MASK
+    if base == TYPE_KEYFRAME:
+        size = (count + 7) // 8
+    elif base == TYPE_DELTA:
+        size = count * index_size(count)
+    elif base == TYPE_STATUS:
+        size = STATUS_SIZE + 1          # with the debounce depth
+    elif base == TYPE_ANALOG_KEYFRAME:
+        size = THRESHOLD_SIZE + packed_size(count)
+    elif base == TYPE_ANALOG_DELTA:
+        size = (count + 7) // 8 + packed_size(count)
+    elif base in (TYPE_TOUCH_EVENTS, TYPE_TOUCH_SNAPSHOT):
+        size = TOUCH_EVENT.size * 256   # one per touch id
+    else:
+        size = DESCRIPTOR.size
+    if frame_type & FLAG_TIMESTAMP:
+        size += TIMESTAMP_SIZE
+    return size
+
+
+def encode_delta(prev_states, states, rows, cols, seq=0):
+    """Encode the cells that differ between two grids as a delta frame."""
+    width = index_size(rows * cols)
+    payload = bytearray()
+    for i, s in enumerate(states):
+        if s != prev_states[i]:
+            payload += i.to_bytes(width, "little")
+    return encode_frame(TYPE_DELTA, seq, rows, cols, payload)
+
+
+def encode_status(rows, cols, scan_hz, mode, seq=0, timestamp=None,
+                  debounce=None):
+    """Encode a scan rate report as a status frame."""
+    payload = min(scan_hz, 0xFFFF).to_bytes(2, "little") + bytes((mode,))
+    if debounce is not None:
+        payload += bytes((min(debounce, 0xFF),))
+    return encode_frame(TYPE_STATUS, seq, rows, cols, payload, timestamp)
+
+
+def encode_analog_keyframe(values, threshold, rows, cols, seq=0,
+                           timestamp=None):
+    """Encode every cell's ADC reading as an analog keyframe."""
+    payload = (threshold & 0xFFFF).to_bytes(THRESHOLD_SIZE, "little")
+    return encode_frame(TYPE_ANALOG_KEYFRAME, seq, rows, cols,
+                        payload + pack_values(values), timestamp)
+
+
+def encode_analog_delta(values, changed, rows, cols, seq=0, timestamp=None):
+    """Encode the new readings of the cells listed in `changed`."""
+    count = rows * cols
+    mask = np.zeros(count, dtype=bool)
+    mask[list(changed)] = True
+    flat = np.asarray(values).ravel()
+    payload = (np.packbits(mask, bitorder="little").tobytes()
+               + pack_values(flat[mask]))
+    return encode_frame(TYPE_ANALOG_DELTA, seq, rows, cols, payload,
+                        timestamp)
+
+
+def encode_touches(events, rows, cols, seq=0, snapshot=False):
+    """Touch events (or a snapshot of every touch) as a touch frame."""
+    payload = bytearray(TOUCH_EVENT.size * len(events))
+    for i, event in enumerate(events):
+        TOUCH_EVENT.pack_into(
+            payload, i * TOUCH_EVENT.size, TOUCH_KINDS.index(event.kind),
+            event.id & 0xFF,
+            min(max(round(event.x * TOUCH_SCALE), 0), 0xFFFF),
+            min(max(round(event.y * TOUCH_SCALE), 0), 0xFFFF),
+            min(event.cells, 0xFF),
+            min(max(round(event.pressure * 255), 0), 0xFF))
+    frame_type = TYPE_TOUCH_SNAPSHOT if snapshot else TYPE_TOUCH_EVENTS
+    return encode_frame(frame_type, (seq or 0) & 0xFF, rows, cols, payload)
+
+
+def decode_touches(payload):
+    """Inverse of encode_touches: the list of TouchEvents."""
+    events = []
+    for i in range(len(payload) // TOUCH_EVENT.size):
+        kind, touch_id, x, y, cells, pressure = TOUCH_EVENT.unpack_from(
+            payload, i * TOUCH_EVENT.size)
+        if kind < len(TOUCH_KINDS):
+            events.append(TouchEvent(TOUCH_KINDS[kind], touch_id,
+                                     x / TOUCH_SCALE, y / TOUCH_SCALE,
+                                     cells, pressure / 255))
+    return events
+
+
+def encode_descriptor(descriptor, seq=0):
+    """Encode a Descriptor as a descriptor frame."""
+    d = descriptor
+    payload = DESCRIPTOR.pack(
+        d.firmware[0], d.firmware[1], min(d.scan_hz, 0xFFFF), d.encodings,
+        d.encoding, d.first_row, min(round(d.width * 1000), 0xFFFF),
+        min(round(d.gap * 1000), 0xFFFF))
+    return encode_frame(TYPE_DESCRIPTOR, seq, d.rows, d.cols, payload)
+
+
+def decode_descriptor(payload, rows, cols):
+    """Inverse of encode_descriptor, or None if the payload is short."""
+    if len(payload) < DESCRIPTOR.size:
+        return None
+    (major, minor, scan_hz, encodings, encoding, first_row, width,
+     gap) = DESCRIPTOR.unpack_from(payload)
+    return Descriptor(rows, cols, scan_hz, encodings, encoding,
+                      (major, minor), first_row, width / 1000, gap / 1000)
+
+
+def encode_subscription(name, max_hz=None):
+    """Client -> forwarder request for one representation (SUB_*)."""
+    if name == SUB_DECIMATE:
+        name = f"{name}:{max_hz:g}"
+    return SUBSCRIBE + name.encode() + b"\n"
+
+
+def parse_subscription(line):
+    """(name, max_hz or None) from a subscription line, or None."""
+    if not line.startswith(SUBSCRIBE):
+        return None
+    name, _, rate = bytes(line[len(SUBSCRIBE):]).strip().decode(
+        "ascii", "replace").partition(":")
+    if name in (SUB_DELTA, SUB_FULL, SUB_TOUCHES) and not rate:
+        return name, None
+    if name == SUB_DECIMATE:
+        try:
+            max_hz = float(rate)
+        except ValueError:
+            return None
+        if max_hz > 0:
+            return name, max_hz
+    return None
+
+
+def encode_csv(states):
+    """Encode a grid as a legacy CSV line."""
+    return (",".join(states) + "\n").encode("ascii")
+
+
+_CSV_TO_BITS = bytes.maketrans(b"01", b"10")
+
+
+def parse_csv_line(line):
+    """Parse a CSV grid line into (count, bits), or None if invalid.
+
+    Works on the raw bytes (bytes, bytearray or memoryview) without
+    splitting: the digits sit at even offsets and the commas at odd ones.
+    Bit i of the result is set when cell i is touched.
+    """
+    line = bytes(line).strip()
+    if not line:
+        return None
+    digits = line[::2]
+    count = len(digits)
+    if (len(line) != 2 * count - 1 or line[1::2].count(b",") != count - 1
+            or digits.strip(b"01")):
+        return None
+    # '0' means touch: flip to bit values, reverse so cell 0 is the LSB
+    return count, int(digits.translate(_CSV_TO_BITS)[::-1], 2)
+
+
+class TouchEvent:
+    """A touch going down, moving or lifting, at (x, y) inches.
+
+    x runs along the columns and y along the rows, from the outer edge of
+    the first strip. `cells` is the blob size and `pressure` its mean
+    intensity (1.0 for digital frames); both repeat the last values for
+    an "up". seq and recv_us come from the frame that caused the event.
+    """
+
+    __slots__ = ("kind", "id", "x", "y", "cells", "pressure", "seq",
+                 "recv_us")
+
+    def __init__(self, kind, touch_id, x, y, cells, pressure, seq=None,
+                 recv_us=None):
+        self.kind = kind
+        self.id = touch_id
+        self.x = x
+        self.y = y
+        self.cells = cells
+        self.pressure = pressure
+        self.seq = seq
+        self.recv_us = recv_us
+
+    def __repr__(self):
+        return (f"TouchEvent({self.kind} #{self.id} x={self.x:.2f} "
+                f"y={self.y:.2f} cells={self.cells} "
+                f"pressure={self.pressure:.2f})")
+
+
+class Descriptor:
+    """What a scanner reports about itself in a descriptor frame.
+
+    rows x cols is the grid every frame carries; the first `first_row`
+    rows are scanned but not part of the fabric, so the sensor itself is
+    grid_rows x cols. encodings is the ENC_* bits the scanner can send
+    and encoding the one in use. width and gap are the strip geometry in
+    inches (0 if the firmware does not know it), as in designs_info.txt.
+    """
+
+    __slots__ = ("rows", "cols", "scan_hz", "encodings", "encoding",
+                 "firmware", "first_row", "width", "gap")
+
+    def __init__(self, rows, cols, scan_hz, encodings, encoding,
+                 firmware=(0, 0), first_row=0, width=0.0, gap=0.0):
+        self.rows = rows
+        self.cols = cols
+        self.scan_hz = scan_hz
+        self.encodings = encodings
+        self.encoding = encoding
+        self.firmware = firmware
+        self.first_row = first_row
+        self.width = width
+        self.gap = gap
+
+    @property
+    def grid_rows(self):
+        """Rows of the fabric, without the leading spare rows."""
+        return self.rows - self.first_row
+
+    def geometry(self):
+        """Strip geometry as a designs preset dict, or None if unknown."""
+        if not self.width:
+            return None
+        return {"rows": self.grid_rows, "cols": self.cols,
+                "width": self.width, "gap": self.gap}
+
+    def __repr__(self):
+        names = "|".join(name for enc, name in ENC_NAMES.items()
+                         if self.encodings & enc)
+        return (f"Descriptor({self.rows}x{self.cols} first_row="
+                f"{self.first_row} {self.scan_hz} Hz "
+                f"{ENC_NAMES.get(self.encoding, '?')} of {names} "
+                f"firmware {self.firmware[0]}.{self.firmware[1]} "
+                f"width={self.width:g} gap={self.gap:g})")
+
+
+class Frame:
+    """One decoded grid frame, held as a bitset.
+
+    Bit i of `bits` is set when cell i (row-major) is touched. rows, cols
+    and seq are None for CSV lines, which carry no header.
+
+    Per-cell work goes through NumPy rather than Python loops: grid() is a
+    bool (rows, cols) view of the bits, diff() the indices that differ
+    from another frame (one XOR, then nonzero), and row_counts() /
+    col_counts() the touches projected onto each axis.
+
+    device_us and scan_us come from a timestamped frame (None otherwise);
+    recv_us is the host perf counter, in microseconds, when the bytes that
+    completed the frame were read.
+
+    scan_hz, scan_mode and debounce are the scanner's rate, MODE_* and
+    debounce depth in scans as of the latest status frame (None before
+    one arrives, or for debounce if the scanner does not report it). A
+    status frame itself is returned as a TYPE_STATUS frame repeating the
+    current grid.
+
+    Analog frames also carry `values`, the ADC readings as a uint16 array
+    of shape (rows, cols), and the touch `threshold` that gave `bits`.
+    Both are None for digital frames. The threshold is one value for all
+    cells and ignores the scanner's calibration; Calibrator.apply()
+    replaces `bits` with per-cell decisions.
+
+    Touch frames (TYPE_TOUCH_EVENTS / TYPE_TOUCH_SNAPSHOT) carry no grid
+    (count 0) but the list of TouchEvents in `touches`, and descriptor
+    frames (TYPE_DESCRIPTOR) the scanner's Descriptor in `descriptor`.
+    """
+
+    __slots__ = ("frame_type", "seq", "rows", "cols", "count", "bits",
+                 "changed", "device_us", "scan_us", "recv_us", "scan_hz",
+                 "scan_mode", "debounce", "values", "threshold", "touches",
+                 "descriptor")
+
+    def __init__(self, frame_type, seq, rows, cols, count, bits,
+                 changed=None):
+        self.frame_type = frame_type
+        self.seq = seq
+        self.rows = rows
+        self.cols = cols
+        self.count = count
+        self.bits = bits
+        # Indices that flipped, for delta frames
+        self.changed = changed
+        self.device_us = None
+        self.scan_us = None
+        self.recv_us = None
+        self.scan_hz = None
+        self.scan_mode = None
+        self.debounce = None
+        self.values = None
+        self.threshold = None
+        self.touches = None
+        self.descriptor = None
+
+    def touched(self, index):
+        """True if cell `index` is touched."""
+        return (self.bits >> index) & 1 == 1
+
+    def active(self):
+        """Number of touched cells."""
+        return self.bits.bit_count()
+
+    def cells(self):
+        """Cells as array('B'), 1 = touch."""
+        return array("B", bits_mask(self.bits, self.count).tobytes())
+
+    def grid(self):
+        """Touched cells as a bool array of shape (rows, cols).
+
+        CSV frames have no header and come back as a single row.
+        """
+        return bits_mask(self.bits, self.count).reshape(self.rows or 1, -1)
+
+    def diff(self, other):
+        """Cells that differ from `other` (a Frame or bits), as index list.
+
+        None diffs against an empty grid.
+        """
+        if other is None:
+            other = 0
+        elif isinstance(other, Frame):
+            other = other.bits
+        return bit_indices(self.bits ^ other, self.count)
+
+    def row_counts(self):
+        """Touched cells in each row."""
+        return np.count_nonzero(self.grid(), axis=1)
+
+    def col_counts(self):
+        """Touched cells in each column."""
+        return np.count_nonzero(self.grid(), axis=0)
+
+    def states(self):
+        """Cells as the legacy list of '0' (touch) / '1' (no touch)."""
+        bits = self.bits
+        return [TOUCH if (bits >> i) & 1 else NO_TOUCH
+                for i in range(self.count)]
+
+    def intensity(self):
+        """Pressure per cell as float32 (rows, cols), 0 = open, 1 = full.
+
+        Readings fall as a cell is pressed; the touch threshold maps to
+        0.5. Digital frames give 0 or 1.
+        """
+        if self.values is None:
+            return self.grid().astype(np.float32)
+        span = max(ADC_MAX - self.threshold, 1) * 2
+        pressure = (ADC_MAX - self.values.astype(np.float32)) / span
+        return np.clip(pressure, 0.0, 1.0)
+
+    def _encode_grid(self, keyframe, timestamp):
+        # Keyframe or delta for the grid itself, digital or analog
+        if self.values is not None:
+            if self.frame_type == TYPE_ANALOG_DELTA and not keyframe:
+                return encode_analog_delta(self.values, self.changed,
+                                           self.rows, self.cols, self.seq,
+                                           timestamp)
+            return encode_analog_keyframe(self.values, self.threshold,
+                                          self.rows, self.cols, self.seq,
+                                          timestamp)
+        if self.frame_type == TYPE_DELTA and not keyframe:
+            width = index_size(self.count)
+            payload = b"".join(i.to_bytes(width, "little")
+                               for i in self.changed)
+            return encode_frame(TYPE_DELTA, self.seq, self.rows, self.cols,
+                                payload, timestamp)
+        payload = self.bits.to_bytes((self.count + 7) // 8, "little")
+        return encode_frame(TYPE_KEYFRAME, self.seq, self.rows, self.cols,
+                            payload, timestamp)
+
+    def encode(self, keyframe=False):
+        """Wire bytes for this frame.
+
+        Binary frames are re-encoded as received (a delta stays a delta
+        unless keyframe=True); CSV frames become a CSV line again. A status
+        frame stays a status frame, followed by a keyframe if keyframe=True.
+        """
+        if self.rows is None:
+            return encode_csv(self.states())
+        if self.descriptor is not None:
+            return encode_descriptor(self.descriptor, self.seq)
+        if self.touches is not None:
+            return encode_touches(self.touches, self.rows, self.cols,
+                                  self.seq,
+                                  self.frame_type == TYPE_TOUCH_SNAPSHOT)
+        timestamp = None
+        if self.device_us is not None:
+            timestamp = (self.device_us, self.scan_us)
+        if self.frame_type == TYPE_STATUS:
+            status = encode_status(self.rows, self.cols, self.scan_hz,
+                                   self.scan_mode, self.seq, timestamp,
+                                   self.debounce)
+            if not keyframe:
+                return status
+            return status + self._encode_grid(True, timestamp)
+        return self._encode_grid(keyframe, timestamp)
+
+    def __repr__(self):
+        return (f"Frame(type={self.frame_type}, seq={self.seq}, "
+                f"rows={self.rows}, cols={self.cols}, active={self.active()})")
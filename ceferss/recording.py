@@ -0,0 +1,437 @@
+"""
+Recording and replay of raw sensor streams.
+
+A recording holds the bytes exactly as they came off the serial port or
+the forwarder socket (binary frames, CSV lines and any line noise), each
+chunk stamped with its receive time, so a replay goes through the same
+FrameReader path as live data.
+
+File layout (.cfr), all integers little-endian:
+
+    header   0   4   magic b"CFRS"
+             4   1   format version (1)
+             5   1   reserved
+             6   2   source name length n
+             8   8   start time, unix seconds (float64)
+            16   n   source name, UTF-8 (port or tcp:host:port)
+
+    records, back to back:
+             0   4   microseconds since the previous record
+             4   2   chunk length m (longer reads are split)
+             6   m   raw bytes
+
+    footer, appended by Recorder.close():
+                     index entries: (record offset, t_us) as 2 x uint64,
+                     one per INDEX_INTERVAL_US of recording
+             -32 8   end of the records
+             -24 8   record count
+             -16 8   duration in microseconds
+              -8 4   index entry count
+              -4 4   magic b"CFIX"
+
+The file is only ever appended to. If the footer is missing (recorder
+killed), Recording rebuilds the index by walking the record headers and
+ignores a truncated last record. Recordings are read through mmap, so
+seeking is a bisect on the index plus a short walk, and chunks are handed
+out as memoryviews without copying.
+
+Usage:
+  python3 -m ceferss.recording record out.cfr [serial_port | tcp:host:port]
+  python3 -m ceferss.recording info in.cfr
+  python3 -m ceferss.recording replay in.cfr [speed | max]
+
+Host scripts that take a serial port also accept a .cfr path in its
+place (see ReplayPort), optionally followed by a speed.
+"""
+
+import asyncio
+import bisect
+import mmap
+import socket
+import struct
+import sys
+import time
+
+import serial
+
+from .ports import find_serial_port
+from .protocol import REQUEST_KEYFRAME
+from .stream import FrameReader
+
+SUFFIX = ".cfr"
+MAGIC = b"CFRS"
+INDEX_MAGIC = b"CFIX"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sBxHd")
+RECORD = struct.Struct("<IH")
+INDEX_ENTRY = struct.Struct("<QQ")
+FOOTER = struct.Struct("<QQQI4s")
+
+MAX_CHUNK = 0xFFFF
+MAX_GAP_US = 0xFFFFFFFF
+INDEX_INTERVAL_US = 100_000
+
+BAUD_RATE = 115200
+
+
+def is_recording(path):
+    """True if `path` names a recording rather than a port."""
+    return str(path).endswith(SUFFIX)
+
+
+def parse_speed(text):
+    """'2', '2x' or '0.5' -> float; 'max' -> None (as fast as possible)."""
+    if text is None:
+        return 1.0
+    text = text.strip().lower()
+    if text == "max":
+        return None
+    speed = float(text.rstrip("x"))
+    if speed <= 0:
+        raise ValueError(f"speed must be positive, got {text}")
+    return speed
+
+
+class Recorder:
+    """Appends timestamped raw chunks to a new recording file."""
+
+    def __init__(self, path, source=""):
+        self._file = open(path, "wb")
+        name = source.encode("utf-8")
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(name),
+                                     time.time()))
+        self._file.write(name)
+        self._offset = HEADER.size + len(name)
+        self._start_ns = time.perf_counter_ns()
+        self._last_us = 0
+        self._next_index_us = 0
+        self.index = []
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, data):
+        """Record one chunk of received bytes, stamped with the time now."""
+        t_us = (time.perf_counter_ns() - self._start_ns) // 1000
+        view = memoryview(data)
+        gap = t_us - self._last_us
+        # Gaps over ~71 minutes become empty records
+        while gap > MAX_GAP_US:
+            self._append(MAX_GAP_US, b"")
+            gap -= MAX_GAP_US
+        for pos in range(0, len(view), MAX_CHUNK):
+            if t_us >= self._next_index_us:
+                self.index.append((self._offset, t_us))
+                self._next_index_us = t_us + INDEX_INTERVAL_US
+                # Bounds what a crash can lose to one index interval
+                self._file.flush()
+            self._append(gap, view[pos:pos + MAX_CHUNK])
+            gap = 0
+        self._last_us = t_us
+        self.bytes += len(view)
+
+    def _append(self, gap, chunk):
+        self._file.write(RECORD.pack(gap, len(chunk)))
+        self._file.write(chunk)
+        self._offset += RECORD.size + len(chunk)
+        self.records += 1
+
+    def close(self):
+        """Write the index footer and close the file."""
+        if self._file.closed:
+            return
+        for entry in self.index:
+            self._file.write(INDEX_ENTRY.pack(*entry))
+        self._file.write(FOOTER.pack(self._offset, self.records,
+                                     self._last_us, len(self.index),
+                                     INDEX_MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """Read-only, memory-mapped view of a recording file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path}: not a recording")
+        magic, version, name_len, self.start_time = HEADER.unpack_from(
+            self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path}: not a version {FORMAT_VERSION} "
+                             f"recording")
+        self.source = bytes(self._view[HEADER.size:HEADER.size + name_len]
+                            ).decode("utf-8", "replace")
+        self.data_start = HEADER.size + name_len
+        if not self._load_footer():
+            self._rebuild_index()
+        self._index_times = [t for _, t in self.index]
+
+    def _load_footer(self):
+        size = len(self._map)
+        if size < self.data_start + FOOTER.size:
+            return False
+        data_end, records, duration, entries, magic = FOOTER.unpack_from(
+            self._map, size - FOOTER.size)
+        index_start = size - FOOTER.size - entries * INDEX_ENTRY.size
+        if magic != INDEX_MAGIC or data_end != index_start:
+            return False
+        self.data_end = data_end
+        self.records = records
+        self.duration_us = duration
+        self.index = [INDEX_ENTRY.unpack_from(self._map, index_start + i
+                                              * INDEX_ENTRY.size)
+                      for i in range(entries)]
+        return True
+
+    def _rebuild_index(self):
+        self.index = []
+        self.records = 0
+        buf = self._map
+        size = len(buf)
+        offset = self.data_start
+        t_us = 0
+        next_index_us = 0
+        while offset + RECORD.size <= size:
+            gap, length = RECORD.unpack_from(buf, offset)
+            if offset + RECORD.size + length > size:
+                break
+            t_us += gap
+            if length and t_us >= next_index_us:
+                self.index.append((offset, t_us))
+                next_index_us = t_us + INDEX_INTERVAL_US
+            offset += RECORD.size + length
+            self.records += 1
+        self.data_end = offset
+        self.duration_us = t_us
+
+    def seek(self, t_us):
+        """(record offset, record time) of the last index entry <= t_us."""
+        i = bisect.bisect_right(self._index_times, t_us) - 1
+        if i < 0:
+            return self.data_start, 0
+        return self.index[i]
+
+    def chunks(self, start_us=0):
+        """Yield (t_us, memoryview) for every chunk from start_us onward."""
+        offset, t_us = self.seek(start_us)
+        buf = self._map
+        view = self._view
+        end = self.data_end
+        unpack = RECORD.unpack_from
+        if offset < end and offset != self.data_start:
+            # Index times include the record's own gap
+            t_us -= unpack(buf, offset)[0]
+        while offset < end:
+            gap, length = unpack(buf, offset)
+            t_us += gap
+            offset += RECORD.size
+            if length and t_us >= start_us:
+                yield t_us, view[offset:offset + length]
+            offset += length
+
+    def close(self):
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # Chunks still referenced; the map goes with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Pacer:
+    """Maps recording time to wall time at a given speed (None = max)."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self._origin = None
+
+    def delay(self, t_us):
+        """Seconds to wait before the chunk stamped t_us is due."""
+        if self.speed is None:
+            return 0
+        now = time.perf_counter()
+        if self._origin is None:
+            self._origin = now - t_us / 1e6 / self.speed
+        return self._origin + t_us / 1e6 / self.speed - now
+
+
+def replay(recording, speed=1.0, start_us=0, reader=None):
+    """Yield the frames of a recording, paced at `speed` x real time."""
+    if reader is None:
+        reader = FrameReader()
+    pacer = _Pacer(speed)
+    for t_us, chunk in recording.chunks(start_us):
+        delay = pacer.delay(t_us)
+        if delay > 0:
+            time.sleep(delay)
+        yield from reader.feed(chunk)
+
+
+async def pump_replay(recording, on_frame, speed=1.0, start_us=0):
+    """Like stream.pump_serial, but fed from a recording on the event loop.
+
+    Returns when the recording ends.
+    """
+    reader = FrameReader()
+    pacer = _Pacer(speed)
+    for t_us, chunk in recording.chunks(start_us):
+        # Yield to the loop even at max speed so clients get served
+        await asyncio.sleep(max(pacer.delay(t_us), 0))
+        for frame in reader.feed(chunk):
+            on_frame(frame)
+
+
+class ReplayPort:
+    """Stand-in for serial.Serial that plays back a recording.
+
+    Supports what the host scripts use (in_waiting, readinto, read,
+    write, flush, close). Reads block until the next chunk is due and
+    raise serial.SerialException at the end of the recording, just like
+    an unplugged port. Keyframe requests are accepted and ignored.
+    """
+
+    def __init__(self, path, speed=1.0, start_us=0):
+        self.recording = Recording(path)
+        self.port = path
+        self.timeout = None
+        self.is_open = True
+        self._pacer = _Pacer(speed)
+        self._chunks = self.recording.chunks(start_us)
+        self._next = None
+        self._pending = b""
+
+    def _advance(self, block):
+        if self._pending:
+            return True
+        if self._next is None:
+            self._next = next(self._chunks, None)
+            if self._next is None:
+                return False
+        t_us, chunk = self._next
+        delay = self._pacer.delay(t_us)
+        if delay > 0:
+            if not block:
+                return False
+            time.sleep(delay)
+        self._pending = chunk
+        self._next = None
+        return True
+
+    @property
+    def in_waiting(self):
+        self._advance(False)
+        return len(self._pending)
+
+    def readinto(self, buf):
+        if not self._advance(True):
+            raise serial.SerialException("end of recording")
+        count = min(len(buf), len(self._pending))
+        buf[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
+
+    def read(self, size=1):
+        buf = bytearray(size)
+        return bytes(buf[:self.readinto(buf)])
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self._chunks.close()
+        self._pending = b""
+        self._next = None
+        self.recording.close()
+
+
+# --- Command line ---
+
+def record(path, source):
+    """Record `source` (serial port or tcp:host:port) until Ctrl+C."""
+    with Recorder(path, source) as recorder:
+        try:
+            if source.startswith("tcp:"):
+                host, port = source[4:].rsplit(":", 1)
+                sock = socket.create_connection((host, int(port)))
+                sock.sendall(REQUEST_KEYFRAME)
+                buf = bytearray(4096)
+                while True:
+                    count = sock.recv_into(buf)
+                    if not count:
+                        break
+                    recorder.write(memoryview(buf)[:count])
+            else:
+                ser = serial.Serial(source, BAUD_RATE, timeout=1)
+                ser.write(REQUEST_KEYFRAME)
+                while True:
+                    data = ser.read(ser.in_waiting or 1)
+                    if data:
+                        recorder.write(data)
+        except KeyboardInterrupt:
+            pass
+        print(f"\nRecorded {recorder.records} chunks, {recorder.bytes} bytes "
+              f"to {path}")
+
+
+def info(path):
+    with Recording(path) as recording:
+        frames = sum(1 for _ in replay(recording, speed=None))
+        print(f"{path}: {recording.source or 'unknown source'}, "
+              f"started {time.ctime(recording.start_time)}")
+        print(f"  {recording.duration_us / 1e6:.1f} s, {recording.records} "
+              f"chunks, {frames} frames, {len(recording.index)} index entries")
+
+
+def replay_stats(path, speed):
+    """Replay without a consumer and report the decode rate."""
+    with Recording(path) as recording:
+        start = time.perf_counter()
+        frames = sum(1 for _ in replay(recording, speed))
+        elapsed = time.perf_counter() - start
+        print(f"{frames} frames in {elapsed:.3f} s "
+              f"({frames / elapsed if elapsed else 0:.0f} frames/s)")
+
+
+def main():
+    usage = __doc__[__doc__.index("Usage:"):__doc__.index("Host scripts")]
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("record", "info", "replay"):
+        print(usage.rstrip())
+        sys.exit(1)
+    command, path = args[0], args[1]
+    if command == "record":
+        source = args[2] if len(args) > 2 else find_serial_port()
+        if source is None:
+            print("Error: No sensor serial port found.")
+            sys.exit(1)
+        record(path, source)
+    elif command == "info":
+        info(path)
+    else:
+        replay_stats(path, parse_speed(args[2] if len(args) > 2 else "max"))
+
+
+if __name__ == "__main__":
+    main()
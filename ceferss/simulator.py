@@ -0,0 +1,583 @@
+"""
+Hardware-free scanner simulator on a pseudo-terminal.
+
+Opens a pty and writes what the real firmware writes to its serial port,
+so every host script can run against the printed device path instead of
+/dev/ttyACM0 or /dev/ttyUSB0. The profiles mirror the firmware defaults
+(scan rate active / idle, keyframe every n scans):
+
+    pico_grid     pico/pico_grid.py                   6x5  200 / 10 Hz  50
+    data_sender   pico/basic_scanner/data_sender.py   9x9   50 / 5 Hz   50
+    nano_grid     nano/nano_grid/nano_grid.ino        5x5  100 / 5 Hz   20
+
+Binary frames (keyframes plus deltas on change, a keyframe on 'K' from
+the host) are the default; --csv switches to the legacy lines, sent only
+on change (and with every keyframe) for pico_grid and every scan for
+the others. --analog sends 10-bit ADC readings like nano_grid.ino with
+ANALOG_FRAMES (touched cells read lower the deeper they are pressed).
+Grid size and rate can be raised far past the hardware
+(e.g. --rows 32 --cols 32 --rate max) to load-test the host side.
+
+The touches come from fingers moving over the grid, each pressing the
+cells within --radius of it, bouncing off the edges and lifting and
+landing again at random. --noise flips each cell with that probability
+per scan. --bounce makes a cell chatter for that many scans around each
+real transition, like a contact settling. --debounce filters that the
+way DEBOUNCE_SCANS does in the Pico firmware (ceferss.debounce), and
+reports the depth in status frames.
+
+Like the firmware, the simulator answers '?' with a descriptor frame
+(grid, spare rows, rate, encodings and the strip geometry of the matching
+designs_info.txt preset) and switches encoding on the select commands
+(ceferss.handshake).
+
+--idle-rate mimics ADAPTIVE_RATE in the firmware (on by default, at the
+profile's IDLE_HZ): the scan rate drops from --rate to --idle-rate once
+nothing has been touched for --idle-after seconds and comes back on the
+next touch, with a status frame reporting each switch (and following
+each keyframe). --idle-rate 0 scans at --rate throughout.
+
+Usage: python3 -m ceferss.simulator [profile] [options]   (--help for all)
+"""
+
+import argparse
+import math
+import os
+import random
+import select
+import time
+import tty
+from array import array
+
+import numpy as np
+
+from .debounce import Debouncer
+from .designs import find_preset
+from .protocol import (
+    ENC_ANALOG,
+    ENC_CSV,
+    ENC_DELTA,
+    ENC_KEYFRAMES,
+    MODE_ACTIVE,
+    MODE_IDLE,
+    CRC_SIZE,
+    HEADER_SIZE,
+    REQUEST_DESCRIPTOR,
+    REQUEST_KEYFRAME,
+    SELECT_ENCODING,
+    THRESHOLD_SIZE,
+    TYPE_DELTA,
+    TYPE_KEYFRAME,
+    Descriptor,
+    encode_analog_delta,
+    encode_analog_keyframe,
+    encode_descriptor,
+    encode_frame,
+    encode_status,
+    index_size,
+    packed_size,
+)
+
+PROFILES = {
+    "pico_grid": {"rows": 6, "cols": 5, "rate": 200.0, "idle_rate": 10.0,
+                  "keyframe_interval": 50, "csv_every_scan": False,
+                  "first_row": 1},
+    "data_sender": {"rows": 9, "cols": 9, "rate": 50.0, "idle_rate": 5.0,
+                    "keyframe_interval": 50, "csv_every_scan": True,
+                    "first_row": 0},
+    "nano_grid": {"rows": 5, "cols": 5, "rate": 100.0, "idle_rate": 5.0,
+                  "keyframe_interval": 20, "csv_every_scan": True,
+                  "first_row": 0},
+}
+
+# Reported in descriptor frames, as FIRMWARE_VERSION in the firmware
+FIRMWARE_VERSION = (1, 0)
+
+# Simulated scan time per row, reported in timestamped frames
+ROW_SCAN_US = 60
+# Rate reported (and --debounce sized for) with --rate max
+DEBOUNCE_MAX_HZ = 1000
+
+# Analog readings, as nano_grid.ino sees them
+ANALOG_OPEN = 1015          # untouched cell
+ANALOG_PRESSED = 700        # deepest press
+ANALOG_NOISE = 3            # +- counts per scan
+ANALOG_DEADBAND = 4
+ANALOG_THRESHOLD = 961
+
+
+class Finger:
+    """One synthetic touch moving in a straight line between bounces."""
+
+    def __init__(self, rows, cols, rng):
+        self.rows = rows
+        self.cols = cols
+        self.rng = rng
+        self.down = False
+        self.timer = rng.uniform(0, 0.5)
+        self._land()
+
+    def _land(self):
+        rng = self.rng
+        self.y = rng.uniform(0, self.rows - 1)
+        self.x = rng.uniform(0, self.cols - 1)
+        angle = rng.uniform(0, 2 * math.pi)
+        speed = rng.uniform(1.0, 6.0)    # cells per second
+        self.vy = speed * math.sin(angle)
+        self.vx = speed * math.cos(angle)
+
+    def step(self, dt):
+        self.timer -= dt
+        if self.timer <= 0:
+            self.down = not self.down
+            if self.down:
+                self._land()
+                self.timer = self.rng.uniform(0.3, 2.0)
+            else:
+                self.timer = self.rng.uniform(0.2, 1.0)
+        if not self.down:
+            return
+        self.y += self.vy * dt
+        self.x += self.vx * dt
+        # Reflect off the grid edges
+        if not 0 <= self.y <= self.rows - 1:
+            self.vy = -self.vy
+            self.y = min(max(self.y, 0), self.rows - 1)
+        if not 0 <= self.x <= self.cols - 1:
+            self.vx = -self.vx
+            self.x = min(max(self.x, 0), self.cols - 1)
+
+
+class TouchModel:
+    """Produces successive grid bitsets (bit i set = cell i touched)."""
+
+    def __init__(self, rows, cols, fingers=2, radius=0.8, noise=0.0,
+                 bounce=0, seed=None):
+        self.rows = rows
+        self.cols = cols
+        self.count = rows * cols
+        self.radius = radius
+        self.noise = noise
+        self.bounce = bounce
+        self.rng = random.Random(seed)
+        self.fingers = [Finger(rows, cols, self.rng) for _ in range(fingers)]
+        self.clean = 0
+        # Scans of chatter left per cell after a transition
+        self._settling = array("B", bytes(self.count))
+        self._settling_cells = set()
+        self._log_keep = math.log(1 - noise) if 0 < noise < 1 else None
+
+    def _pressed(self):
+        bits = 0
+        r2 = self.radius * self.radius
+        reach = int(self.radius)
+        for finger in self.fingers:
+            if not finger.down:
+                continue
+            cy = round(finger.y)
+            cx = round(finger.x)
+            for r in range(max(cy - reach - 1, 0),
+                           min(cy + reach + 2, self.rows)):
+                for c in range(max(cx - reach - 1, 0),
+                               min(cx + reach + 2, self.cols)):
+                    if (r - finger.y) ** 2 + (c - finger.x) ** 2 <= r2:
+                        bits |= 1 << (r * self.cols + c)
+        return bits
+
+    def _noise_mask(self):
+        if self.noise <= 0:
+            return 0
+        if self.noise >= 1:
+            return (1 << self.count) - 1
+        # Geometric skips: cost scales with the flips, not the cells
+        mask = 0
+        index = -1
+        rng = self.rng
+        while True:
+            index += int(math.log(1.0 - rng.random()) / self._log_keep) + 1
+            if index >= self.count:
+                return mask
+            mask |= 1 << index
+
+    def step(self, dt):
+        """Advance by dt seconds and return the scanned bitset."""
+        for finger in self.fingers:
+            finger.step(dt)
+        clean = self._pressed()
+        bits = clean
+        if self.bounce:
+            changed = clean ^ self.clean
+            while changed:
+                low = changed & -changed
+                index = low.bit_length() - 1
+                changed ^= low
+                self._settling[index] = self.bounce
+                self._settling_cells.add(index)
+            for index in list(self._settling_cells):
+                if self.rng.random() < 0.5:
+                    bits ^= 1 << index
+                self._settling[index] -= 1
+                if not self._settling[index]:
+                    self._settling_cells.discard(index)
+        self.clean = clean
+        return bits ^ self._noise_mask()
+
+
+class FrameEncoder:
+    """Turns scanned bitsets into the firmware's wire output."""
+
+    def __init__(self, rows, cols, binary=True, delta=True,
+                 keyframe_interval=50, csv_every_scan=True,
+                 timestamps=False, analog=False, seed=None, first_row=0,
+                 width=0.0, gap=0.0):
+        self.rows = rows
+        self.cols = cols
+        self.count = rows * cols
+        self.binary = binary
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.csv_every_scan = csv_every_scan
+        self.timestamps = timestamps
+        self.seq = 0
+        self.sent = None
+        self.scans_since_keyframe = keyframe_interval
+        self.payload_len = (self.count + 7) // 8
+        self.index_size = index_size(self.count)
+        # Reported after each keyframe once set by status()
+        self.scan_hz = None
+        self.scan_mode = None
+        self.debounce = None
+        self.analog = analog
+        self._rng = np.random.default_rng(seed)
+        self._depth = np.zeros(self.count, dtype=np.float32)
+        self._sent_values = None
+        # Descriptor: spare leading rows and strip geometry, inches
+        self.first_row = first_row
+        self.width = width
+        self.gap = gap
+        if analog:
+            self.encodings = ENC_ANALOG | ENC_CSV
+        else:
+            self.encodings = ENC_DELTA | ENC_KEYFRAMES | ENC_CSV
+
+    @property
+    def encoding(self):
+        """ENC_* in use."""
+        if not self.binary:
+            return ENC_CSV
+        if self.analog:
+            return ENC_ANALOG
+        return ENC_DELTA if self.delta else ENC_KEYFRAMES
+
+    def descriptor(self, scan_hz):
+        """Descriptor frame, out of sequence like a status frame."""
+        return encode_descriptor(Descriptor(
+            self.rows, self.cols, round(scan_hz), self.encodings,
+            self.encoding, FIRMWARE_VERSION, self.first_row, self.width,
+            self.gap), self.seq)
+
+    def command(self, data, scan_hz):
+        """Act on bytes from the host: (bytes to send now, keyframe due).
+
+        A select command for a supported encoding switches to it and is
+        answered with a descriptor and a keyframe, as in the firmware.
+        """
+        keyframe = REQUEST_KEYFRAME in data
+        reply = REQUEST_DESCRIPTOR in data
+        for encoding, request in SELECT_ENCODING.items():
+            if request in data and self.encodings & encoding:
+                self.binary = encoding != ENC_CSV
+                if encoding != ENC_ANALOG:
+                    self.delta = encoding == ENC_DELTA
+                self.sent = None
+                keyframe = reply = True
+        return (self.descriptor(scan_hz) if reply else b""), keyframe
+
+    def _csv(self, bits):
+        # '0' = touch; cell 0 first
+        digits = format(bits, f"0{self.count}b")[::-1]
+        return (",".join(digits.translate(_BITS_TO_CSV)) + "\n").encode()
+
+    def _frame(self, frame_type, payload, timestamp):
+        data = encode_frame(frame_type, self.seq, self.rows, self.cols,
+                            payload, timestamp)
+        self.seq = (self.seq + 1) & 0xFF
+        return data
+
+    def status(self, scan_hz, mode):
+        """Status frame for a new scan rate (empty for CSV)."""
+        self.scan_hz = scan_hz
+        self.scan_mode = mode
+        if not self.binary:
+            return b""
+        # Out of sequence: repeats the next seq without taking it
+        return encode_status(self.rows, self.cols, round(scan_hz), mode,
+                             self.seq, debounce=self.debounce)
+
+    def encode(self, bits, keyframe_requested=False):
+        """Bytes the scanner writes after this scan (may be empty)."""
+        self.scans_since_keyframe += 1
+        keyframe = (keyframe_requested
+                    or self.scans_since_keyframe >= self.keyframe_interval)
+        if keyframe:
+            self.scans_since_keyframe = 0
+        changed = bits != self.sent
+        if not self.binary:
+            if keyframe or changed or self.csv_every_scan:
+                self.sent = bits
+                return self._csv(bits)
+            return b""
+
+        timestamp = None
+        if self.timestamps:
+            start = time.perf_counter_ns() // 1000
+            timestamp = (start, ROW_SCAN_US * self.rows)
+        if self.analog:
+            data = self._analog(bits, keyframe, timestamp)
+        elif keyframe or not self.delta or self.sent is None:
+            self.sent = bits
+            data = self._frame(TYPE_KEYFRAME,
+                               bits.to_bytes(self.payload_len, "little"),
+                               timestamp)
+        else:
+            return self._delta(bits, changed, timestamp)
+        if keyframe and self.scan_hz is not None:
+            data += self.status(self.scan_hz, self.scan_mode)
+        return data
+
+    def _delta(self, bits, changed, timestamp):
+        if not changed:
+            return b""
+        flipped = bits ^ self.sent
+        self.sent = bits
+        if flipped.bit_count() * self.index_size > self.payload_len:
+            # Same fallback as the firmware: a keyframe is smaller
+            return self._frame(TYPE_KEYFRAME,
+                               bits.to_bytes(self.payload_len, "little"),
+                               timestamp)
+        payload = bytearray()
+        while flipped:
+            low = flipped & -flipped
+            payload += (low.bit_length() - 1).to_bytes(self.index_size,
+                                                       "little")
+            flipped ^= low
+        return self._frame(TYPE_DELTA, payload, timestamp)
+
+    def _analog(self, bits, keyframe, timestamp):
+        # Pressed cells sink towards full depth, released ones recover
+        touched = np.unpackbits(
+            np.frombuffer(bits.to_bytes(self.payload_len, "little"),
+                          dtype=np.uint8),
+            count=self.count, bitorder="little").astype(bool)
+        self._depth += (touched - self._depth) * 0.3
+        values = (ANALOG_OPEN - self._depth * (ANALOG_OPEN - ANALOG_PRESSED)
+                  + self._rng.integers(-ANALOG_NOISE, ANALOG_NOISE + 1,
+                                       self.count))
+        values = np.clip(values, 0, 1023).astype(np.uint16)
+        sent = self._sent_values
+        if keyframe or not self.delta or sent is None:
+            self._sent_values = values
+            data = encode_analog_keyframe(values, ANALOG_THRESHOLD, self.rows,
+                                          self.cols, self.seq, timestamp)
+        else:
+            moved = np.flatnonzero(
+                np.abs(values.astype(np.int32) - sent) > ANALOG_DEADBAND)
+            if not len(moved):
+                return b""
+            sent = sent.copy()
+            sent[moved] = values[moved]
+            self._sent_values = sent
+            data = encode_analog_delta(sent, moved, self.rows, self.cols,
+                                       self.seq, timestamp)
+            keyframe_size = (HEADER_SIZE + THRESHOLD_SIZE + CRC_SIZE
+                             + packed_size(self.count))
+            if len(data) >= keyframe_size:
+                # Same fallback as the firmware: a keyframe is smaller
+                self._sent_values = values
+                data = encode_analog_keyframe(values, ANALOG_THRESHOLD,
+                                              self.rows, self.cols, self.seq,
+                                              timestamp)
+        self.seq = (self.seq + 1) & 0xFF
+        return data
+
+
+_BITS_TO_CSV = str.maketrans("01", "10")
+
+
+def open_pty(link=None):
+    """Open a raw pty; returns (master fd, slave path)."""
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if link:
+        if os.path.islink(link):
+            os.unlink(link)
+        os.symlink(path, link)
+        path = link
+    # Keep the slave open so the pty survives clients reconnecting
+    return master, path
+
+
+def run(master, model, encoder, rate, duration=None, idle_rate=None,
+        idle_after=2.0, debouncer=None):
+    """Scan and write frames to the pty until duration (or forever).
+
+    With idle_rate (and a rate), scan at idle_rate after idle_after
+    seconds without a touch, like the firmware's ADAPTIVE_RATE. With a
+    Debouncer, every scan goes through it before encoding.
+    """
+    interval = 1.0 / rate if rate else 0
+    if not (idle_rate and rate):
+        idle_rate = None
+    if debouncer is not None:
+        encoder.debounce = debouncer.limit(rate or DEBOUNCE_MAX_HZ)
+    if idle_rate or debouncer is not None:
+        os.write(master, encoder.status(rate or DEBOUNCE_MAX_HZ, MODE_ACTIVE))
+    # Touch motion advances at the nominal rate even when running flat out
+    dt = interval or 1.0 / 50
+    start = time.perf_counter()
+    next_scan = start
+    frames = 0
+    sent = 0
+    last_report = start
+    last_touch = start
+    while duration is None or time.perf_counter() - start < duration:
+        requested = False
+        while select.select([master], [], [], 0)[0]:
+            reply, keyframe = encoder.command(
+                os.read(master, 64),
+                encoder.scan_hz or rate or DEBOUNCE_MAX_HZ)
+            if reply:
+                os.write(master, reply)
+            requested = requested or keyframe
+        # Touches move in real time, whatever the current scan rate
+        bits = model.step(interval or dt)
+        if debouncer is not None:
+            bits = debouncer.scan(bits)
+        data = encoder.encode(bits, requested)
+        if idle_rate:
+            now = time.perf_counter()
+            if bits:
+                last_touch = now
+                if encoder.scan_mode != MODE_ACTIVE:
+                    if debouncer is not None:
+                        encoder.debounce = debouncer.limit(rate)
+                    data += encoder.status(rate, MODE_ACTIVE)
+                    interval = 1.0 / rate
+            elif (encoder.scan_mode == MODE_ACTIVE
+                  and now - last_touch >= idle_after):
+                if debouncer is not None:
+                    encoder.debounce = debouncer.limit(idle_rate)
+                data += encoder.status(idle_rate, MODE_IDLE)
+                interval = 1.0 / idle_rate
+        if data:
+            os.write(master, data)
+            frames += 1
+            sent += len(data)
+        if interval:
+            next_scan += interval
+            delay = next_scan - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_scan = time.perf_counter()
+        now = time.perf_counter()
+        if now - last_report >= 5:
+            print(f"{frames / (now - last_report):.0f} frames/s, "
+                  f"{sent / (now - last_report) / 1024:.1f} KiB/s")
+            frames = sent = 0
+            last_report = now
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python3 -m ceferss.simulator",
+        description="Emit simulated scanner output on a pseudo-terminal.")
+    parser.add_argument("profile", nargs="?", default="pico_grid",
+                        choices=sorted(PROFILES))
+    parser.add_argument("--rows", type=int, help="grid rows (max 255)")
+    parser.add_argument("--cols", type=int, help="grid columns (max 255)")
+    parser.add_argument("--rate", help="scans per second, or 'max'")
+    parser.add_argument("--csv", action="store_true",
+                        help="legacy CSV lines instead of binary frames")
+    parser.add_argument("--no-delta", action="store_true",
+                        help="send a keyframe every scan")
+    parser.add_argument("--timestamps", action="store_true",
+                        help="stamp binary frames like TIMESTAMPS = True")
+    parser.add_argument("--analog", action="store_true",
+                        help="10-bit ADC readings like ANALOG_FRAMES = true")
+    parser.add_argument("--fingers", type=int, default=2)
+    parser.add_argument("--radius", type=float, default=0.8,
+                        help="finger radius in cells")
+    parser.add_argument("--noise", type=float, default=0.0,
+                        help="probability of a cell flipping per scan")
+    parser.add_argument("--bounce", type=int, default=0,
+                        help="scans of chatter around each transition")
+    parser.add_argument("--debounce", type=int, default=1,
+                        help="scans a change must hold before it is sent")
+    parser.add_argument("--max-debounce-ms", type=float, default=25,
+                        help="cap on the delay --debounce adds")
+    parser.add_argument("--idle-rate", type=float,
+                        help="adaptive rate: scans per second when idle "
+                        "(default: the profile's IDLE_HZ, 0 = off)")
+    parser.add_argument("--idle-after", type=float, default=2.0,
+                        help="seconds without a touch before idling")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--duration", type=float,
+                        help="stop after this many seconds")
+    parser.add_argument("--link", help="also expose the pty at this path")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    rows = args.rows or profile["rows"]
+    cols = args.cols or profile["cols"]
+    if not (0 < rows < 256 and 0 < cols < 256):
+        parser.error("rows and cols must be 1..255")
+    if not 0 <= args.bounce < 256:
+        parser.error("bounce must be 0..255")
+    if not 0 < args.debounce < 256:
+        parser.error("debounce must be 1..255")
+    idle_rate = args.idle_rate
+    if idle_rate is None:
+        idle_rate = profile["idle_rate"]
+    if args.rate is None:
+        rate = profile["rate"]
+    elif args.rate == "max":
+        rate = None
+    else:
+        rate = float(args.rate)
+
+    # The fabric is the rows after the spare ones, as on the hardware
+    first_row = min(profile["first_row"], rows - 1)
+    geometry = {"first_row": first_row}
+    preset = find_preset(rows - first_row, cols)
+    if preset is not None:
+        geometry["width"] = preset["width"]
+        geometry["gap"] = preset["gap"]
+    model = TouchModel(rows, cols, args.fingers, args.radius, args.noise,
+                       args.bounce, args.seed)
+    encoder = FrameEncoder(rows, cols, binary=not args.csv,
+                           delta=not args.no_delta,
+                           keyframe_interval=profile["keyframe_interval"],
+                           csv_every_scan=profile["csv_every_scan"],
+                           timestamps=args.timestamps, analog=args.analog,
+                           seed=args.seed, **geometry)
+    debouncer = None
+    if args.debounce > 1:
+        debouncer = Debouncer(rows, cols, args.debounce, args.max_debounce_ms)
+    master, path = open_pty(args.link)
+    print(f"Simulating {args.profile} ({rows}x{cols}, "
+          f"{'CSV' if args.csv else 'binary'}, "
+          f"{'max' if rate is None else rate} Hz) on {path}")
+    try:
+        run(master, model, encoder, rate, args.duration, idle_rate,
+            args.idle_after, debouncer)
+    except KeyboardInterrupt:
+        print("\nSimulator stopped.")
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+
+
+if __name__ == "__main__":
+    main()
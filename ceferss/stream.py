@@ -0,0 +1,423 @@
+"""
+Buffered grid frame reader shared by every host consumer.
+
+FrameReader owns one preallocated bytearray and a memoryview over it.
+Bytes from the serial port or a socket are read straight into the free
+tail of that buffer, frames are parsed in place, and only the unconsumed
+remainder (less than one frame) is moved back to the front when the tail
+runs out. Parsing cost is therefore linear in the bytes received, however
+the stream is chunked.
+
+Typical use:
+
+    reader = FrameReader()
+    while True:
+        for frame in reader.read_serial(ser):
+            ...
+        if reader.resync_needed:
+            ser.write(REQUEST_KEYFRAME)
+            reader.resync_needed = False
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+from .protocol import (
+    CRC_SIZE,
+    FLAG_TIMESTAMP,
+    HEADER_SIZE,
+    SYNC0,
+    SYNC1,
+    THRESHOLD_SIZE,
+    TIMESTAMP_SIZE,
+    TYPE_ANALOG_DELTA,
+    TYPE_ANALOG_KEYFRAME,
+    TYPE_DELTA,
+    TYPE_DESCRIPTOR,
+    TYPE_KEYFRAME,
+    TYPE_MASK,
+    TYPE_STATUS,
+    TYPE_TOUCH_EVENTS,
+    TYPE_TOUCH_SNAPSHOT,
+    VERSION,
+    REQUEST_KEYFRAME,
+    SPARSE_BITS,
+    STATUS_SIZE,
+    Frame,
+    crc8,
+    decode_descriptor,
+    decode_touches,
+    index_size,
+    mask_bits,
+    max_payload,
+    packed_size,
+    parse_csv_line,
+    touch_bits,
+    unpack_values,
+)
+
+DEFAULT_CAPACITY = 64 * 1024
+
+# Longest run of text kept while waiting for a newline or sync byte
+MAX_LINE = 4096
+
+
+class FrameReader:
+    """Incremental decoder for a byte stream of CSV lines and binary frames.
+
+    Resynchronises on the next sync byte or newline after garbage, a CRC
+    failure or a header of another version or with a length beyond the
+    largest payload of its type and grid (max_payload). Delta frames are
+    applied to the last full state, so every frame returned carries the
+    complete grid. When a delta cannot be applied (no keyframe yet, or
+    frames were lost) resync_needed is set; the caller may write
+    REQUEST_KEYFRAME to the port and clear it.
+
+    Every frame is stamped with recv_us, the time.perf_counter_ns() // 1000
+    at which the read that completed it returned, and with the scan rate
+    and debounce depth from the latest status frame (scan_hz, scan_mode,
+    debounce).
+
+    Analog frames are decoded into Frame.values (NumPy uint16, rows x
+    cols; never modified once returned, so consumers may keep it) with
+    bits derived from the scanner's touch threshold. Touch frames from
+    the forwarder come back with Frame.touches and no grid, descriptor
+    frames with Frame.descriptor and no grid; the latest descriptor is
+    also kept in `descriptor`.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.crc_errors = 0
+        self.invalid_headers = 0
+        self.invalid_lines = 0
+        self.last_seq = None
+        self.lost_frames = 0
+        self.dropped_deltas = 0
+        self.resync_needed = False
+        self._bits = None
+        self._count = None
+        self._values = None         # flat uint16, analog streams only
+        self._threshold = None
+        self.scan_hz = None
+        self.scan_mode = None
+        self.debounce = None
+        self.descriptor = None
+
+    # --- input ---
+
+    def _reserve(self, size):
+        """Return a writable view of at least `size` free bytes."""
+        if len(self._buf) - self._end < size:
+            pending = self._end - self._start
+            if pending + size > len(self._buf):
+                # A frame larger than the buffer: grow once
+                self._buf = self._buf[self._start:self._end] + bytearray(
+                    max(len(self._buf), size))
+                self._view = memoryview(self._buf)
+            else:
+                self._view[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def feed(self, data, recv_us=None):
+        """Add bytes to the stream and return the list of complete frames."""
+        size = len(data)
+        self._reserve(size)[:size] = data
+        self._end += size
+        if recv_us is None:
+            recv_us = time.perf_counter_ns() // 1000
+        return self._parse(recv_us)
+
+    def read_serial(self, ser):
+        """Read what the port has buffered and return the decoded frames.
+
+        Waits up to the port timeout for the first byte, so a reader loop
+        does not spin while the sensor is idle.
+        """
+        size = ser.in_waiting or 1
+        count = ser.readinto(self._reserve(size)[:size])
+        self._end += count or 0
+        return self._parse(time.perf_counter_ns() // 1000)
+
+    def read_socket(self, sock):
+        """Receive from a socket into the buffer; None once it is closed."""
+        count = sock.recv_into(self._reserve(4096))
+        if not count:
+            return None
+        self._end += count
+        return self._parse(time.perf_counter_ns() // 1000)
+
+    # --- parsing ---
+
+    def _parse(self, recv_us):
+        buf = self._buf
+        view = self._view
+        frames = []
+        pos = self._start
+        end = self._end
+        while pos < end:
+            if buf[pos] == SYNC0:
+                if end - pos < HEADER_SIZE:
+                    break
+                if buf[pos + 1] != SYNC1:
+                    pos += 1
+                    continue
+                length = buf[pos + 6] | (buf[pos + 7] << 8)
+                if (buf[pos + 2] >> 4 != VERSION
+                        or length > max_payload(buf[pos + 2] & 0xF,
+                                                buf[pos + 4], buf[pos + 5])):
+                    # Corrupt header: do not wait for a payload that long
+                    self.invalid_headers += 1
+                    pos += 1
+                    continue
+                frame_end = pos + HEADER_SIZE + length + CRC_SIZE
+                if frame_end > end:
+                    break
+                if crc8(buf, pos + 2, frame_end - 1) != buf[frame_end - 1]:
+                    self.crc_errors += 1
+                    pos += 1
+                    continue
+                frame = self._decode_binary(view, pos, length)
+                if frame is not None:
+                    frame.recv_us = recv_us
+                    frame.scan_hz = self.scan_hz
+                    frame.scan_mode = self.scan_mode
+                    frame.debounce = self.debounce
+                    frames.append(frame)
+                pos = frame_end
+            else:
+                newline = buf.find(b"\n", pos, end)
+                sync = buf.find(SYNC0, pos, end)
+                if newline < 0 and sync < 0:
+                    if end - pos > MAX_LINE:
+                        pos = end
+                    break
+                if sync >= 0 and (newline < 0 or sync < newline):
+                    # Junk (e.g. the tail of a frame we joined mid-way)
+                    pos = sync
+                    continue
+                line = view[pos:newline]
+                pos = newline + 1
+                if not bytes(line).strip():
+                    continue
+                parsed = parse_csv_line(line)
+                if parsed is None:
+                    self.invalid_lines += 1
+                else:
+                    count, bits = parsed
+                    frame = Frame(None, None, None, None, count, bits)
+                    frame.recv_us = recv_us
+                    frames.append(frame)
+        if pos >= end:
+            self._start = self._end = 0
+        else:
+            self._start = pos
+        return frames
+
+    def _decode_binary(self, view, pos, length):
+        header = view[pos + 2]
+        version = header >> 4
+        frame_type = header & TYPE_MASK
+        if version != VERSION:
+            return None
+        seq = view[pos + 3]
+        rows = view[pos + 4]
+        cols = view[pos + 5]
+        if frame_type == TYPE_STATUS:
+            return self._decode_status(view, pos, length, header, rows, cols)
+        if frame_type == TYPE_DESCRIPTOR:
+            # Out of sequence too
+            start = pos + HEADER_SIZE
+            if header & FLAG_TIMESTAMP:
+                start += TIMESTAMP_SIZE
+            descriptor = decode_descriptor(view[start:pos + HEADER_SIZE
+                                                + length], rows, cols)
+            if descriptor is None:
+                return None
+            self.descriptor = descriptor
+            frame = Frame(frame_type, seq, rows, cols, 0, 0)
+            frame.descriptor = descriptor
+            return frame
+        if frame_type in (TYPE_TOUCH_EVENTS, TYPE_TOUCH_SNAPSHOT):
+            # From the forwarder, outside the sequence like status frames
+            frame = Frame(frame_type, seq, rows, cols, 0, 0)
+            frame.touches = decode_touches(
+                view[pos + HEADER_SIZE:pos + HEADER_SIZE + length])
+            return frame
+        in_order = (self.last_seq is not None
+                    and seq == (self.last_seq + 1) & 0xFF)
+        if self.last_seq is not None:
+            self.lost_frames += (seq - self.last_seq - 1) & 0xFF
+        self.last_seq = seq
+        payload = view[pos + HEADER_SIZE:pos + HEADER_SIZE + length]
+        count = rows * cols
+        device_us = scan_us = None
+        if header & FLAG_TIMESTAMP:
+            if length < TIMESTAMP_SIZE:
+                return None
+            device_us = int.from_bytes(payload[:4], "little")
+            scan_us = payload[4] | (payload[5] << 8)
+            payload = payload[TIMESTAMP_SIZE:]
+            length -= TIMESTAMP_SIZE
+
+        if frame_type == TYPE_KEYFRAME:
+            if length * 8 < count:
+                return None
+            bits = int.from_bytes(payload, "little") & ((1 << count) - 1)
+            self._bits = bits
+            self._count = count
+            self._values = None
+            frame = Frame(frame_type, seq, rows, cols, count, bits)
+            frame.device_us = device_us
+            frame.scan_us = scan_us
+            return frame
+
+        if frame_type == TYPE_DELTA:
+            if not in_order or self._bits is None or self._count != count:
+                self.dropped_deltas += 1
+                self._bits = None
+                self.resync_needed = True
+                return None
+            width = index_size(count)
+            bits = self._bits
+            if length // width > SPARSE_BITS:
+                indices = np.frombuffer(payload, dtype="<u1" if width == 1
+                                        else "<u2", count=length // width)
+                indices = indices[indices < count]
+                # An index listed twice flips back, as one at a time
+                flips = np.bincount(indices, minlength=count) & 1
+                bits ^= mask_bits(flips)
+                changed = indices.tolist()
+            else:
+                changed = []
+                for i in range(0, length - width + 1, width):
+                    if width == 1:
+                        index = payload[i]
+                    else:
+                        index = payload[i] | (payload[i + 1] << 8)
+                    if index < count:
+                        bits ^= 1 << index
+                        changed.append(index)
+            self._bits = bits
+            frame = Frame(frame_type, seq, rows, cols, count, bits, changed)
+            frame.device_us = device_us
+            frame.scan_us = scan_us
+            return frame
+
+        if frame_type == TYPE_ANALOG_KEYFRAME:
+            if length < THRESHOLD_SIZE + packed_size(count):
+                return None
+            threshold = payload[0] | (payload[1] << 8)
+            values = unpack_values(payload[THRESHOLD_SIZE:], count)
+            frame = self._analog_frame(frame_type, seq, rows, cols, values,
+                                       threshold, None)
+        elif frame_type == TYPE_ANALOG_DELTA:
+            mask_size = (count + 7) // 8
+            if (not in_order or self._values is None or self._count != count
+                    or length < mask_size):
+                self.dropped_deltas += 1
+                self._bits = None
+                self._values = None
+                self.resync_needed = True
+                return None
+            mask = np.unpackbits(np.frombuffer(payload[:mask_size],
+                                               dtype=np.uint8),
+                                 count=count, bitorder="little").view(bool)
+            changed = np.flatnonzero(mask)
+            if length < mask_size + packed_size(len(changed)):
+                # Its values are lost: the next deltas would build on
+                # stale readings, so wait for a keyframe as above
+                self.dropped_deltas += 1
+                self._bits = None
+                self._values = None
+                self.resync_needed = True
+                return None
+            values = self._values.copy()
+            values[changed] = unpack_values(payload[mask_size:],
+                                            len(changed))
+            frame = self._analog_frame(frame_type, seq, rows, cols, values,
+                                       self._threshold, changed.tolist())
+        else:
+            return None
+        frame.device_us = device_us
+        frame.scan_us = scan_us
+        return frame
+
+    def _analog_frame(self, frame_type, seq, rows, cols, values, threshold,
+                      changed):
+        # Keep the flat readings as the state the next delta applies to
+        count = rows * cols
+        bits = touch_bits(values, threshold)
+        self._values = values
+        self._threshold = threshold
+        self._bits = bits
+        self._count = count
+        frame = Frame(frame_type, seq, rows, cols, count, bits, changed)
+        frame.values = values.reshape(rows, cols)
+        frame.threshold = threshold
+        return frame
+
+    def _decode_status(self, view, pos, length, header, rows, cols):
+        # Out of sequence: seq is not checked and last_seq is kept
+        start = pos + HEADER_SIZE
+        if header & FLAG_TIMESTAMP:
+            start += TIMESTAMP_SIZE
+            length -= TIMESTAMP_SIZE
+        if length < STATUS_SIZE:
+            return None
+        self.scan_hz = view[start] | (view[start + 1] << 8)
+        self.scan_mode = view[start + 2]
+        self.debounce = view[start + 3] if length > STATUS_SIZE else None
+        if self._bits is None or self._count != rows * cols:
+            return None
+        # Repeat the grid so consumers redraw with the new rate
+        frame = Frame(TYPE_STATUS, self.last_seq, rows, cols, self._count,
+                      self._bits)
+        if self._values is not None:
+            frame.values = self._values.reshape(rows, cols)
+            frame.threshold = self._threshold
+        if header & FLAG_TIMESTAMP:
+            frame.device_us = int.from_bytes(
+                view[pos + HEADER_SIZE:pos + HEADER_SIZE + 4], "little")
+            frame.scan_us = (view[pos + HEADER_SIZE + 4]
+                             | (view[pos + HEADER_SIZE + 5] << 8))
+        return frame
+
+
+async def pump_serial(ser, on_frame, reader=None):
+    """Deliver every frame from a port to on_frame(frame) on the event loop.
+
+    `ser` must be opened with timeout=0; it is read from loop.add_reader,
+    so nothing blocks. Keyframes are requested automatically after a gap.
+    Returns only by raising the error that ended reading (e.g. unplugged).
+    """
+    loop = asyncio.get_running_loop()
+    if reader is None:
+        reader = FrameReader()
+    failed = loop.create_future()
+
+    def on_readable():
+        try:
+            for frame in reader.read_serial(ser):
+                on_frame(frame)
+            if reader.resync_needed:
+                ser.write(REQUEST_KEYFRAME)
+                reader.resync_needed = False
+        except OSError as e:
+            # serial.SerialException is an IOError
+            if not failed.done():
+                failed.set_exception(e)
+
+    fd = ser.fileno()
+    loop.add_reader(fd, on_readable)
+    try:
+        await failed
+    finally:
+        loop.remove_reader(fd)
@@ -0,0 +1,288 @@
+"""
+Differential ANSI renderer for the terminal visualizers.
+
+The terminal counterpart of ceferss.oled.GridRenderer. The first frame
+is drawn in full: title, grid borders, legend and the status panel next
+to the grid. After that only the cell glyphs and the panel text can
+change, so render() moves the cursor (CSI row;col H) to each cell whose
+glyph changed and each panel line whose text changed (active count, bar,
+scan rate) and overwrites just those. Nothing is cleared, so nothing
+flickers, and every frame is a single sys.stdout.write: one cell
+changing on the 5x5 layout is a few hundred bytes instead of 4 KB.
+
+    screen = TerminalGrid(rows, cols, cell_w=8, cell_h=4,
+                          title="5x5 Sensor Grid")
+    screen.render(glyphs, status_panel(frame, frame.active(), rows * cols),
+                  legend)
+    ...
+    screen.close()      # cursor back below the grid before printing
+
+A change of legend or panel height (or the first frame) redraws the
+whole screen.
+
+Grids too big for boxed cells go to DenseGrid, which packs several cells
+into one character: 1x2 with half blocks (▀ ▄ █) or 2x4 with braille
+dots, so a 128x128 grid is 64 characters by 32 lines. It takes the
+touch mask as a (rows, cols) bool array, packs it with one vectorized
+pass, and rewrites only the changed span of each changed line.
+grid_screen() picks the layout: with LAYOUT_AUTO, boxed cells shrunk
+from cell_w x cell_h as far as needed to fit the terminal, then half
+blocks, then braille.
+"""
+
+import shutil
+import sys
+
+import numpy as np
+
+from .protocol import MODE_ACTIVE, MODE_NAMES
+
+CSI = "\033["
+CLEAR = CSI + "H" + CSI + "J"
+HIDE_CURSOR = CSI + "?25l"
+SHOW_CURSOR = CSI + "?25h"
+
+MARGIN = "  "           # left of the grid
+PANEL_GAP = "        "   # between the grid and the panel
+PANEL_WIDTH = 23
+BAR_WIDTH = 16
+
+# Lines besides the grid: title, blank line and two of legend
+EXTRA_LINES = 4
+
+LAYOUT_AUTO = "auto"
+LAYOUT_CELLS = "cells"
+LAYOUT_HALF = "half"
+LAYOUT_BRAILLE = "braille"
+LAYOUTS = (LAYOUT_AUTO, LAYOUT_CELLS, LAYOUT_HALF, LAYOUT_BRAILLE)
+
+# Dot values of a braille character (U+2800 + sum), by (row, col) in
+# its 4x2 block
+BRAILLE_DOTS = np.array([[0x01, 0x08], [0x02, 0x10], [0x04, 0x20],
+                         [0x40, 0x80]], dtype=np.uint8)
+BRAILLE_CHARS = np.array([chr(0x2800 + i) for i in range(256)])
+HALF_DOTS = np.array([[1], [2]], dtype=np.uint8)
+HALF_CHARS = np.array([" ", "▀", "▄", "█"])
+
+
+def status_panel(frame, active, total):
+    """Status panel lines: active cells, a bar and the reported scan rate."""
+    panel = [
+        "┌─────────────────────┐",
+        "│       Status        │",
+        "│                     │",
+        "│                     │",
+    ]
+    if total > 999:
+        count = f"{active}/{total}"
+        panel.insert(3, f"│  Active: {count:<11}│")
+    else:
+        panel.insert(3, f"│  Active: {active:>3} / {total:<3}  │")
+    bar_len = int((active / total) * BAR_WIDTH)
+    bar = "█" * bar_len + "░" * (BAR_WIDTH - bar_len)
+    panel.append(f"│ [{bar}]  │")
+    if frame.scan_hz is None:
+        panel.append("│                     │")
+    else:
+        # adaptive scan rate reported by the firmware
+        rate = f"{frame.scan_hz} Hz"
+        if frame.scan_mode != MODE_ACTIVE:
+            rate += " " + MODE_NAMES.get(frame.scan_mode, "?")
+        panel.append(f"│  Scan: {rate:<12} │")
+        if frame.debounce is not None and frame.debounce > 1:
+            # changes are held back this long by DEBOUNCE_SCANS
+            delay = (frame.debounce - 1) * 1000 // max(frame.scan_hz, 1)
+            panel.append(f"│  Debounce: +{delay:<3} ms  │")
+    panel.append("└─────────────────────┘")
+    return panel
+
+
+class TerminalGrid:
+    """Draws a rows x cols grid of glyphs, writing only what changed."""
+
+    dense = False
+
+    def __init__(self, rows, cols, cell_w=8, cell_h=4, title=""):
+        self.rows = rows
+        self.cols = cols
+        self.cell_w = cell_w
+        self.cell_h = cell_h
+        self.title = title
+        self.glyphs = None
+        self.panel = None
+        self.legend = None
+        self.height = 0
+        # Characters written by the last render(), escapes included
+        self.written = 0
+
+    def _layout(self, glyphs, legend):
+        cell = "─" * self.cell_w
+        inner = self.cols - 1
+        lines = [MARGIN + self.title,
+                 MARGIN + "┌" + (cell + "┬") * inner + cell + "┐"]
+        mid = MARGIN + "├" + (cell + "┼") * inner + cell + "┤"
+        for r in range(self.rows):
+            # every line of a cell row is the same: build it once
+            row = glyphs[r * self.cols:(r + 1) * self.cols]
+            line = (MARGIN + "│"
+                    + "│".join([g * self.cell_w for g in row]) + "│")
+            lines.extend([line] * self.cell_h)
+            if r < self.rows - 1:
+                lines.append(mid)
+        lines.append(MARGIN + "└" + (cell + "┴") * inner + cell + "┘")
+        lines.append("")
+        lines.extend(legend)
+        return lines
+
+    def _full(self, glyphs, panel, legend):
+        lines = self._layout(glyphs, legend)
+        # Panel vertically centred next to the grid
+        top = max(1, (len(lines) - len(panel)) // 2)
+        width = len(lines[1])
+        for i, text in enumerate(panel):
+            if top + i < len(lines):
+                lines[top + i] = (lines[top + i].ljust(width) + PANEL_GAP
+                                  + text)
+        self._panel_row = top + 1
+        self._panel_col = width + len(PANEL_GAP) + 1
+        self.height = len(lines)
+        return HIDE_CURSOR + CLEAR + "\n".join(lines) + "\n"
+
+    def _changes(self, glyphs, panel):
+        return self._cell_changes(glyphs) + self._panel_changes(panel)
+
+    def _panel_changes(self, panel):
+        parts = []
+        for i, (new, old) in enumerate(zip(panel, self.panel)):
+            if new != old:
+                parts.append(f"{CSI}{self._panel_row + i};"
+                             f"{self._panel_col}H{new}")
+        return "".join(parts)
+
+    def _cell_changes(self, glyphs):
+        parts = []
+        cols = self.cols
+        cell_w = self.cell_w
+        # Screen position (1-based) of the top-left of cell (0, 0); each
+        # further cell is one border character / line on
+        y0 = 3
+        x0 = len(MARGIN) + 2
+        for i, (new, old) in enumerate(zip(glyphs, self.glyphs)):
+            if new != old:
+                r, c = divmod(i, cols)
+                y = y0 + r * (self.cell_h + 1)
+                x = x0 + c * (cell_w + 1)
+                fill = new * cell_w
+                for k in range(self.cell_h):
+                    parts.append(f"{CSI}{y + k};{x}H{fill}")
+        return "".join(parts)
+
+    def render(self, glyphs, panel, legend=()):
+        """Show one character per cell (row-major) and the panel lines."""
+        legend = tuple(legend)
+        if (self.glyphs is None or len(glyphs) != len(self.glyphs)
+                or len(panel) != len(self.panel) or legend != self.legend):
+            out = self._full(glyphs, panel, legend)
+        else:
+            out = self._changes(glyphs, panel)
+        self.glyphs = glyphs
+        self.panel = panel
+        self.legend = legend
+        self.written = len(out)
+        if out:
+            sys.stdout.write(out)
+            sys.stdout.flush()
+
+    def redraw(self):
+        """Draw everything again on the next render (e.g. after a resize)."""
+        self.glyphs = None
+
+    def close(self):
+        """Put the cursor below the grid and show it again."""
+        if self.glyphs is not None:
+            sys.stdout.write(f"{CSI}{self.height + 1};1H{SHOW_CURSOR}")
+            sys.stdout.flush()
+            self.glyphs = None
+
+
+class DenseGrid(TerminalGrid):
+    """Packs 1x2 (half blocks) or 2x4 (braille) cells into each character.
+
+    render() takes the touch mask, a (rows, cols) bool array, instead of
+    glyphs.
+    """
+
+    dense = True
+
+    def __init__(self, rows, cols, layout=LAYOUT_BRAILLE, title=""):
+        super().__init__(rows, cols, 1, 1, title)
+        self.layout = layout
+        if layout == LAYOUT_BRAILLE:
+            self._dots, self._chars = BRAILLE_DOTS, BRAILLE_CHARS
+            self.key = "⣿ = touched cells, 2x4 per character"
+        else:
+            self._dots, self._chars = HALF_DOTS, HALF_CHARS
+            self.key = "▀▄ = touched cells, 2 per character"
+        block_h, block_w = self._dots.shape
+        self.width = -(-cols // block_w)
+        self.lines = -(-rows // block_h)
+        # Mask padded to whole characters, viewed as blocks of cells
+        self._padded = np.zeros((self.lines * block_h, self.width * block_w),
+                                dtype=np.uint8)
+        self._blocks = self._padded.reshape(self.lines, block_h, self.width,
+                                            block_w)
+
+    def _codes(self, mask):
+        self._padded[:self.rows, :self.cols] = mask
+        return np.einsum("ihjw,hw->ij", self._blocks, self._dots)
+
+    def _layout(self, codes, legend):
+        border = "─" * self.width
+        lines = [MARGIN + self.title, MARGIN + "┌" + border + "┐"]
+        for row in self._chars[codes].tolist():
+            lines.append(MARGIN + "│" + "".join(row) + "│")
+        lines.append(MARGIN + "└" + border + "┘")
+        lines.append("")
+        lines.extend(legend)
+        return lines
+
+    def _cell_changes(self, codes):
+        parts = []
+        x0 = len(MARGIN) + 2
+        changed = codes != self.glyphs
+        for y in np.flatnonzero(changed.any(axis=1)).tolist():
+            # One write from the first to the last change on the line
+            xs = np.flatnonzero(changed[y])
+            first = int(xs[0])
+            last = int(xs[-1]) + 1
+            text = "".join(self._chars[codes[y, first:last]].tolist())
+            parts.append(f"{CSI}{y + 3};{x0 + first}H{text}")
+        return "".join(parts)
+
+    def render(self, mask, panel, legend=()):
+        """Show a (rows, cols) bool touch mask and the panel lines."""
+        super().render(self._codes(mask), panel, legend)
+
+
+def grid_screen(rows, cols, cell_w=8, cell_h=4, title="", layout=LAYOUT_AUTO):
+    """TerminalGrid or DenseGrid for this grid, sized to the terminal.
+
+    LAYOUT_AUTO takes the largest layout that fits: boxed cells of up to
+    cell_w x cell_h (shrunk to no less than 2x1), then half blocks, then
+    braille.
+    """
+    if layout == LAYOUT_CELLS:
+        return TerminalGrid(rows, cols, cell_w, cell_h, title)
+    if layout in (LAYOUT_HALF, LAYOUT_BRAILLE):
+        return DenseGrid(rows, cols, layout, title)
+    size = shutil.get_terminal_size()
+    width = size.columns - len(MARGIN) - len(PANEL_GAP) - PANEL_WIDTH
+    height = size.lines - EXTRA_LINES
+    # Borders take one column / line per cell plus one
+    fit_w = min(cell_w, (width - 1) // cols - 1) // 2 * 2
+    fit_h = min(cell_h, (height - 1) // rows - 1)
+    if fit_w >= 2 and fit_h >= 1:
+        return TerminalGrid(rows, cols, fit_w, fit_h, title)
+    if cols + 2 <= width and (rows + 1) // 2 + 2 <= height:
+        return DenseGrid(rows, cols, LAYOUT_HALF, title)
+    return DenseGrid(rows, cols, LAYOUT_BRAILLE, title)
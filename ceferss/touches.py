@@ -0,0 +1,301 @@
+"""
+Touch points from grid frames: blobs, centroids and tracked touch ids.
+
+TouchTracker turns the frame stream into touch events, so consumers that
+only care where the fingers are need not look at whole grids:
+
+  * touched cells are grouped into blobs (8-connected, so a diagonal
+    neighbour belongs to the same finger);
+  * each blob's centroid is placed in inches from the strip geometry in
+    designs_info.txt (ceferss.designs). Digital frames average the cell
+    centres, analog frames weight them by pressure, which both resolve
+    positions between strips;
+  * blobs are matched to the previous frame's touches nearest first, up
+    to max_jump pitches away. A touch that finds no blob ends with "up",
+    a blob with no touch starts a new id with "down", and a matched touch
+    that moved gets a "move".
+
+A frame where nothing moved produces no events. All per-cell work is
+vectorized; only the touches themselves are Python objects.
+
+    tracker = TouchTracker.for_grid(rows, cols)
+    for frame in reader.feed(data):
+        for event in tracker.update(frame):
+            print(event)
+
+Usage: python3 -m ceferss.touches [serial_port | recording.cfr [speed]]
+           [--rows 5 --cols 5] [--width IN --gap IN]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import serial
+
+from .calibration import Calibrator
+from .designs import find_preset
+from .handshake import handshake
+from .ports import find_serial_port
+from .protocol import DOWN, MOVE, UP, TouchEvent
+from .recording import ReplayPort, is_recording, parse_speed
+from .stream import FrameReader
+
+MAX_JUMP = 2.0          # pitches a touch may move between frames
+MOVE_EPSILON = 0.01     # inches; smaller centroid shifts are not a move
+MAX_IDS = 256           # ids wrap, so they fit in a byte on the wire
+
+BAUD_RATE = 115200
+
+# Offsets of the 8 neighbours plus the cell itself
+_NEIGHBOURS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+
+def label_blobs(mask):
+    """8-connected components of a bool (rows, cols) array.
+
+    Returns (labels, count): labels is an int array, 0 outside the mask
+    and 1..count inside, numbered in row-major order of first cell.
+    """
+    rows, cols = mask.shape
+    if not mask.any():
+        return np.zeros(mask.shape, dtype=np.intp), 0
+    # Every touched cell starts with its own label and takes the smallest
+    # label in its neighbourhood until nothing changes; that takes about
+    # as many passes as the widest blob is long
+    none = mask.size + 1
+    labels = np.where(mask, np.arange(1, mask.size + 1).reshape(mask.shape),
+                      none)
+    padded = np.full((rows + 2, cols + 2), none)
+    while True:
+        padded[1:-1, 1:-1] = labels
+        smallest = labels.copy()
+        for dr, dc in _NEIGHBOURS:
+            np.minimum(smallest, padded[1 + dr:1 + dr + rows,
+                                        1 + dc:1 + dc + cols], out=smallest)
+        smallest[~mask] = none
+        if np.array_equal(smallest, labels):
+            break
+        labels = smallest
+    found, labels[mask] = np.unique(labels[mask], return_inverse=True)
+    labels[~mask] = -1
+    return labels + 1, len(found)
+
+
+class TouchTracker:
+    """Tracks touch ids across frames; update() returns TouchEvents.
+
+    width and gap are the strip geometry in inches. The defaults put
+    cell centres one unit apart, so positions are in cells.
+    """
+
+    def __init__(self, rows, cols, width=1.0, gap=0.0, max_jump=MAX_JUMP):
+        self.rows = rows
+        self.cols = cols
+        self.width = width
+        self.gap = gap
+        pitch = width + gap
+        self.pitch = pitch
+        self.max_jump = max_jump * pitch
+        # Centre of every cell, in inches
+        self._cell_x = (np.arange(cols) * pitch + width / 2).astype(
+            np.float32)
+        self._cell_y = (np.arange(rows) * pitch + width / 2).astype(
+            np.float32)
+        self.reset()
+
+    @classmethod
+    def for_grid(cls, rows, cols, **kwargs):
+        """Tracker with the geometry of the designs_info.txt preset of
+        this size, or in cell units if there is none."""
+        preset = find_preset(rows, cols)
+        if preset is not None:
+            kwargs.setdefault("width", preset["width"])
+            kwargs.setdefault("gap", preset["gap"])
+        return cls(rows, cols, **kwargs)
+
+    def reset(self):
+        """Forget all touches (without sending "up" for them)."""
+        self.ids = np.empty(0, dtype=np.intp)
+        self.positions = np.empty((0, 2), dtype=np.float32)
+        self.cells = []
+        self.pressures = []
+        self._next_id = 0
+
+    def snapshot(self):
+        """Every current touch as a "down" event."""
+        return [TouchEvent(DOWN, touch_id, x, y, cells, pressure)
+                for touch_id, (x, y), cells, pressure in zip(
+                    self.ids.tolist(), self.positions.tolist(), self.cells,
+                    self.pressures)]
+
+    def blobs(self, mask, intensity=None):
+        """Centroids (n, 2) as (x, y), cell counts and mean pressures."""
+        labels, count = label_blobs(mask)
+        if not count:
+            return np.empty((0, 2), dtype=np.float32), [], []
+        rows, cols = np.nonzero(mask)
+        blob = labels[rows, cols] - 1
+        if intensity is None:
+            weights = np.ones(len(blob), dtype=np.float32)
+        else:
+            # A touched cell always counts a little, even if its reading
+            # sits right at the threshold
+            weights = np.maximum(intensity[rows, cols], 0.05)
+        total = np.bincount(blob, weights, count)
+        centroids = np.empty((count, 2), dtype=np.float32)
+        centroids[:, 0] = np.bincount(blob, weights * self._cell_x[cols],
+                                      count) / total
+        centroids[:, 1] = np.bincount(blob, weights * self._cell_y[rows],
+                                      count) / total
+        cells = np.bincount(blob, minlength=count)
+        if intensity is None:
+            pressure = np.ones(count)
+        else:
+            pressure = np.bincount(blob, intensity[rows, cols], count) / cells
+        return centroids, cells.tolist(), pressure.tolist()
+
+    def _match(self, centroids):
+        # (previous touch, blob) pairs, nearest first, within max_jump
+        if not len(self.ids) or not len(centroids):
+            return []
+        delta = self.positions[:, None, :] - centroids[None, :, :]
+        dist = np.hypot(delta[..., 0], delta[..., 1])
+        order = np.argsort(dist, axis=None)
+        order = order[dist.ravel()[order] <= self.max_jump]
+        pairs = []
+        used_old = set()
+        used_new = set()
+        for old, new in zip(*np.unravel_index(order, dist.shape)):
+            old = int(old)
+            new = int(new)
+            if old in used_old or new in used_new:
+                continue
+            used_old.add(old)
+            used_new.add(new)
+            pairs.append((old, new))
+        return pairs
+
+    def update(self, frame, intensity=None):
+        """Track the touches in one frame and return the events.
+
+        intensity is an optional (rows, cols) pressure array (e.g. from
+        ceferss.calibration); analog frames default to frame.intensity().
+        """
+        if frame.count != self.rows * self.cols:
+            return []
+        mask = frame.grid().reshape(self.rows, self.cols)
+        if intensity is None and frame.values is not None:
+            intensity = frame.intensity()
+        if intensity is not None:
+            intensity = np.asarray(intensity).reshape(self.rows, self.cols)
+        centroids, cells, pressures = self.blobs(mask, intensity)
+
+        events = []
+        seq = frame.seq
+        recv_us = frame.recv_us
+        ids = np.empty(len(centroids), dtype=np.intp)
+        matched = np.zeros(len(centroids), dtype=bool)
+        lifted = np.ones(len(self.ids), dtype=bool)
+        for old, new in self._match(centroids):
+            touch_id = int(self.ids[old])
+            ids[new] = touch_id
+            matched[new] = True
+            lifted[old] = False
+            x, y = centroids[new].tolist()
+            px, py = self.positions[old].tolist()
+            if (abs(x - px) > MOVE_EPSILON or abs(y - py) > MOVE_EPSILON
+                    or cells[new] != self.cells[old]):
+                events.append(TouchEvent(MOVE, touch_id, x, y, cells[new],
+                                         pressures[new], seq, recv_us))
+            else:
+                # Hold the reported position still through jitter
+                centroids[new] = self.positions[old]
+
+        for old in np.flatnonzero(lifted).tolist():
+            x, y = self.positions[old].tolist()
+            events.append(TouchEvent(UP, int(self.ids[old]), x, y,
+                                     self.cells[old], self.pressures[old],
+                                     seq, recv_us))
+        for new in np.flatnonzero(~matched).tolist():
+            touch_id = self._next_id
+            self._next_id = (touch_id + 1) % MAX_IDS
+            ids[new] = touch_id
+            x, y = centroids[new].tolist()
+            events.append(TouchEvent(DOWN, touch_id, x, y, cells[new],
+                                     pressures[new], seq, recv_us))
+
+        self.ids = ids
+        self.positions = centroids
+        self.cells = cells
+        self.pressures = pressures
+        return events
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print touch events from a scanner or a recording.")
+    parser.add_argument("source", nargs="?",
+                        help="serial port or .cfr recording")
+    parser.add_argument("speed", nargs="?", help="replay speed or max")
+    parser.add_argument("--rows", type=int,
+                        help="default: from the descriptor or the frames")
+    parser.add_argument("--cols", type=int)
+    parser.add_argument("--width", type=float,
+                        help="strip width, in (default: from the descriptor "
+                        "or designs_info.txt)")
+    parser.add_argument("--gap", type=float, help="strip gap, in")
+    args = parser.parse_args()
+
+    port = args.source or find_serial_port()
+    if port is None:
+        print("Error: No sensor serial port found.")
+        sys.exit(1)
+    if is_recording(port):
+        ser = ReplayPort(port, parse_speed(args.speed))
+    else:
+        ser = serial.Serial(port, BAUD_RATE, timeout=1)
+    reader = FrameReader()
+    # Grid size and strip geometry as the scanner reports them
+    descriptor = handshake(ser, reader)
+    geometry = {}
+    if descriptor is not None:
+        args.rows = args.rows or descriptor.rows
+        args.cols = args.cols or descriptor.cols
+        if descriptor.width:
+            geometry = {"width": descriptor.width, "gap": descriptor.gap}
+    if args.width is not None:
+        geometry["width"] = args.width
+    if args.gap is not None:
+        geometry["gap"] = args.gap
+
+    calibrator = Calibrator()
+    tracker = None
+    try:
+        while True:
+            for frame in reader.read_serial(ser):
+                if tracker is None:
+                    rows = args.rows or frame.rows
+                    cols = args.cols or frame.cols
+                    if rows is None or cols is None:
+                        print("CSV frames carry no size: pass --rows/--cols")
+                        sys.exit(1)
+                    tracker = TouchTracker.for_grid(rows, cols, **geometry)
+                    print(f"{rows}x{cols} grid, pitch {tracker.pitch:.3f}")
+                intensity = None
+                if frame.values is not None:
+                    calibrator.apply(frame)
+                    intensity = calibrator.intensity(frame.values)
+                for event in tracker.update(frame, intensity):
+                    print(f"{event.kind:<4} #{event.id:<3} "
+                          f"x={event.x:6.2f} y={event.y:6.2f} "
+                          f"cells={event.cells} "
+                          f"pressure={event.pressure:.2f}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ser.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,131 @@ const int TOUCH_THRESHOLD = (4.7 / 5.0) * 1023;
 // array to store grid states grid states (according to size of grid) (1 = no touch, 0 = touch)
 int gridState[ROW_COUNT * COL_COUNT];
 
+// raw ADC reading of every cell from the last scan
+int adcValues[ROW_COUNT * COL_COUNT];
+
+// per-cell auto-calibration instead of the fixed TOUCH_THRESHOLD: the
+// first CALIBRATION_SCANS scans (keep hands off the fabric) learn each
+// cell's resting reading and noise, which then follow drift (humidity,
+// stretch, wear) as an average over roughly 2^BASELINE_SHIFT scans while
+// the cell is untouched. a cell is touched once its reading drops below
+// the baseline by NOISE_K x its noise (at least MIN_DROP counts) and is
+// released when the drop falls under half that
+const bool AUTO_CALIBRATE = true;
+const int CALIBRATION_SCANS = 64;
+const int BASELINE_SHIFT = 5;
+const int NOISE_K = 4;
+const int MIN_DROP = 16;
+
+// baseline and mean absolute deviation per cell, in 1/16 ADC counts
+long baseline[ROW_COUNT * COL_COUNT];
+long noise[ROW_COUNT * COL_COUNT];
+int calibrationScans = 0;
+
+// wire format: true = bit-packed binary frames, false = legacy CSV lines
+// binary layout must match ceferss/protocol.py on the host:
+//   0xA5 0x5A | version<<4 | type | seq | rows | cols | len (2, LE) | payload | CRC-8
+// this and DELTA_FRAMES are the format at power-up; the Pi may switch it
+// with a select command (see below)
+const bool BINARY_FRAMES = true;
+
+// binary only: between keyframes send just the indices of flipped cells;
+// a keyframe goes out every KEYFRAME_INTERVAL loops or when the Pi sends 'K'
+const bool DELTA_FRAMES = true;
+const int KEYFRAME_INTERVAL = 20; // 0.2 s at ACTIVE_HZ, 4 s at IDLE_HZ
+const char REQUEST_KEYFRAME = 'K';
+
+// the Pi sends '?' to get a descriptor frame: grid size, scan rate,
+// encodings and the one in use, firmware version and the strip geometry
+// of the NANO design in designs_info.txt (inches). it may then select an
+// encoding: 'c' CSV, 'k' keyframes, 'd' deltas, or 'a' analog frames
+// (only with ANALOG_FRAMES), answered with a descriptor and a keyframe
+const char REQUEST_DESCRIPTOR = '?';
+const uint8_t FIRMWARE_MAJOR = 1;
+const uint8_t FIRMWARE_MINOR = 0;
+const float STRIP_WIDTH = 0.85;
+const float STRIP_GAP = 0.125;
+
+// binary only: prefix the payload with the scan start (micros(), 4 bytes)
+// and scan duration (2 bytes) so the Pi can measure end-to-end latency
+const bool TIMESTAMPS = false;
+
+// adaptive scan rate: ACTIVE_HZ while anything is touched, IDLE_HZ once
+// nothing has been for IDLE_AFTER_MS; false = fixed ~20 Hz. with
+// WAKE_ON_CHANGE the idle scan drives every row at once and only reads
+// the columns, going back to full scans on the first contact. binary
+// frames report each change of rate in a status frame
+const bool ADAPTIVE_RATE = true;
+const unsigned long ACTIVE_HZ = 100;
+const unsigned long IDLE_HZ = 5;
+const unsigned long IDLE_AFTER_MS = 2000;
+const bool WAKE_ON_CHANGE = false;
+
+// binary only: send the 10-bit ADC readings instead of touch bits (bit-
+// packed, 4 cells in 5 bytes; see ceferss/protocol.py). keyframes carry
+// every cell plus TOUCH_THRESHOLD, deltas the cells that moved by more
+// than ANALOG_DEADBAND (or twice their noise with AUTO_CALIBRATE) since
+// they were last sent
+const bool ANALOG_FRAMES = false;
+const int ANALOG_DEADBAND = 4;
+
+// ADC clock = 16 MHz / ADC_PRESCALER. the Arduino default of 128 takes
+// ~112 us per analogRead (2.8 ms for 25 cells); 32 takes ~30 us with a
+// small loss of accuracy, 16 ~16 us with a larger one
+const int ADC_PRESCALER = 32;
+
+const uint8_t SYNC0 = 0xA5;
+const uint8_t SYNC1 = 0x5A;
+const uint8_t PROTOCOL_VERSION = 1;
+const uint8_t TYPE_KEYFRAME = 0x0;
+const uint8_t TYPE_DELTA = 0x1;
+const uint8_t TYPE_STATUS = 0x2;
+const uint8_t TYPE_DESCRIPTOR = 0x7;
+const uint8_t TYPE_MASK = 0x7;
+const uint8_t FLAG_TIMESTAMP = 0x8;
+const uint8_t MODE_ACTIVE = 0;
+const uint8_t MODE_IDLE = 1;
+const uint8_t MODE_WAKE = 2;
+const int HEADER_SIZE = 8;
+const int TIMESTAMP_SIZE = 6;
+const uint8_t TYPE_ANALOG_KEYFRAME = 0x3;
+const uint8_t TYPE_ANALOG_DELTA = 0x4;
+const int STATUS_SIZE = 3;
+const int DESCRIPTOR_SIZE = 11;
+const uint8_t ENC_CSV = 0x01;
+const uint8_t ENC_KEYFRAMES = 0x02;
+const uint8_t ENC_DELTA = 0x04;
+const uint8_t ENC_ANALOG = 0x08;
+const uint8_t ENCODINGS = ANALOG_FRAMES ? (ENC_ANALOG | ENC_CSV)
+                                        : (ENC_CSV | ENC_KEYFRAMES | ENC_DELTA);
+const int DATA_START = HEADER_SIZE + (TIMESTAMPS ? TIMESTAMP_SIZE : 0);
+const int PAYLOAD_SIZE = (ROW_COUNT * COL_COUNT + 7) / 8;
+const int ANALOG_SIZE = 2 + (ROW_COUNT * COL_COUNT * 10 + 7) / 8;
+const int DATA_SIZE = ANALOG_SIZE; // the largest payload
+
+// frame buffer reused for every send
+uint8_t frameBuf[DATA_START + DATA_SIZE + 1];
+uint8_t frameSeq = 0;
+
+// wire format in use, as last selected by the Pi
+bool binaryFrames = BINARY_FRAMES;
+bool deltaFrames = DELTA_FRAMES;
+
+// adaptive scan rate state
+uint8_t scanMode = MODE_ACTIVE;
+unsigned long scanHz = ACTIVE_HZ;
+unsigned long lastActiveMs = 0;
+unsigned long nextScanUs = 0;
+
+// timing of the scan behind the next frame
+unsigned long scanStartUs = 0;
+unsigned long scanDurationUs = 0;
+
+// state as of the last frame sent, for delta encoding
+int sentState[ROW_COUNT * COL_COUNT];
+int sentValues[ROW_COUNT * COL_COUNT];
+int loopsSinceKeyframe = KEYFRAME_INTERVAL; // first loop sends a keyframe
+
 // LED blink state
 unsigned long lastLedToggle = 0;
 bool ledState = false;
@@ -37,6 +162,345 @@ void setup() {
 
   // set built-in LED as output
   pinMode(LED_BUILTIN, OUTPUT);
+
+#if defined(ADCSRA)
+  // ADC prescaler select bits: 2 -> 1, 4 -> 2, ... 128 -> 7
+  uint8_t adps = 0;
+  for (int p = ADC_PRESCALER; p > 1; p >>= 1) {
+    adps++;
+  }
+  ADCSRA = (ADCSRA & ~0x07) | (adps & 0x07);
+#endif
+}
+
+// CRC-8, polynomial 0x07, init 0
+uint8_t crc8(const uint8_t *data, int len) {
+  uint8_t crc = 0;
+  for (int i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (int b = 0; b < 8; b++) {
+      crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+// fill in the header and CRC around a payload already in frameBuf, then send;
+// status and descriptor frames repeat the next sequence number instead of
+// taking one
+void sendFrame(uint8_t type, int payloadLen) {
+  if (TIMESTAMPS) {
+    unsigned int duration = scanDurationUs > 0xFFFF ? 0xFFFF : scanDurationUs;
+    for (int i = 0; i < 4; i++) {
+      frameBuf[HEADER_SIZE + i] = (scanStartUs >> (8 * i)) & 0xFF;
+    }
+    frameBuf[HEADER_SIZE + 4] = duration & 0xFF;
+    frameBuf[HEADER_SIZE + 5] = duration >> 8;
+    type |= FLAG_TIMESTAMP;
+    payloadLen += TIMESTAMP_SIZE;
+  }
+  frameBuf[0] = SYNC0;
+  frameBuf[1] = SYNC1;
+  frameBuf[2] = (PROTOCOL_VERSION << 4) | type;
+  frameBuf[3] = frameSeq;
+  if ((type & TYPE_MASK) != TYPE_STATUS && (type & TYPE_MASK) != TYPE_DESCRIPTOR) {
+    frameSeq++;
+  }
+  frameBuf[4] = ROW_COUNT;
+  frameBuf[5] = COL_COUNT;
+  frameBuf[6] = payloadLen & 0xFF;
+  frameBuf[7] = payloadLen >> 8;
+  frameBuf[HEADER_SIZE + payloadLen] = crc8(frameBuf + 2, HEADER_SIZE - 2 + payloadLen);
+  Serial.write(frameBuf, HEADER_SIZE + payloadLen + 1);
+}
+
+// remember gridState as sent, for the next delta
+void markSent() {
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    sentState[i] = gridState[i];
+  }
+}
+
+// send gridState as a binary keyframe (bit set = touch)
+void sendKeyframe() {
+  for (int i = 0; i < PAYLOAD_SIZE; i++) {
+    frameBuf[DATA_START + i] = 0;
+  }
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    if (gridState[i] == 0) {
+      frameBuf[DATA_START + (i >> 3)] |= 1 << (i & 7);
+    }
+  }
+  sendFrame(TYPE_KEYFRAME, PAYLOAD_SIZE);
+  markSent();
+}
+
+// send the indices of cells that flipped since the last frame (one byte
+// each, grid is under 256 cells); falls back to a keyframe when that
+// would not be smaller, sends nothing when nothing changed
+void sendDelta() {
+  int len = 0;
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    if (gridState[i] != sentState[i]) {
+      if (len >= PAYLOAD_SIZE) {
+        sendKeyframe();
+        return;
+      }
+      frameBuf[DATA_START + len++] = i;
+    }
+  }
+  if (len > 0) {
+    sendFrame(TYPE_DELTA, len);
+    markSent();
+  }
+}
+
+// OR a 10-bit value into slot `slot` of a zeroed bit-packed array
+void packValue(uint8_t *buf, int slot, int value) {
+  int bit = slot * 10;
+  int shift = bit & 7;
+  uint8_t *p = buf + (bit >> 3);
+  p[0] |= (uint8_t)(value << shift);
+  p[1] |= (uint8_t)(value >> (8 - shift));
+  if (shift > 6) {
+    p[2] |= (uint8_t)(value >> (16 - shift));
+  }
+}
+
+// send every cell's ADC reading as an analog keyframe. the threshold is
+// the fixed TOUCH_THRESHOLD even with AUTO_CALIBRATE: the per-cell
+// decisions stay on the board, and the host recalibrates from the
+// readings (ceferss.calibration)
+void sendAnalogKeyframe() {
+  for (int i = 0; i < ANALOG_SIZE; i++) {
+    frameBuf[DATA_START + i] = 0;
+  }
+  frameBuf[DATA_START] = TOUCH_THRESHOLD & 0xFF;
+  frameBuf[DATA_START + 1] = TOUCH_THRESHOLD >> 8;
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    packValue(frameBuf + DATA_START + 2, i, adcValues[i]);
+    sentValues[i] = adcValues[i];
+  }
+  sendFrame(TYPE_ANALOG_KEYFRAME, ANALOG_SIZE);
+  markSent();
+}
+
+// send the cells whose reading moved more than ANALOG_DEADBAND since it
+// was last sent: a bitmap of those cells, then their packed values.
+// falls back to a keyframe when that would not be smaller
+void sendAnalogDelta() {
+  for (int i = 0; i < ANALOG_SIZE; i++) {
+    frameBuf[DATA_START + i] = 0;
+  }
+  uint8_t *values = frameBuf + DATA_START + PAYLOAD_SIZE;
+  int count = 0;
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    int deadband = ANALOG_DEADBAND;
+    if (AUTO_CALIBRATE && (noise[i] >> 3) > deadband) {
+      deadband = noise[i] >> 3; // twice the noise, in counts
+    }
+    if (abs(adcValues[i] - sentValues[i]) > deadband) {
+      int len = PAYLOAD_SIZE + ((count + 1) * 10 + 7) / 8;
+      if (len >= ANALOG_SIZE) {
+        sendAnalogKeyframe();
+        return;
+      }
+      frameBuf[DATA_START + (i >> 3)] |= 1 << (i & 7);
+      packValue(values, count++, adcValues[i]);
+    }
+  }
+  if (count == 0) {
+    return;
+  }
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    if (frameBuf[DATA_START + (i >> 3)] & (1 << (i & 7))) {
+      sentValues[i] = adcValues[i];
+    }
+  }
+  sendFrame(TYPE_ANALOG_DELTA, PAYLOAD_SIZE + (count * 10 + 7) / 8);
+  markSent();
+}
+
+// how far below its baseline a cell's reading must drop to count as touched
+int touchDrop(int index) {
+  int drop = (NOISE_K * noise[index]) >> 4;
+  return drop > MIN_DROP ? drop : MIN_DROP;
+}
+
+// set gridState[index] from a new reading and update the calibration
+void classify(int index, int reading) {
+  if (!AUTO_CALIBRATE) {
+    gridState[index] = reading < TOUCH_THRESHOLD ? 0 : 1;
+    return;
+  }
+  long x = (long)reading << 4;
+  if (calibrationScans < CALIBRATION_SCANS) {
+    // startup: plain mean over the calibration scans
+    int n = calibrationScans + 1;
+    baseline[index] += (x - baseline[index]) / n;
+    noise[index] += (labs(x - baseline[index]) - noise[index]) / n;
+    gridState[index] = 1;
+    return;
+  }
+  long drop = (baseline[index] - x) >> 4;
+  int on = touchDrop(index);
+  // hysteresis: a touched cell stays touched down to half the drop
+  if (gridState[index] == 0) {
+    gridState[index] = drop > on / 2 ? 0 : 1;
+  } else {
+    gridState[index] = drop > on ? 0 : 1;
+  }
+  if (gridState[index] == 1) {
+    baseline[index] += (x - baseline[index]) >> BASELINE_SHIFT;
+    noise[index] += (labs(x - baseline[index]) - noise[index]) >> BASELINE_SHIFT;
+  }
+}
+
+// report the current scan rate and mode (binary frames only)
+void sendStatus() {
+  if (!binaryFrames || !ADAPTIVE_RATE) {
+    return;
+  }
+  frameBuf[DATA_START] = scanHz & 0xFF;
+  frameBuf[DATA_START + 1] = (scanHz >> 8) & 0xFF;
+  frameBuf[DATA_START + 2] = scanMode;
+  sendFrame(TYPE_STATUS, STATUS_SIZE);
+}
+
+// drive every row LOW at once; true if any column sees a touch
+bool anyContact() {
+  for (int r = 0; r < ROW_COUNT; r++) {
+    digitalWrite(rowPins[r], LOW);
+  }
+  delayMicroseconds(10);
+  bool contact = false;
+  for (int c = 0; c < COL_COUNT; c++) {
+    if (analogRead(colPins[c]) < TOUCH_THRESHOLD) {
+      contact = true;
+      break;
+    }
+  }
+  for (int r = 0; r < ROW_COUNT; r++) {
+    digitalWrite(rowPins[r], HIGH);
+  }
+  return contact;
+}
+
+// switch between ACTIVE_HZ and IDLE_HZ, then wait until the next scan is due
+void pace(bool active) {
+  if (!ADAPTIVE_RATE) {
+    delay(50); // ~20Hz refresh rate
+    return;
+  }
+  unsigned long now = millis();
+  if (active) {
+    lastActiveMs = now;
+    if (scanMode != MODE_ACTIVE) {
+      scanMode = MODE_ACTIVE;
+      scanHz = ACTIVE_HZ;
+      sendStatus();
+      nextScanUs = micros(); // start of a touch: scan again right away
+      return;
+    }
+  } else if (scanMode == MODE_ACTIVE && now - lastActiveMs >= IDLE_AFTER_MS) {
+    scanMode = WAKE_ON_CHANGE ? MODE_WAKE : MODE_IDLE;
+    scanHz = IDLE_HZ;
+    sendStatus();
+  }
+  nextScanUs += 1000000UL / scanHz;
+  long remaining = (long)(nextScanUs - micros());
+  if (remaining > 0) {
+    delay(remaining / 1000);
+    delayMicroseconds(remaining % 1000);
+  } else {
+    nextScanUs = micros(); // running late: don't try to catch up
+  }
+}
+
+// ENC_* of the wire format in use
+uint8_t currentEncoding() {
+  if (!binaryFrames) {
+    return ENC_CSV;
+  }
+  if (ANALOG_FRAMES) {
+    return ENC_ANALOG;
+  }
+  return deltaFrames ? ENC_DELTA : ENC_KEYFRAMES;
+}
+
+// tell the Pi what this scanner is and how it is sending
+void sendDescriptor() {
+  unsigned int width = STRIP_WIDTH * 1000 + 0.5;
+  unsigned int gap = STRIP_GAP * 1000 + 0.5;
+  unsigned int hz = ADAPTIVE_RATE ? scanHz : 20;
+  frameBuf[DATA_START] = FIRMWARE_MAJOR;
+  frameBuf[DATA_START + 1] = FIRMWARE_MINOR;
+  frameBuf[DATA_START + 2] = hz & 0xFF;
+  frameBuf[DATA_START + 3] = hz >> 8;
+  frameBuf[DATA_START + 4] = ENCODINGS;
+  frameBuf[DATA_START + 5] = currentEncoding();
+  frameBuf[DATA_START + 6] = 0; // no spare rows
+  frameBuf[DATA_START + 7] = width & 0xFF;
+  frameBuf[DATA_START + 8] = width >> 8;
+  frameBuf[DATA_START + 9] = gap & 0xFF;
+  frameBuf[DATA_START + 10] = gap >> 8;
+  sendFrame(TYPE_DESCRIPTOR, DESCRIPTOR_SIZE);
+}
+
+// switch to a supported encoding; false if it is not one
+bool selectEncoding(uint8_t encoding) {
+  if (!(ENCODINGS & encoding)) {
+    return false;
+  }
+  binaryFrames = encoding != ENC_CSV;
+  if (!ANALOG_FRAMES) {
+    deltaFrames = encoding == ENC_DELTA;
+  }
+  return true;
+}
+
+// drain incoming commands, answering '?' and selects; true if a keyframe
+// is due (the Pi asked for one, or the encoding changed)
+bool keyframeRequested() {
+  bool requested = false;
+  bool describe = false;
+  while (Serial.available() > 0) {
+    int command = Serial.read();
+    uint8_t encoding = 0;
+    if (command == REQUEST_KEYFRAME) {
+      requested = true;
+    } else if (command == REQUEST_DESCRIPTOR) {
+      describe = true;
+    } else if (command == 'c') {
+      encoding = ENC_CSV;
+    } else if (command == 'k') {
+      encoding = ENC_KEYFRAMES;
+    } else if (command == 'd') {
+      encoding = ENC_DELTA;
+    } else if (command == 'a') {
+      encoding = ENC_ANALOG;
+    }
+    if (encoding && selectEncoding(encoding)) {
+      requested = true;
+      describe = true;
+    }
+  }
+  if (describe) {
+    sendDescriptor();
+  }
+  return requested;
+}
+
+// send gridState as a CSV line
+void sendCsv() {
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    Serial.print(gridState[i]);
+    // add comma if not the last element
+    if (i < (ROW_COUNT * COL_COUNT - 1)) {
+      Serial.print(',');
+    }
+  }
+  Serial.println();
 }
 
 void loop() {
@@ -48,10 +512,11 @@ void loop() {
     lastLedToggle = now;
   }
 
-  String dataString = "";
-
-  // scan the matrix
-  for (int r = 0; r < ROW_COUNT; r++) {
+  // scan the matrix (while idle in MODE_WAKE, only once a column sees
+  // contact; until then gridState still holds the last, untouched scan)
+  scanStartUs = micros();
+  bool skipScan = ADAPTIVE_RATE && scanMode == MODE_WAKE && !anyContact();
+  for (int r = 0; r < ROW_COUNT && !skipScan; r++) {
     // set current row to LOW (active)
     digitalWrite(rowPins[r], LOW);
     delayMicroseconds(10); // Small delay for signal to settle
@@ -60,28 +525,52 @@ void loop() {
       // read analog value from ADC
       int reading = analogRead(colPins[c]);
       int index = r * COL_COUNT + c;
+      adcValues[index] = reading;
 
-      // update grid state based on threshold
-      if (reading < TOUCH_THRESHOLD) {
-        gridState[index] = 0; // 0 = TOUCH
-      } else {
-        gridState[index] = 1; // 1 = NO TOUCH
-      }
-
-      dataString += String(gridState[index]);
-      // add comma if not the last element
-      if (index < (ROW_COUNT * COL_COUNT - 1)) {
-        dataString += ",";
-      }
+      // update grid state (0 = TOUCH, 1 = NO TOUCH) from the threshold
+      // or the cell's own calibration
+      classify(index, reading);
     }
 
     // reset current row to HIGH (inactive)
     digitalWrite(rowPins[r], HIGH);
   }
+  scanDurationUs = micros() - scanStartUs;
+  if (!skipScan && calibrationScans < CALIBRATION_SCANS) {
+    calibrationScans++;
+  }
 
-  // send grid state over serial to Raspberry Pi 5
-  Serial.println(dataString);
+  // send grid state over serial to Raspberry Pi 5 (commands are read in
+  // CSV mode too, so the Pi can switch to binary frames)
+  bool requested = keyframeRequested();
+  if (binaryFrames) {
+    loopsSinceKeyframe++;
+    bool periodic = loopsSinceKeyframe >= KEYFRAME_INTERVAL || requested;
+    if (ANALOG_FRAMES) {
+      if (!deltaFrames || periodic) {
+        sendAnalogKeyframe();
+      } else {
+        sendAnalogDelta();
+      }
+    } else if (!deltaFrames || periodic) {
+      sendKeyframe();
+    } else {
+      sendDelta();
+    }
+    if (periodic) {
+      sendStatus();
+      loopsSinceKeyframe = 0;
+    }
+  } else {
+    sendCsv();
+  }
 
-  // wait 50ms for a ~20Hz refresh rate
-  delay(50);
+  // anything touched keeps the fast rate (a release follows a touched scan)
+  bool active = false;
+  for (int i = 0; i < ROW_COUNT * COL_COUNT; i++) {
+    if (gridState[i] == 0) {
+      active = true;
+    }
+  }
+  pace(active);
 }
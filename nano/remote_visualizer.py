@@ -3,72 +3,133 @@
 Remote visualizer for Arduino Nano grid data.
 This script connects to the serial forwarder on the Pi 5 and visualizes the grid.
 Run this on your remote device after SSH port forwarding.
+
+Usage: python3 remote_visualizer.py [delta | full | touches | decimate:HZ]
+  Chooses what the forwarder sends (default: delta, the frames as the
+  scanner sent them). "touches" prints touch events instead of grids;
+  "decimate:5" draws at most 5 grids a second.
+  Grids are drawn at most MAX_FPS times a second whatever the forwarder
+  sends (the newest one wins); touch events are all printed. The grid
+  size comes from the sensor's descriptor, which the forwarder relays;
+  GRID_ROWS x GRID_COLS is assumed until one arrives.
 """
 
+import os
 import socket
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ceferss.calibration import Calibrator
+from ceferss.handshake import GeometryError, check_geometry
+from ceferss.mailbox import DisplayScheduler, Mailbox, start_ingest
+from ceferss.protocol import (REQUEST_KEYFRAME, SUB_TOUCHES, SUBSCRIBE,
+                              TYPE_TOUCH_SNAPSHOT, parse_subscription)
+from ceferss.stream import FrameReader
+
 # --- Configuration ---
 TCP_HOST = 'localhost'  # After SSH port forwarding
 TCP_PORT = 5555
 GRID_ROWS = 5
 GRID_COLS = 5
+MAX_FPS = 20  # grids printed per second; newer frames coalesce
 
-def visualize_grid(grid_states):
+def visualize_grid(frame):
     """Simple ASCII visualization of the grid."""
     print("\n" + "="*30)
+    # touch shows as █, no touch as ░
+    cells = ["█ " if t else "░ " for t in frame.grid().ravel().tolist()]
+    cells += ["? "] * (GRID_ROWS * GRID_COLS - len(cells))
     for r in range(GRID_ROWS):
-        row_str = ""
-        for c in range(GRID_COLS):
-            index = r * GRID_COLS + c
-            if index < len(grid_states):
-                # '0' = touch (show as █), '1' = no touch (show as ░)
-                row_str += "█ " if grid_states[index] == '0' else "░ "
-            else:
-                row_str += "? "
-        print(row_str)
+        print("".join(cells[r * GRID_COLS:(r + 1) * GRID_COLS]))
     print("="*30)
 
+def show_touches(frame, touches):
+    """Print touch events and keep `touches` (id -> event) current."""
+    if frame.frame_type == TYPE_TOUCH_SNAPSHOT:
+        touches.clear()
+    for event in frame.touches:
+        if event.kind == "up":
+            touches.pop(event.id, None)
+        else:
+            touches[event.id] = event
+        print(f"{event.kind:<4} #{event.id:<3} x={event.x:5.2f} "
+              f"y={event.y:5.2f} cells={event.cells}")
+    print(f"{len(touches)} touch(es) down")
+
+def follow_touches(sock, reader):
+    """Print every touch event until the connection closes."""
+    touches = {}
+    while True:
+        # Receive straight into the reader's buffer
+        frames = reader.read_socket(sock)
+        if frames is None:
+            raise ConnectionError("Connection closed by server")
+        for frame in frames:
+            if frame.touches is not None:
+                show_touches(frame, touches)
+        # Missed a frame: the forwarder answers with a snapshot
+        if reader.resync_needed:
+            sock.sendall(REQUEST_KEYFRAME)
+            reader.resync_needed = False
+
 def main():
     """Connect to the serial forwarder and visualize data."""
+    global GRID_ROWS, GRID_COLS
+    subscription = sys.argv[1] if len(sys.argv) > 1 else "delta"
+    request = SUBSCRIBE + subscription.encode() + b"\n"
+    parsed = parse_subscription(request)
+    if parsed is None:
+        print(f"Unknown subscription: {subscription}")
+        print("Usage: python3 remote_visualizer.py [delta | full | touches | decimate:HZ]")
+        sys.exit(1)
     try:
         print(f"Connecting to serial forwarder at {TCP_HOST}:{TCP_PORT}...")
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect((TCP_HOST, TCP_PORT))
-        print("Connected! Receiving data...")
+        sock.sendall(request)
+        print(f"Connected! Receiving {subscription}...")
         
-        buffer = b""
+        reader = FrameReader()
+        if parsed[0] == SUB_TOUCHES:
+            # Events only make sense in full: never coalesced
+            follow_touches(sock, reader)
         
+        # Received on its own thread (keyframes requested after a missed
+        # delta); only the newest grid is printed
+        mailbox = Mailbox()
+        ingest, stop_ingest = start_ingest(sock, mailbox, reader)
+        scheduler = DisplayScheduler(mailbox, MAX_FPS, reader)
+        # Analog frames: touch bits from per-cell baselines, not one
+        # threshold
+        calibrator = Calibrator()
         while True:
-            # Receive data
-            data = sock.recv(1024)
-            if not data:
-                print("Connection closed by server")
-                break
-            
-            buffer += data
-            
-            # Process complete lines
-            while b'\n' in buffer:
-                line, buffer = buffer.split(b'\n', 1)
-                line_str = line.decode('utf-8').strip()
-                
-                # Validate and visualize
-                if line_str and line_str.count(',') == (GRID_ROWS * GRID_COLS - 1):
-                    grid_states = line_str.split(',')
-                    visualize_grid(grid_states)
-                    print(f"Raw data: {line_str}")
-                else:
-                    print(f"Invalid data: {line_str}")
+            # Complete frames (binary or CSV lines), deltas applied
+            frame = scheduler.next_frame()
+            # The reader keeps the latest descriptor, even if its frame
+            # was coalesced away
+            if reader.descriptor is not None:
+                GRID_ROWS = reader.descriptor.rows
+                GRID_COLS = reader.descriptor.cols
+            check_geometry(frame, GRID_ROWS, GRID_COLS)
+            if frame.count:
+                calibrator.apply(frame)
+                visualize_grid(frame)
+                print(f"Raw data: {','.join(frame.states())}")
                     
     except ConnectionRefusedError:
         print(f"Error: Could not connect to {TCP_HOST}:{TCP_PORT}")
         print("Make sure:")
         print("1. The serial forwarder is running on the Pi 5")
         print(f"2. You've set up SSH port forwarding: ssh -L {TCP_PORT}:localhost:{TCP_PORT} user@pi5")
+    except ConnectionError as e:
+        print(e)
+    except GeometryError as e:
+        print(f"Error: {e}")
     except KeyboardInterrupt:
         print("\nStopping visualizer...")
     finally:
+        if 'scheduler' in locals():
+            print(scheduler.summary())
         if 'sock' in locals():
             sock.close()
 
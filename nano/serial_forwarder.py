@@ -2,113 +2,433 @@
 """
 Serial-to-TCP forwarder for Arduino Nano grid data.
 This script reads from the Arduino Nano and forwards the data to any connected TCP clients.
+
+Everything runs on one asyncio event loop. The serial port is opened
+non-blocking and read from loop.add_reader, so no thread ever waits on it.
+Each client gets a bounded send queue: frames are written straight to the
+socket while it keeps up, and only queue (dropping the oldest, or keeping
+just the latest frame) once that client's socket buffer fills. A slow
+SSH-tunnelled client therefore only ever delays itself.
+
+Clients choose what they receive with a one-line subscription right
+after connecting (ceferss.protocol.SUBSCRIBE): the frames as the scanner
+sent them (the default, also for clients that send nothing), every frame
+as a keyframe, touch events only (ceferss.touches), or keyframes
+decimated to a maximum rate. Each representation is encoded once per
+frame and shared by every client that asked for it, so a viewer on a
+slow SSH tunnel can take a few hundred bytes a second of touch events
+instead of the whole stream.
+
+On opening the port the forwarder asks the scanner for its descriptor
+and the fastest encoding (ceferss.handshake). The descriptor is relayed
+to every client, first thing on subscribing, so they learn the grid size
+without asking the scanner themselves; it also sizes CSV frames and
+places touches in inches.
+
+Latency percentiles (scan/transfer/parse/fanout, see ceferss/latency.py)
+are served as JSON on STATS_PORT, e.g. `curl localhost:5557`, and
+printed on SIGUSR1.
+
+Usage: python3 serial_forwarder.py [serial_port | recording.cfr [speed]]
+  A recording (ceferss.recording) is broadcast at speed x real time
+  (default 1, or "max") instead of reading the port.
 """
 
-import serial
-import socket
-import threading
+import asyncio
+import json
+import os
+import sys
 import time
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ceferss.calibration import Calibrator
+from ceferss.fanout import Client, Packet
+from ceferss.handshake import RETRY_INTERVAL, Handshake, describe
+from ceferss.latency import LatencyStats, now_us
+from ceferss.protocol import (REQUEST_KEYFRAME, SUB_DECIMATE, SUB_DELTA,
+                              SUB_FULL, SUB_TOUCHES, SUBSCRIBE,
+                              encode_touches, parse_subscription)
+from ceferss.recording import Recording, is_recording, parse_speed, pump_replay
+from ceferss.stream import pump_serial
+from ceferss.touches import TouchTracker
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyUSB0'
 BAUD_RATE = 115200
 TCP_HOST = '0.0.0.0'  # Listen on all network interfaces
 TCP_PORT = 5555       # Port for clients to connect to
+STATS_PORT = 5557     # Latency stats as JSON over HTTP
+
+# Per-client flow control
+CLIENT_QUEUE_SIZE = 32            # frames queued before dropping
+CLIENT_BUFFER_LIMIT = 16 * 1024   # socket bytes pending before queueing
+QUEUE_POLICY = 'drop-oldest'      # 'drop-oldest' or 'latest'
+
+# Subscriptions
+HANDSHAKE_TIMEOUT = 0.2           # seconds to wait for a subscription line
+CSV_GRID = (5, 5)                 # CSV frames (no header), until a descriptor
+
+# Connected clients
+clients = set()
+
+# Clients by representation; decimated ones grouped by maximum rate
+delta_clients = set()
+full_clients = set()
+touch_clients = set()
+decimators = {}
+
+# Most recent frame, sent as a keyframe to new clients and on request
+last_packet = None
+# The scanner's latest descriptor frame, sent to new clients first
+descriptor_packet = None
+
+# Touch tracking runs only while someone subscribes to touch events
+tracker = None
+last_touches = None
+# Per-cell touch decisions for analog frames, fed every frame so the
+# baselines are warm when a touch client subscribes
+calibrator = Calibrator()
+
+stats = LatencyStats()
+
+
+class Decimator:
+    """Clients that want the newest frame at most max_hz times a second.
+
+    A frame arriving too early is held back and sent when the period is
+    up, unless a newer one replaces it first, so the last state before
+    the stream goes quiet always gets through.
+    """
+
+    def __init__(self, max_hz):
+        self.max_hz = max_hz
+        self.period = 1 / max_hz
+        self.clients = set()
+        self.last_sent = float("-inf")
+        self.pending = None
+        self._timer = None
+
+    def offer(self, packet):
+        now = time.monotonic()
+        if now - self.last_sent >= self.period:
+            self._send(packet, now)
+            return
+        self.pending = packet
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.last_sent + self.period - now, self._flush)
+
+    def _flush(self):
+        self._timer = None
+        if self.pending is not None:
+            self._send(self.pending, time.monotonic())
+
+    def _send(self, packet, now):
+        self.pending = None
+        self.last_sent = now
+        for client in self.clients:
+            client.offer(packet)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def track_touches(frame):
+    """Touch events for a frame, as a Packet (None if nothing changed)."""
+    global tracker, last_touches
+    descriptor = None
+    if descriptor_packet is not None:
+        descriptor = descriptor_packet.frame.descriptor
+    if frame.rows is not None:
+        rows, cols = frame.rows, frame.cols
+    elif descriptor is not None:
+        rows, cols = descriptor.rows, descriptor.cols
+    else:
+        rows, cols = CSV_GRID
+    if frame.count != rows * cols:
+        return None
+    if tracker is None or (tracker.rows, tracker.cols) != (rows, cols):
+        # Strip geometry as the scanner reports it, else designs_info.txt
+        geometry = {}
+        if descriptor is not None and descriptor.width:
+            geometry = {"width": descriptor.width, "gap": descriptor.gap}
+        tracker = TouchTracker.for_grid(rows, cols, **geometry)
+    intensity = None
+    if frame.values is not None:
+        intensity = calibrator.intensity(frame.values)
+    events = tracker.update(frame, intensity)
+    if not events:
+        return None
+    touches = tracker.snapshot()
+    seq = frame.seq
+    last_touches = Packet(
+        None, encode_touches(events, rows, cols, seq),
+        keyframe=lambda: encode_touches(touches, rows, cols, seq, True))
+    return last_touches
+
+
+def touch_snapshot():
+    """Every current touch, for a client that just subscribed."""
+    if tracker is None:
+        return None
+    rows, cols = tracker.rows, tracker.cols
+    data = encode_touches(tracker.snapshot(), rows, cols,
+                          None if last_packet is None
+                          else last_packet.frame.seq, True)
+    return Packet(None, data)
+
+
+def broadcast_to_clients(frame):
+    """Send a frame to all connected clients, in the form each asked for."""
+    global last_packet, descriptor_packet
+    if frame.descriptor is not None:
+        descriptor_packet = Packet(frame)
+        for client in clients - touch_clients:
+            client.offer(descriptor_packet)
+        return
+    start = now_us()
+    stats.frame_received(frame, start)
+    # Analog bits from per-cell baselines, not the one threshold sent
+    calibrator.apply(frame)
+    packet = Packet(frame)
+    last_packet = packet
+    for client in delta_clients:
+        client.offer(packet)
+    if full_clients or decimators:
+        # One keyframe encoding for every full and decimated client
+        full = Packet(frame, packet.keyframe(), packet.keyframe())
+        for client in full_clients:
+            client.offer(full)
+        for decimator in decimators.values():
+            decimator.offer(full)
+    if touch_clients:
+        touches = track_touches(frame)
+        if touches is not None:
+            for client in touch_clients:
+                client.offer(touches)
+    stats.record("fanout", now_us() - start)
+
+
+def unsubscribe(client):
+    delta_clients.discard(client)
+    full_clients.discard(client)
+    touch_clients.discard(client)
+    for max_hz, decimator in list(decimators.items()):
+        decimator.clients.discard(client)
+        if not decimator.clients:
+            decimator.close()
+            del decimators[max_hz]
 
-# List to store connected clients
-clients = []
-clients_lock = threading.Lock()
 
-def handle_client(client_socket, client_address):
-    """Handle a connected client."""
-    print(f"New client connected: {client_address}")
-    with clients_lock:
-        clients.append(client_socket)
-    
+def subscribe(client, name, max_hz=None):
+    """Move a client to a representation and send it a starting point."""
+    global tracker
+    unsubscribe(client)
+    if name == SUB_TOUCHES:
+        if not touch_clients:
+            # Tracking was off: pick the touches up from the newest frame
+            tracker = None
+            if last_packet is not None:
+                track_touches(last_packet.frame)
+        touch_clients.add(client)
+        snapshot = touch_snapshot()
+        if snapshot is not None:
+            client.offer(snapshot, keyframe=True)
+        return
+    if name == SUB_DECIMATE:
+        decimator = decimators.get(max_hz)
+        if decimator is None:
+            decimator = decimators[max_hz] = Decimator(max_hz)
+        decimator.clients.add(client)
+    elif name == SUB_FULL:
+        full_clients.add(client)
+    else:
+        delta_clients.add(client)
+    if descriptor_packet is not None:
+        client.offer(descriptor_packet)
+    if last_packet is not None:
+        client.offer(last_packet, keyframe=True)
+
+
+def resend(client):
+    """Answer a keyframe request in the client's representation."""
+    if client in touch_clients:
+        snapshot = touch_snapshot()
+        if snapshot is not None:
+            client.offer(snapshot, keyframe=True)
+    elif last_packet is not None:
+        client.offer(last_packet, keyframe=True)
+
+
+def handle_input(client, data):
+    """Act on keyframe requests and subscription lines from a client.
+
+    Returns the start of a subscription line still waiting for its
+    newline, to be passed back with the next read.
+    """
+    while data:
+        start = data.find(SUBSCRIBE)
+        if REQUEST_KEYFRAME in (data if start < 0 else data[:start]):
+            resend(client)
+        if start < 0:
+            return b""
+        end = data.find(b"\n", start)
+        if end < 0:
+            return data[start:start + 64]
+        line = data[start:end]
+        subscription = parse_subscription(line)
+        if subscription is None:
+            print(f"Client {client.address} sent an unknown subscription")
+            subscription = (SUB_DELTA, None)
+        subscribe(client, *subscription)
+        print(f"Client {client.address} subscribed to "
+              f"{line[len(SUBSCRIBE):].decode(errors='replace')}")
+        data = data[end + 1:]
+    return b""
+
+
+async def handle_client(reader, writer):
+    """Handle a connected client until it disconnects."""
+    client = Client(writer, CLIENT_QUEUE_SIZE, CLIENT_BUFFER_LIMIT, QUEUE_POLICY)
+    print(f"New client connected: {client.address}")
+    clients.add(client)
+    sender = asyncio.create_task(client.send_queued())
+
     try:
-        # Keep the connection alive until the client disconnects
-        while True:
-            time.sleep(1)
-    except Exception as e:
-        print(f"Client {client_address} error: {e}")
+        # A subscription comes first, if at all; older clients send
+        # nothing (or only keyframe requests) and get the frames as sent
+        try:
+            data = await asyncio.wait_for(reader.read(64), HANDSHAKE_TIMEOUT)
+        except asyncio.TimeoutError:
+            data = None
+        if data is None or SUBSCRIBE not in data:
+            subscribe(client, SUB_DELTA)
+        pending = b""
+        # Then keyframe requests or subscription changes; EOF = disconnect
+        while data != b"":
+            if data:
+                pending = handle_input(client, pending + data)
+            data = await reader.read(64)
+    except (ConnectionError, OSError) as e:
+        print(f"Client {client.address} error: {e}")
     finally:
-        with clients_lock:
-            if client_socket in clients:
-                clients.remove(client_socket)
-        client_socket.close()
-        print(f"Client disconnected: {client_address}")
-
-def broadcast_to_clients(data):
-    """Send data to all connected clients."""
-    with clients_lock:
-        disconnected = []
-        for client in clients:
-            try:
-                client.sendall(data)
-            except Exception as e:
-                print(f"Error sending to client: {e}")
-                disconnected.append(client)
-        
-        # Remove disconnected clients
-        for client in disconnected:
-            clients.remove(client)
-            client.close()
-
-def serial_reader(ser):
-    """Read from serial port and broadcast to all clients."""
-    print(f"Reading from {SERIAL_PORT}...")
+        clients.discard(client)
+        unsubscribe(client)
+        sender.cancel()
+        writer.close()
+        if client.dropped:
+            print(f"Client {client.address} dropped {client.dropped} frames")
+        print(f"Client disconnected: {client.address}")
+
+
+async def handle_stats(reader, writer):
+    """Answer any request on the stats port with the current percentiles."""
+    try:
+        await asyncio.wait_for(reader.read(1024), timeout=1)
+    except asyncio.TimeoutError:
+        pass
+    body = json.dumps({
+        "clients": len(clients),
+        "dropped": sum(client.dropped for client in clients),
+        "subscriptions": {
+            SUB_DELTA: len(delta_clients),
+            SUB_FULL: len(full_clients),
+            SUB_TOUCHES: len(touch_clients),
+            SUB_DECIMATE: {f"{max_hz:g}": len(decimator.clients)
+                           for max_hz, decimator in decimators.items()},
+        },
+        "latency_us": stats.snapshot(),
+    }).encode()
+    writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                 + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    try:
+        await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    writer.close()
+
+
+async def serial_reader(port=SERIAL_PORT):
+    """Read the serial port without blocking and broadcast every frame."""
     while True:
         try:
-            if ser.in_waiting > 0:
-                line = ser.readline()
-                print(f"Received: {line.decode('utf-8').strip()}")
-                broadcast_to_clients(line)
-        except Exception as e:
+            ser = serial.Serial(port, BAUD_RATE, timeout=0)
+        except serial.SerialException as e:
+            print(f"Serial open error: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        print(f"Reading from {port}...")
+        # Descriptor and encoding negotiated on the frames as they come;
+        # the task repeats the request while the scanner is silent
+        handshake = Handshake()
+        handshake.start(ser)
+        retries = asyncio.create_task(negotiate(ser, handshake))
+
+        def on_frame(frame):
+            if not handshake.done and handshake.update(frame, ser):
+                print(describe(handshake.descriptor))
+            broadcast_to_clients(frame)
+
+        try:
+            await pump_serial(ser, on_frame)
+        except OSError as e:
             print(f"Serial read error: {e}")
-            time.sleep(1)
+        finally:
+            retries.cancel()
+            ser.close()
+        await asyncio.sleep(1)
+
+
+async def negotiate(ser, handshake):
+    """Poll a Handshake until it is over, for when no frames arrive."""
+    while not handshake.done:
+        await asyncio.sleep(RETRY_INTERVAL)
+        if not handshake.done and handshake.poll(ser):
+            print(describe(handshake.descriptor))
+
+
+async def replay_reader(path, speed):
+    """Broadcast the frames of a recording instead of reading the port."""
+    with Recording(path) as recording:
+        print(f"Replaying {path} ({recording.duration_us / 1e6:.1f} s) "
+              f"at {'max' if speed is None else speed}x speed...")
+        await pump_replay(recording, broadcast_to_clients, speed)
+    print("Replay finished")
+
+
+async def serve(port=SERIAL_PORT, speed=1.0):
+    """Start the TCP server next to the serial reader."""
+    server = await asyncio.start_server(handle_client, TCP_HOST, TCP_PORT,
+                                        reuse_address=True)
+    stats_server = await asyncio.start_server(handle_stats, TCP_HOST,
+                                              STATS_PORT, reuse_address=True)
+    print(f"TCP server listening on {TCP_HOST}:{TCP_PORT}")
+    print(f"Clients can connect using: ssh -L {TCP_PORT}:localhost:{TCP_PORT} user@pi5-hostname")
+    print(f"Latency stats: curl http://localhost:{STATS_PORT}/")
+    print("Press Ctrl+C to stop")
+    async with server, stats_server:
+        if is_recording(port):
+            source = replay_reader(port, speed)
+        else:
+            source = serial_reader(port)
+        await asyncio.gather(server.serve_forever(),
+                             stats_server.serve_forever(), source)
+
 
 def main():
     """Main function to start the serial forwarder."""
+    port = sys.argv[1] if len(sys.argv) > 1 else SERIAL_PORT
+    speed = parse_speed(sys.argv[2] if len(sys.argv) > 2 else None)
+    stats.install_dump_signal()
     try:
-        # Open serial port
-        print(f"Opening serial port {SERIAL_PORT}...")
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
-        ser.flush()
-        print(f"Serial port opened successfully")
-        
-        # Start serial reader thread
-        serial_thread = threading.Thread(target=serial_reader, args=(ser,), daemon=True)
-        serial_thread.start()
-        
-        # Create TCP server
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((TCP_HOST, TCP_PORT))
-        server_socket.listen(5)
-        
-        print(f"TCP server listening on {TCP_HOST}:{TCP_PORT}")
-        print(f"Clients can connect using: ssh -L {TCP_PORT}:localhost:{TCP_PORT} user@pi5-hostname")
-        print("Press Ctrl+C to stop")
-        
-        # Accept client connections
-        while True:
-            client_socket, client_address = server_socket.accept()
-            client_thread = threading.Thread(
-                target=handle_client, 
-                args=(client_socket, client_address), 
-                daemon=True
-            )
-            client_thread.start()
-            
-    except serial.SerialException as e:
-        print(f"Error: Could not open serial port {SERIAL_PORT}. {e}")
+        asyncio.run(serve(port, speed))
     except KeyboardInterrupt:
         print("\nStopping server...")
-    finally:
-        if 'ser' in locals() and ser.is_open:
-            ser.close()
-        if 'server_socket' in locals():
-            server_socket.close()
+
 
 if __name__ == "__main__":
     main()
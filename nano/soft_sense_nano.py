@@ -1,98 +1,147 @@
+import os
+import sys
 import serial
 from luma.core.interface.serial import i2c
-from luma.core.render import canvas
 from luma.oled.device import sh1106
-import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ceferss.calibration import Calibrator
+from ceferss.debounce import Debouncer
+from ceferss.handshake import GeometryError, check_geometry, describe, handshake
+from ceferss.oled import grid_renderer
+from ceferss.mailbox import DisplayScheduler, Mailbox, start_ingest
+from ceferss.latency import LatencyStats, now_us
+from ceferss.ports import find_serial_port
+from ceferss.recording import ReplayPort, is_recording, parse_speed
+from ceferss.stream import FrameReader
 
 # --- SYSTEM CONFIG ---
 SERIAL_PORT = '/dev/ttyUSB0'
 BAUD_RATE = 115200
+MAX_FPS = 60 # OLED updates per second; newer frames coalesce
 
 # --- GRID CONFIG ---
 CELL_SIZE = 10
 CELL_GAP = 2
+# Used only if the Nano does not describe itself (older firmware):
 GRID_COLS = 5
 GRID_ROWS = 5 # Display a 5x5 grid
 
-GRID_WIDTH = (CELL_SIZE * GRID_COLS) + (CELL_GAP * (GRID_COLS - 1))
-GRID_HEIGHT = (CELL_SIZE * GRID_ROWS) + (CELL_GAP * (GRID_ROWS - 1))
-
-def draw_grid(device, grid_states, offset_x, offset_y):
-    """Draw the entire grid based on the current states."""
-    with canvas(device) as draw:
-        for r in range(GRID_ROWS):
-            for c in range(GRID_COLS):
-                index = r * GRID_COLS + c
-                
-                x1 = offset_x + (c * (CELL_SIZE + CELL_GAP))
-                y1 = offset_y + (r * (CELL_SIZE + CELL_GAP))
-                x2 = x1 + CELL_SIZE
-                y2 = y1 + CELL_SIZE
-                
-                # print(grid_states[index])
-                # '0' means touch (LOW), so we fill the square
-                # Pico sends 0 for touch, 1 for no touch
-                if index < len(grid_states) and grid_states[index] == '0':
-                    draw.rectangle((x1, y1, x2, y2), outline="white", fill="white")
-                else:
-                    draw.rectangle((x1, y1, x2, y2), outline="white", fill="black")
+# --- DEBOUNCE CONFIG ---
+# The Nano sends every raw change: a cell must hold its new state for
+# DEBOUNCE_SCANS scans before it is drawn, adding at most MAX_DEBOUNCE_MS
+# (fewer scans if the rate is too low for that). 1 = off
+DEBOUNCE_SCANS = 2
+MAX_DEBOUNCE_MS = 50
 
 def main():
+    # Optional: a recording to replay instead of the serial port, and speed;
+    # otherwise the Nano found by USB id, or SERIAL_PORT
+    port = sys.argv[1] if len(sys.argv) > 1 else find_serial_port("nano") or SERIAL_PORT
     try:
         i2c_bus = i2c(port=1, address=0x3C)
         device = sh1106(i2c_bus, rotate=0)
         device.clear()
-        
-        OFFSET_X = (device.width - GRID_WIDTH) // 2
-        OFFSET_Y = (device.height - GRID_HEIGHT) // 2
 
-        print(f"Connecting to Arduino Nano on {SERIAL_PORT}...")
-        # --- OPTIMIZATION: Reduce timeout to prevent long hangs ---
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
+        print(f"Connecting to Arduino Nano on {port}...")
+        if is_recording(port):
+            speed = parse_speed(sys.argv[2] if len(sys.argv) > 2 else None)
+            ser = ReplayPort(port, speed)
+        else:
+            # --- OPTIMIZATION: Reduce timeout to prevent long hangs ---
+            ser = serial.Serial(port, BAUD_RATE, timeout=0.1)
         ser.flush()
-        print("Connection successful. Reading 5x5 grid from Nano...")
+        reader = FrameReader()
+        # Grid size and the fastest encoding from the Nano's descriptor
+        # (it resets when the port opens, so this waits for it to boot);
+        # the constants above for firmware without one
+        descriptor = handshake(ser, reader)
+        if not is_recording(port):
+            print(describe(descriptor))
+        if descriptor is not None:
+            grid_rows = descriptor.rows
+            grid_cols = descriptor.cols
+        else:
+            grid_rows = GRID_ROWS
+            grid_cols = GRID_COLS
+
+        # --- OPTIMIZATION: Persistent image, only changed cells are redrawn
+        # and only the OLED pages they cover are sent over I2C ---
+        renderer = grid_renderer(device, grid_rows, grid_cols, CELL_SIZE, CELL_GAP)
+        # --- OPTIMIZATION: Serial is read on its own thread; the render
+        # loop only ever sees the newest frame, older ones are coalesced ---
+        mailbox = Mailbox()
+        # Per-stage latency percentiles; `kill -USR1 <pid>` prints them
+        stats = LatencyStats()
+        stats.install_dump_signal()
+        # Digital frames only; analog ones have the calibrator's hysteresis
+        debouncer = None
+        if DEBOUNCE_SCANS > 1:
+            debouncer = Debouncer(grid_rows, grid_cols, DEBOUNCE_SCANS,
+                                  MAX_DEBOUNCE_MS, stats=stats)
+        ingest, stop_ingest = start_ingest(ser, mailbox, reader, stats,
+                                           debouncer)
+        scheduler = DisplayScheduler(mailbox, MAX_FPS, reader)
+        print(f"Connection successful. Reading {grid_rows}x{grid_cols} grid from Nano...")
 
         # Initialize with an empty grid state
-        grid_states = ['1'] * (GRID_ROWS * GRID_COLS)
+        grid_bits = 0
+        # Analog frames: per-cell baseline and noise, tracking drift
+        calibrator = Calibrator()
         
         # --- OPTIMIZATION: Draw the initial empty grid once ---
-        draw_grid(device, grid_states, OFFSET_X, OFFSET_Y)
+        renderer.render(grid_bits)
         
         while True:
-         # Check if there's data waiting in the serial buffer
-         if ser.in_waiting > 0:
-             try:
-                 line = ser.readline().decode('utf-8').strip()
-                 print(f"Received: {line}")  # Debug output
-                 
-                 # Ensure the line is not empty and has the correct format
-                 if line and line.count(',') == (GRID_ROWS * GRID_COLS - 1):
-                     new_states = line.split(',')
-                     
-                     # --- OPTIMIZATION: Only redraw if the state has changed ---
-                     if new_states != grid_states:
-                         grid_states = new_states
-                         draw_grid(device, grid_states, OFFSET_X, OFFSET_Y)
-                         print(f"Updated grid: {grid_states}")
-                 else:
-                     print(f"Invalid data format: {line}")
-                     
-             except UnicodeDecodeError:
-                 # Handle cases where incomplete data is read
-                 print("Warning: UnicodeDecodeError. Flushing input.")
-                 ser.flushInput()
+            # Blocks until the ingest thread posts a frame, at most MAX_FPS
+            # times a second; binary frames and CSV lines are both
+            # accepted, deltas arrive already applied
+            frame = scheduler.next_frame()
+            stats.record("queue", mailbox.wait_us)
+            # A Nano scanning another grid stops us here, once
+            check_geometry(frame, grid_rows, grid_cols)
+            if not frame.count:
+                continue
             
-        # Sleep briefly to yield CPU time. 20Hz = 50ms.
-        # We can sleep for less to ensure high responsiveness.
-        time.sleep(0.02) # Loop at ~50Hz
+            if frame.values is not None:
+                # Analog frames (ANALOG_FRAMES in the firmware): pressure
+                # heatmap, only cells whose fill height changed are redrawn
+                calibrator.apply(frame)
+                render_start = now_us()
+                renderer.render_intensity(calibrator.intensity(frame.values))
+                stats.record("render", now_us() - render_start)
+                stats.record("i2c", renderer.push_us)
+                stats.frame_shown(frame)
+            # --- OPTIMIZATION: Only redraw if the state has changed ---
+            elif frame.bits != grid_bits:
+                grid_bits = frame.bits
+                render_start = now_us()
+                renderer.render(grid_bits)
+                stats.record("render", now_us() - render_start)
+                stats.record("i2c", renderer.push_us)
+                stats.frame_shown(frame)
+                print(f"Updated grid: {grid_bits:0{grid_rows * grid_cols}b}")
 
     except serial.SerialException as e:
-        print(f"Error: Could not open serial port {SERIAL_PORT}. {e}")
+        print(f"Error: Serial port {port} failed. {e}")
+    except GeometryError as e:
+        print(f"Error: {e}. Check GRID_ROWS / GRID_COLS or the firmware.")
     except FileNotFoundError:
-        print(f"Error: Serial port {SERIAL_PORT} not found.")
+        print(f"Error: Serial port {port} not found.")
     except KeyboardInterrupt:
         print("\nProgram stopped.")
     finally:
+        if 'stop_ingest' in locals():
+            stop_ingest.set()
+            ingest.join(timeout=1)
+        if 'debouncer' in locals() and debouncer is not None:
+            print(f"Debounce: {debouncer.depth} scans "
+                  f"(+{debouncer.latency_ms:.0f} ms), "
+                  f"{debouncer.glitches} glitches filtered")
+        if 'scheduler' in locals():
+            print(scheduler.summary())
+        if 'stats' in locals():
+            print(stats.format())
         if 'ser' in locals() and ser.is_open:
             ser.close()
         if 'device' in locals():
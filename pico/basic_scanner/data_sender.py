@@ -12,14 +12,58 @@
 #    - PULL_UP on columns prevents floating-pin false positives
 #
 #  Output format (plain UART / USB serial, 115200 baud):
-#    One CSV line per scan: 81 comma-separated values, '0'=contact '1'=open
+#    BINARY_FRAMES = True:  binary frames (see ../wire_format.py, upload
+#                           it alongside). With DELTA_FRAMES only flipped
+#                           cells are sent, plus a 20-byte keyframe every
+#                           KEYFRAME_INTERVAL scans or when the PC writes 'K'
+#    BINARY_FRAMES = False: one CSV line per scan, 81 comma-separated
+#                           values, '0'=contact '1'=open
 #    Example: 1,1,0,1,1,1,1,1,1,1,0,1,...\n
 #
+#  SCAN_ENGINE = "timer" or "pio" replaces the sleep-paced loop with the
+#  background engines in ../scan_engine.py (upload it alongside): rows are
+#  strobed at SCAN_RATE_HZ with µs settling, one GPIO_IN read per row.
+#
+#  BULK_READ = True keeps the loop below but reads all columns of a row
+#  with one GPIO_IN register read (also from ../scan_engine.py) into a
+#  preallocated array, settling SETTLE_US instead of SETTLE_MS: binary
+#  frames are then built without any heap allocation.
+#
+#  SCANNER = "mcp23017" or "shift" runs the same loop through GPIO
+#  expanders (../expander.py, upload it alongside) for grids larger than
+#  the Pico's pins allow: MCP23017s on I2C1 (GP26 SDA, GP27 SCL, from
+#  0x20, row chips first), or 74HC595 rows and 74HC165 columns on SPI0
+#  (GP18 SCK, GP19 MOSI, GP20 MISO, RCLK GP21, SH/LD GP22). Each row is
+#  a couple of multi-byte bus transfers; set NUM_ROWS / NUM_COLS to match.
+#
+#  ADAPTIVE_RATE paces the loop at ACTIVE_HZ while anything is touched or
+#  changing and IDLE_HZ after IDLE_AFTER_MS of quiet (with WAKE_ON_CHANGE
+#  the idle scan is one all-rows-driven column read). Binary frames
+#  report each change of rate in a status frame.
+#
+#  DEBOUNCE_SCANS > 1 holds back every cell change until the new level
+#  has lasted that many scans (Debouncer in ../scan_engine.py), using
+#  fewer where that would add more than MAX_DEBOUNCE_MS. Binary frames
+#  report the depth in use in the status frame.
+#
+#  The PC may write '?' for a descriptor frame (grid size, scan rate,
+#  encodings, FIRMWARE_VERSION and the strip geometry of the PICO design
+#  in designs_info.txt), and 'c', 'k' or 'd' to switch to CSV lines,
+#  keyframes or deltas (ceferss.handshake does both).
+#
 #  Run matrix_visualizer.py on your PC to display this data.
 # ============================================================
 from machine import Pin, UART
+import machine
+import select
 import sys
 import time
+from array import array
+from wire_format import (FrameWriter, MODE_ACTIVE, MODE_WAKE, REQUEST_KEYFRAME,
+                         REQUEST_DESCRIPTOR, ENC_CSV, ENC_KEYFRAMES, ENC_DELTA,
+                         SELECT_COMMANDS)
+
+FIRMWARE_VERSION = (1, 0)
 
 # --- Pin Configuration ---
 NUM_ROWS = 9
@@ -27,20 +71,46 @@ NUM_COLS = 9
 ROW_PIN_BASE = 0   # GPIOs 0-8  (outputs)
 COL_PIN_BASE = 9   # GPIOs 9-17 (inputs)
 
+STRIP_WIDTH = 0.75  # inches, for the descriptor frame (PICO design)
+STRIP_GAP   = 0.5
+
 SETTLE_MS  = 5     # settle time after driving row LOW
-SCAN_MS    = 20    # delay between scans (~20 Hz)
+SCAN_MS    = 20    # delay between scans (~20 Hz) without ADAPTIVE_RATE
 
-# --- Setup pins ---
-row_pins = []
-for r in range(NUM_ROWS):
-    p = Pin(ROW_PIN_BASE + r, Pin.OUT)
-    p.on()   # idle HIGH
-    row_pins.append(p)
+BINARY_FRAMES = True   # False = legacy CSV lines
+DELTA_FRAMES  = True   # binary only: send flipped cells between keyframes
+KEYFRAME_INTERVAL = 50 # scans between full keyframes (~1 s)
+TIMESTAMPS    = False  # binary only: stamp frames with scan time (ticks_us)
+ENCODINGS     = ENC_CSV | ENC_KEYFRAMES | ENC_DELTA  # the PC may select
+
+SCAN_ENGINE   = None   # None = loop below, "timer" or "pio" (scan_engine.py)
+SCAN_RATE_HZ  = 1000   # engine scans per second
+SETTLE_US     = 10     # "pio" / BULK_READ: settle time after driving a row LOW
+BULK_READ     = False  # loop below: one register read per row, no allocation
+SCANNER       = None   # loop below: None = GPIO, "mcp23017" or "shift"
+I2C_FREQ      = 400_000     # SCANNER = "mcp23017"
+SPI_BAUD      = 10_000_000  # SCANNER = "shift"
 
+ADAPTIVE_RATE = True   # loop below: fast after activity, slow when quiet
+ACTIVE_HZ     = 50     # scans per second while touched or changing
+IDLE_HZ       = 5      # scans per second once quiet
+IDLE_AFTER_MS = 2000   # quiet time before dropping to IDLE_HZ
+WAKE_ON_CHANGE = False # idle: poll all columns with every row driven
+
+DEBOUNCE_SCANS = 3     # scans a new level must hold to count, 1 = off
+MAX_DEBOUNCE_MS = 25   # cap on the delay that adds (fewer scans if slow)
+
+# --- Setup pins (the expanders have their own) ---
+row_pins = []
 col_pins = []
-for c in range(NUM_COLS):
-    p = Pin(COL_PIN_BASE + c, Pin.IN, Pin.PULL_UP)
-    col_pins.append(p)
+if not SCANNER:
+    for r in range(NUM_ROWS):
+        p = Pin(ROW_PIN_BASE + r, Pin.OUT)
+        p.on()   # idle HIGH
+        row_pins.append(p)
+    for c in range(NUM_COLS):
+        p = Pin(COL_PIN_BASE + c, Pin.IN, Pin.PULL_UP)
+        col_pins.append(p)
 
 # --- Scan ---
 def scan():
@@ -55,15 +125,245 @@ def scan():
     return grid
 
 # --- Output ---
-# Emit a single CSV line so the PC visualizer can parse it directly.
+frame_writer = FrameWriter(NUM_ROWS, NUM_COLS, timestamps=TIMESTAMPS)
+cells = [False] * (NUM_ROWS * NUM_COLS)
+prev_cells = [False] * (NUM_ROWS * NUM_COLS)
+scans_since_keyframe = KEYFRAME_INTERVAL  # first scan sends a keyframe
+
+stdin_poll = select.poll()
+stdin_poll.register(sys.stdin, select.POLLIN)
+
+def encoding():
+    # ENC_* of the wire format in use
+    if not BINARY_FRAMES:
+        return ENC_CSV
+    return ENC_DELTA if DELTA_FRAMES else ENC_KEYFRAMES
+
+def send_descriptor():
+    # Tell the PC what this scanner is and how it is sending
+    sys.stdout.buffer.write(frame_writer.descriptor(
+        FIRMWARE_VERSION, scan_hz(), ENCODINGS, encoding(), 0, STRIP_WIDTH,
+        STRIP_GAP))
+
+def keyframe_requested():
+    # Non-blocking check for commands from the PC: answers '?' and
+    # switches encoding on a select. True if a keyframe is due
+    global BINARY_FRAMES, DELTA_FRAMES
+    requested = False
+    describe = False
+    while stdin_poll.poll(0):
+        command = ord(sys.stdin.read(1))
+        if command == REQUEST_KEYFRAME:
+            requested = True
+        elif command == REQUEST_DESCRIPTOR:
+            describe = True
+        for select_command, selected in SELECT_COMMANDS:
+            if command == select_command and ENCODINGS & selected:
+                BINARY_FRAMES = selected != ENC_CSV
+                DELTA_FRAMES = selected == ENC_DELTA
+                requested = describe = True
+    if describe:
+        send_descriptor()
+    return requested
+
+# --- Adaptive scan rate ---
+ROW_MASK = ((1 << NUM_ROWS) - 1) << ROW_PIN_BASE
+COL_MASK = (1 << NUM_COLS) - 1
+
+if ADAPTIVE_RATE and not SCAN_ENGINE:
+    from scan_engine import AdaptiveRate, any_contact
+    scan_rate = AdaptiveRate(ACTIVE_HZ, IDLE_HZ, IDLE_AFTER_MS, WAKE_ON_CHANGE)
+else:
+    scan_rate = None
+
+def scan_hz():
+    # Scans per second in the current mode
+    if SCAN_ENGINE:
+        return SCAN_RATE_HZ
+    if scan_rate is not None:
+        return scan_rate.hz
+    return 1000 // SCAN_MS
+
+# --- Debounce ---
+if DEBOUNCE_SCANS > 1:
+    from scan_engine import Debouncer
+    debouncer = Debouncer(NUM_ROWS, NUM_COLS, DEBOUNCE_SCANS, MAX_DEBOUNCE_MS)
+    debouncer.limit(scan_hz())
+    raw_rows = array('L', [COL_MASK] * NUM_ROWS)
+else:
+    debouncer = None
+
+def debounce_grid(grid):
+    # Replace a scan() grid with the debounced state, in place
+    for r in range(NUM_ROWS):
+        level = 0
+        for c in range(NUM_COLS):
+            if not grid[r][c]:
+                level |= 1 << c
+        raw_rows[r] = level
+    debouncer.update(raw_rows)
+    rows = debouncer.rows
+    for r in range(NUM_ROWS):
+        for c in range(NUM_COLS):
+            grid[r][c] = not (rows[r] >> c) & 1
+
+def send_status():
+    # Report the scan rate and debounce depth (binary frames only)
+    if not BINARY_FRAMES or (scan_rate is None and debouncer is None):
+        return
+    mode = MODE_ACTIVE if scan_rate is None else scan_rate.mode
+    depth = 1 if debouncer is None else debouncer.depth
+    sys.stdout.buffer.write(frame_writer.status(scan_hz(), mode, depth))
+
+def pace(active):
+    # Wait for the next scan; active = anything touched or changed
+    if scan_rate is None:
+        time.sleep_ms(SCAN_MS)
+        return
+    if scan_rate.update(active):
+        if debouncer is not None:
+            debouncer.limit(scan_rate.hz)
+        send_status()
+    scan_rate.wait()
+
+def quiet(scanner=None):
+    # In MODE_WAKE: True while no column sees contact (skip the scan)
+    if scan_rate is None or scan_rate.mode != MODE_WAKE:
+        return False
+    if scanner is not None:
+        return not scanner.any_contact()
+    return not any_contact(ROW_MASK, COL_PIN_BASE, COL_MASK, SETTLE_US)
+
+# Emit one frame (binary or CSV line) so the PC visualizer can parse it directly.
 def emit(grid):
+    global scans_since_keyframe
+    requested = keyframe_requested()   # CSV too: the PC may switch us
+    if BINARY_FRAMES:
+        for r in range(NUM_ROWS):
+            for c in range(NUM_COLS):
+                cells[r * NUM_COLS + c] = grid[r][c]
+        scans_since_keyframe += 1
+        periodic = scans_since_keyframe >= KEYFRAME_INTERVAL or requested
+        if not DELTA_FRAMES or periodic:
+            frame = frame_writer.keyframe(cells, touch=True)
+        else:
+            frame = frame_writer.delta(cells, prev_cells, touch=True)
+        if frame is not None:
+            sys.stdout.buffer.write(frame)
+        if periodic:
+            send_status()
+            scans_since_keyframe = 0
+        prev_cells[:] = cells
+        return
     values = []
     for r in range(NUM_ROWS):
         for c in range(NUM_COLS):
             values.append('0' if grid[r][c] else '1')
     sys.stdout.write(','.join(values) + '\n')
 
+# Emit one engine, BULK_READ or SCANNER scan: rows[r] holds the column levels of
+# row r (0 = contact)
+sent_rows = array('L', [(1 << NUM_COLS) - 1] * NUM_ROWS)
+
+def emit_rows(rows):
+    global scans_since_keyframe
+    requested = keyframe_requested()
+    if not BINARY_FRAMES:
+        values = []
+        for r in range(NUM_ROWS):
+            for c in range(NUM_COLS):
+                values.append('1' if (rows[r] >> c) & 1 else '0')
+        sys.stdout.write(','.join(values) + '\n')
+        return
+    scans_since_keyframe += 1
+    periodic = scans_since_keyframe >= KEYFRAME_INTERVAL or requested
+    if not DELTA_FRAMES or periodic:
+        frame = frame_writer.keyframe_rows(rows, touch_level=0)
+    else:
+        frame = frame_writer.delta_rows(rows, sent_rows, touch_level=0)
+    if frame is not None:
+        sys.stdout.buffer.write(frame)
+        for r in range(NUM_ROWS):
+            sent_rows[r] = rows[r]
+    if periodic:
+        send_status()
+        scans_since_keyframe = 0
+
+def run_engine():
+    from scan_engine import PioScanner, TimerScanner
+    if SCAN_ENGINE == "pio":
+        engine = PioScanner(ROW_PIN_BASE, NUM_ROWS, COL_PIN_BASE, NUM_COLS,
+                            SCAN_RATE_HZ, SETTLE_US)
+    else:
+        engine = TimerScanner([ROW_PIN_BASE + r for r in range(NUM_ROWS)],
+                              COL_PIN_BASE, NUM_COLS, SCAN_RATE_HZ)
+    engine.start()
+    while True:
+        rows = engine.acquire()
+        if rows is None:
+            machine.idle()   # sleep until the next interrupt
+            continue
+        if TIMESTAMPS:
+            frame_writer.stamp(*engine.scan_times())
+        if debouncer is not None:
+            debouncer.update(rows)
+            rows = debouncer.rows
+        emit_rows(rows)
+        engine.release()
+
 # --- Main loop ---
+if SCAN_ENGINE:
+    run_engine()
+
+# Row-int scanner for the loop below: expanders or GPIO_IN reads
+if SCANNER == "mcp23017":
+    from expander import Mcp23017Scanner
+    bulk = Mcp23017Scanner(machine.I2C(1, sda=Pin(26), scl=Pin(27),
+                                       freq=I2C_FREQ),
+                           NUM_ROWS, NUM_COLS, settle_us=SETTLE_US)
+elif SCANNER == "shift":
+    from expander import ShiftScanner
+    bulk = ShiftScanner(machine.SPI(0, baudrate=SPI_BAUD, sck=Pin(18),
+                                    mosi=Pin(19), miso=Pin(20)),
+                        Pin(21, Pin.OUT), Pin(22, Pin.OUT),
+                        NUM_ROWS, NUM_COLS, SETTLE_US)
+elif BULK_READ:
+    from scan_engine import BulkScanner
+    bulk = BulkScanner([ROW_PIN_BASE + r for r in range(NUM_ROWS)],
+                       COL_PIN_BASE, NUM_COLS, SETTLE_US)
+else:
+    bulk = None
+
+if bulk is not None:
+    rows = bulk.rows if debouncer is None else debouncer.rows
+else:
+    grid = [[False] * NUM_COLS for _ in range(NUM_ROWS)]
+
 while True:
-    emit(scan())
-    time.sleep_ms(SCAN_MS)
+    scan_start = time.ticks_us()
+    skip = quiet(bulk)   # idle with nothing touched: the last scan holds
+    active = False   # anything touched (a release follows a touched scan)
+    if bulk is not None:
+        if not skip:
+            rows = bulk.scan()
+            if debouncer is not None:
+                debouncer.update(rows)
+                rows = debouncer.rows
+        if TIMESTAMPS:
+            frame_writer.stamp(scan_start, time.ticks_us())
+        for r in range(NUM_ROWS):
+            if rows[r] != COL_MASK:
+                active = True
+        emit_rows(rows)
+    else:
+        if not skip:
+            grid = scan()
+            if debouncer is not None:
+                debounce_grid(grid)
+        if TIMESTAMPS:
+            frame_writer.stamp(scan_start, time.ticks_us())
+        for r in range(NUM_ROWS):
+            if True in grid[r]:
+                active = True
+        emit(grid)
+    pace(active)
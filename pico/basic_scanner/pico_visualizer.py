@@ -3,120 +3,78 @@
 Terminal visualizer for Raspberry Pi Pico 9x9 sensor grid.
 Reads grid state directly from serial (USB) and displays it in the terminal.
 
-Usage: python3 pico_visualizer.py [serial_port]
+Usage: python3 pico_visualizer.py [serial_port | recording.cfr [speed]]
+  A recording (ceferss.recording) is replayed at speed x real time
+  (default 1, or "max").
   Default port: auto-detected (Pico shows up as /dev/tty.usbmodem* on macOS
   or /dev/ttyACM* on Linux)
 """
 
+import os
 import sys
-import glob
 import serial
-import serial.tools.list_ports
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from ceferss.calibration import Calibrator
+from ceferss.handshake import (GeometryError, check_geometry, describe,
+                               handshake)
+from ceferss.mailbox import DisplayScheduler, Mailbox, start_ingest
+from ceferss.ports import find_serial_port as find_sensor_port
+from ceferss.recording import ReplayPort, is_recording, parse_speed
+from ceferss.stream import FrameReader
+from ceferss.terminal import grid_screen, status_panel
 
 # --- Configuration ---
 BAUD_RATE = 115200
+MAX_FPS = 30  # screen updates per second; newer frames coalesce
 GRID_ROWS = 9
 GRID_COLS = 9
 CELL_W = 6   # characters wide per cell (must be even)
 CELL_H = 2   # lines tall per cell
+# "cells" (CELL_W x CELL_H boxes), "half" (2 cells per character),
+# "braille" (2x4 per character) or "auto": the largest that fits
+LAYOUT = "auto"
+FILLS = ("░", "█")  # no touch, touch
+QUIT_HINT = "  Press Ctrl+C to quit"
+LEGEND = ("  ██ = touch    ░░ = no touch", QUIT_HINT)
 
 
 def find_serial_port():
-    """Auto-detect the Pico serial port."""
-    # Prefer ports whose description/hwid look like a Pico
-    for p in serial.tools.list_ports.comports():
-        desc = (p.description or "").lower()
-        hwid = (p.hwid or "").lower()
-        if any(k in desc or k in hwid for k in ("pico", "rp2", "2e8a", "micropython")):
-            return p.device
-
-    # Fall back to common device patterns
-    patterns = [
-        "/dev/tty.usbmodem*",
-        "/dev/ttyACM*",
-        "/dev/tty.usbserial-*",
-        "/dev/ttyUSB*",
-    ]
-    for pattern in patterns:
-        ports = glob.glob(pattern)
-        if ports:
-            return ports[0]
-    return None
-
-
-def clear_screen():
-    """Move cursor to top-left to overwrite previous frame."""
-    print("\033[H\033[J", end="")
-
-
-def render(grid_states):
+    """Auto-detect the Pico serial port (VID/PID match, then device name)."""
+    return find_sensor_port("pico")
+
+
+# drawn on the first frame, then only changed cells and panel lines
+screen = None
+
+
+def render(frame):
     """Render a large grid and active cell count side by side."""
-    active = sum(1 for s in grid_states if s == "0")
+    global screen
+    if screen is None:
+        screen = grid_screen(GRID_ROWS, GRID_COLS, CELL_W, CELL_H,
+                             f"{GRID_ROWS}x{GRID_COLS} Sensor Grid", LAYOUT)
+    active = frame.active()
     total = GRID_ROWS * GRID_COLS
+    panel = status_panel(frame, active, total)
+    if screen.dense:
+        # too many cells for boxes: touched cells as dots
+        grid = frame.grid().reshape(GRID_ROWS, GRID_COLS)
+        screen.render(grid, panel, ("  " + screen.key, QUIT_HINT))
+        return
+    # CSV frames carry no shape, but the glyphs are row-major either way
+    glyphs = [FILLS[t] for t in frame.grid().ravel().tolist()]
+    screen.render(glyphs, panel, LEGEND)
 
-    clear_screen()
-
-    gap = "        "
-
-    # build grid lines
-    top_border = "┌" + ("─" * CELL_W + "┬") * (GRID_COLS - 1) + "─" * CELL_W + "┐"
-    mid_border = "├" + ("─" * CELL_W + "┼") * (GRID_COLS - 1) + "─" * CELL_W + "┤"
-    bot_border = "└" + ("─" * CELL_W + "┴") * (GRID_COLS - 1) + "─" * CELL_W + "┘"
-
-    touch_fill = "█" * CELL_W
-    empty_fill = "░" * CELL_W
-
-    # pre-build all grid output lines
-    lines = []
-    lines.append(f"  {GRID_ROWS}x{GRID_COLS} Sensor Grid")
-    lines.append("  " + top_border)
-
-    for r in range(GRID_ROWS):
-        for _ in range(CELL_H):
-            row_str = "  │"
-            for c in range(GRID_COLS):
-                index = r * GRID_COLS + c
-                if index < len(grid_states) and grid_states[index] == "0":
-                    row_str += touch_fill
-                else:
-                    row_str += empty_fill
-                row_str += "│"
-            lines.append(row_str)
-        if r < GRID_ROWS - 1:
-            lines.append("  " + mid_border)
-
-    lines.append("  " + bot_border)
-    lines.append("")
-    lines.append("  ██ = touch    ░░ = no touch")
-    lines.append("  Press Ctrl+C to quit")
-
-    # build side panel content (vertically centered next to the grid)
-    panel_lines = [
-        "┌─────────────────────┐",
-        "│       Status        │",
-        "│                     │",
-        f"│  Active: {active:>3} / {total:<3}  │",
-        "│                     │",
-    ]
-    bar_len = int((active / total) * 16)
-    bar = "█" * bar_len + "░" * (16 - bar_len)
-    panel_lines.append(f"│ [{bar}]  │")
-    panel_lines.append("│                     │")
-    panel_lines.append("└─────────────────────┘")
-
-    # figure out where to place the panel (vertically centered)
-    panel_start = max(1, (len(lines) - len(panel_lines)) // 2)
-
-    # print with side panel merged in
-    for i, line in enumerate(lines):
-        pi = i - panel_start
-        if 0 <= pi < len(panel_lines):
-            print(line + gap + panel_lines[pi])
-        else:
-            print(line)
+
+def close_screen():
+    """Leave the cursor below the grid before printing anything else."""
+    if screen is not None:
+        screen.close()
 
 
 def main():
+    global GRID_ROWS, GRID_COLS
     # determine serial port
     if len(sys.argv) > 1:
         port = sys.argv[1]
@@ -131,24 +89,54 @@ def main():
     print(f"Connecting to {port} at {BAUD_RATE} baud...")
 
     try:
-        ser = serial.Serial(port, BAUD_RATE, timeout=1)
+        if is_recording(port):
+            speed = parse_speed(sys.argv[2] if len(sys.argv) > 2 else None)
+            ser = ReplayPort(port, speed)
+        else:
+            ser = serial.Serial(port, BAUD_RATE, timeout=1)
         print("Connected! Waiting for data...")
+        # grid size and the fastest encoding from the scanner's descriptor;
+        # firmware without one keeps GRID_ROWS x GRID_COLS
+        reader = FrameReader()
+        descriptor = handshake(ser, reader)
+        if descriptor is not None:
+            GRID_ROWS = descriptor.rows
+            GRID_COLS = descriptor.cols
+        if not is_recording(port):
+            print(describe(descriptor))
+        # the port is drained on its own thread; the screen gets only the
+        # newest frame, at most MAX_FPS times a second
+        mailbox = Mailbox()
+        ingest, stop_ingest = start_ingest(ser, mailbox, reader)
+        scheduler = DisplayScheduler(mailbox, MAX_FPS, reader)
+        # analog frames: touch bits from per-cell baselines, not one threshold
+        calibrator = Calibrator()
 
         while True:
-            line = ser.readline().decode("utf-8", errors="ignore").strip()
-            if not line:
-                continue
-
-            parts = line.split(",")
-            if len(parts) == GRID_ROWS * GRID_COLS:
-                render(parts)
+            # binary frames or CSV lines, deltas already applied
+            frame = scheduler.next_frame()
+            # another grid than expected: say so once and stop
+            check_geometry(frame, GRID_ROWS, GRID_COLS)
+            if frame.count:
+                calibrator.apply(frame)
+                render(frame)
 
     except serial.SerialException as e:
+        close_screen()
         print(f"Serial error: {e}")
         sys.exit(1)
+    except GeometryError as e:
+        close_screen()
+        print(f"Error: {e}")
+        sys.exit(1)
     except KeyboardInterrupt:
+        close_screen()
         print("\nStopping visualizer...")
     finally:
+        if "stop_ingest" in locals():
+            stop_ingest.set()
+            ingest.join(timeout=1)
+            print(scheduler.summary())
         if "ser" in locals():
             ser.close()
 
@@ -0,0 +1,228 @@
+# GPIO-expander scanning backends for the Pico (MicroPython)
+#
+# Direct GPIO tops out around 13x13: one pin per row and per column.
+# These scanners drive the rows and read the columns through expanders
+# instead, behind the same interface as BulkScanner in scan_engine.py:
+#
+#   scanner = Mcp23017Scanner(i2c, NUM_ROWS, NUM_COLS)
+#   rows = scanner.scan()        # bit c of rows[r] = column c level
+#   if scanner.any_contact():    # every row driven: any column LOW?
+#       ...
+#
+# so the sleep-paced loops take whichever backend SCANNER selects in
+# pico_grid.py / data_sender.py. Every row costs a fixed number of
+# multi-byte bus transfers, never one transaction per pin:
+#
+#   Mcp23017Scanner  MCP23017 16-bit I2C expanders: rows on the first
+#                    chips, columns (pulled up) on the next ones. A row
+#                    is one 2-byte OLATA/OLATB write to the chip driving
+#                    it (which also releases the previous row) and one
+#                    2-byte GPIOA/GPIOB read per column chip. 16x16 at
+#                    400 kHz is ~86 bus clocks a row, ~4 ms a scan.
+#   ShiftScanner     74HC595 chain driving rows and 74HC165 chain reading
+#                    columns, sharing one SPI clock. A row is a single
+#                    full-duplex transfer: the columns of the row just
+#                    sampled shift in while the next row's pattern shifts
+#                    out, then one latch pulse drives it. 32x32 at 10 MHz
+#                    is 4 bytes a row; pin toggles and settling dominate.
+#
+# Levels are as everywhere else: rows idle HIGH and are driven LOW, and
+# a column reads 0 on contact. Buffers and row patterns are preallocated;
+# scan() allocates nothing while a row fits in a small int (30 columns).
+# Each row is one array word, 32 bits on the RP2040, so a scanner takes
+# at most MAX_COLS columns (rows are not limited).
+# Nothing here touches machine: the caller passes the bus and pin objects,
+# so ceferss.expander can run these scanners against software fakes.
+#
+# Wiring:
+#   MCP23017: A2-A0 give consecutive addresses from `address`, row chips
+#     first. Row r is pin r % 16 (GPA0-7, then GPB0-7) of row chip r // 16,
+#     column c likewise on column chip c // 16.
+#   74HC595: MOSI into the first chip, Q7' on to the next. Row r is output
+#     Q(r % 8) of chip r // 8. RCLK on `latch`.
+#   74HC165: the first chip's QH to MISO, each next chip's QH into the
+#     SER of the one before. Column c is input D(c % 8) of chip c // 8.
+#     SH/LD on `load`, CLK INH tied low, CLK on the SPI clock.
+# Upload next to the scanner script:
+#   mpremote connect auto cp expander.py :expander.py
+
+import time
+from array import array
+
+try:
+    import micropython
+    native = micropython.native
+except ImportError:   # CPython, against the fakes in ceferss.expander
+    def native(f):
+        return f
+
+try:
+    from time import sleep_us
+except ImportError:
+    def sleep_us(us):
+        time.sleep(us / 1_000_000)
+
+# MCP23017 registers (IOCON.BANK = 0: A and B side by side, and the
+# address pointer steps from A to B within one transfer)
+IODIRA = 0x00
+GPPUA = 0x0C
+GPIOA = 0x12
+OLATA = 0x14
+MCP23017_ADDRESS = 0x20
+MCP23017_PINS = 16
+
+MAX_COLS = 32
+
+
+def _row_words(num_rows, num_cols):
+    # One word per row: 'I' is 4 bytes on the RP2040 and on the host
+    # alike ('L' is 8 on 64-bit CPython)
+    if not 0 < num_cols <= MAX_COLS:
+        raise ValueError("expander scanners take 1 to %d columns, not %d"
+                         % (MAX_COLS, num_cols))
+    return array("H" if num_cols <= 16 else "I", [0] * num_rows)
+
+
+class Mcp23017Scanner:
+    """Matrix scan through MCP23017 I2C expanders (machine.I2C)."""
+
+    def __init__(self, i2c, num_rows, num_cols, address=MCP23017_ADDRESS,
+                 settle_us=10):
+        self.i2c = i2c
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.col_mask = (1 << num_cols) - 1
+        self.settle_us = settle_us
+        self.rows = _row_words(num_rows, num_cols)
+        row_chips = -(-num_rows // MCP23017_PINS)
+        col_chips = -(-num_cols // MCP23017_PINS)
+        self._row_addrs = bytes(range(address, address + row_chips))
+        self._col_addrs = bytes(range(address + row_chips,
+                                      address + row_chips + col_chips))
+        # Output latch of each row pattern: every row HIGH but one
+        self._patterns = [bytes((~(1 << (r % 16)) & 0xFF,
+                                 (~(1 << (r % 16)) >> 8) & 0xFF))
+                          for r in range(num_rows)]
+        self._idle = b"\xff\xff"
+        self._drive_all = b"\x00\x00"
+        self._buf = bytearray(2)
+        for n, addr in enumerate(self._row_addrs):
+            # Only the pins wired to rows become outputs (IODIR 0), idle HIGH
+            used = min(MCP23017_PINS, num_rows - n * MCP23017_PINS)
+            inputs = 0xFFFF ^ ((1 << used) - 1)
+            i2c.writeto_mem(addr, OLATA, self._idle)
+            i2c.writeto_mem(addr, IODIRA, bytes((inputs & 0xFF, inputs >> 8)))
+        for addr in self._col_addrs:
+            i2c.writeto_mem(addr, IODIRA, b"\xff\xff")
+            i2c.writeto_mem(addr, GPPUA, b"\xff\xff")
+
+    @native
+    def _read_cols(self):
+        # All columns in one 2-byte read per column chip
+        i2c = self.i2c
+        buf = self._buf
+        level = 0
+        shift = 0
+        for addr in self._col_addrs:
+            i2c.readfrom_mem_into(addr, GPIOA, buf)
+            level |= (buf[0] | (buf[1] << 8)) << shift
+            shift += 16
+        return level & self.col_mask
+
+    @native
+    def scan(self):
+        i2c = self.i2c
+        rows = self.rows
+        patterns = self._patterns
+        row_addrs = self._row_addrs
+        settle = self.settle_us
+        last = self.num_rows - 1
+        for r in range(self.num_rows):
+            addr = row_addrs[r >> 4]
+            # Writing the next pattern to the same chip releases this row
+            i2c.writeto_mem(addr, OLATA, patterns[r])
+            sleep_us(settle)
+            rows[r] = self._read_cols()
+            if (r & 15) == 15 or r == last:
+                i2c.writeto_mem(addr, OLATA, self._idle)
+        return rows
+
+    def any_contact(self):
+        """Drive every row LOW at once; True if any column reads LOW."""
+        for addr in self._row_addrs:
+            self.i2c.writeto_mem(addr, OLATA, self._drive_all)
+        sleep_us(self.settle_us)
+        cols = self._read_cols()
+        for addr in self._row_addrs:
+            self.i2c.writeto_mem(addr, OLATA, self._idle)
+        return cols != self.col_mask
+
+
+class ShiftScanner:
+    """Matrix scan through 74HC595 (rows) and 74HC165 (columns) chains.
+
+    spi is a machine.SPI (MSB first, mode 0); latch drives the 595 RCLK
+    and load the 165 SH/LD, both machine.Pin outputs.
+    """
+
+    def __init__(self, spi, latch, load, num_rows, num_cols, settle_us=10):
+        self.spi = spi
+        self.latch = latch
+        self.load = load
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.col_mask = (1 << num_cols) - 1
+        self.settle_us = settle_us
+        self.rows = _row_words(num_rows, num_cols)
+        row_bytes = -(-num_rows // 8)
+        self._col_bytes = -(-num_cols // 8)
+        # One transfer carries both chains: the 595s keep the last
+        # row_bytes shifted in, so patterns are padded at the front
+        size = max(row_bytes, self._col_bytes)
+        self._idle = bytes([0xFF] * size)
+        self._drive_all = bytes([0xFF] * (size - row_bytes) + [0] * row_bytes)
+        patterns = []
+        for r in range(num_rows):
+            pattern = bytearray(self._idle)
+            # The last byte out ends up in the first chip
+            pattern[size - 1 - r // 8] ^= 1 << (r % 8)
+            patterns.append(bytes(pattern))
+        self._patterns = patterns
+        self._buf = bytearray(size)
+        latch.value(0)
+        load.value(1)
+        self._shift(self._idle)
+
+    @native
+    def _shift(self, out):
+        # Sample the columns, clock them in while clocking `out` out to
+        # the rows, then drive `out`
+        self.load.value(0)
+        self.load.value(1)
+        self.spi.write_readinto(out, self._buf)
+        self.latch.value(1)
+        self.latch.value(0)
+        buf = self._buf
+        level = 0
+        for i in range(self._col_bytes):
+            level |= buf[i] << (i << 3)
+        return level & self.col_mask
+
+    @native
+    def scan(self):
+        rows = self.rows
+        patterns = self._patterns
+        settle = self.settle_us
+        last = self.num_rows - 1
+        self._shift(patterns[0])
+        for r in range(self.num_rows):
+            sleep_us(settle)
+            # Row r is driven: read it while moving on to the next
+            rows[r] = self._shift(patterns[r + 1] if r < last else self._idle)
+        return rows
+
+    def any_contact(self):
+        """Drive every row LOW at once; True if any column reads LOW."""
+        self._shift(self._drive_all)
+        sleep_us(self.settle_us)
+        return self._shift(self._idle) != self.col_mask
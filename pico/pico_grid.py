@@ -3,10 +3,84 @@
 
 import machine
 import time
+from array import array
+from wire_format import (FrameWriter, MODE_ACTIVE, MODE_WAKE, REQUEST_KEYFRAME,
+                         REQUEST_DESCRIPTOR, ENC_CSV, ENC_KEYFRAMES, ENC_DELTA,
+                         select_encoding)
+
+FIRMWARE_VERSION = (1, 0)
 
 # Grid configuration
 ROW_COUNT = 6
 COL_COUNT = 5
+# Reported to the Pi in the descriptor frame ('?'): row 0 (GP1) is a
+# spare row scanned ahead of the fabric, which is the 5x5 design in
+# designs_info.txt (strip width and gap in inches)
+FIRST_ROW = 1
+STRIP_WIDTH = 0.85
+STRIP_GAP = 0.125
+ENCODINGS = ENC_CSV | ENC_KEYFRAMES | ENC_DELTA  # the Pi may select these
+
+# Wire format: True = bit-packed binary frames (see wire_format.py),
+# False = legacy CSV lines. The Pi may switch between CSV, keyframes and
+# deltas at run time (ceferss.handshake picks the fastest)
+BINARY_FRAMES = True
+
+# Binary only: send just the flipped cells on change, with a full
+# keyframe every KEYFRAME_INTERVAL loops or when the Pi asks for one
+DELTA_FRAMES = True
+KEYFRAME_INTERVAL = 50
+
+# Binary only: prefix each frame with the scan start time and duration
+# (time.ticks_us) so the Pi can measure end-to-end latency
+TIMESTAMPS = False
+
+# Sleep-paced loop: scan at ACTIVE_HZ while anything is touched or has
+# changed in the last IDLE_AFTER_MS, then drop to IDLE_HZ. WAKE_ON_CHANGE
+# makes the idle scan a single read of all columns with every row driven,
+# going back to full scans on the first contact. Binary frames report
+# each rate change in a status frame. False = fixed 50 Hz. Not used with
+# SCAN_ENGINE, which scans at a fixed SCAN_RATE_HZ.
+ADAPTIVE_RATE = True
+ACTIVE_HZ = 200
+IDLE_HZ = 10
+IDLE_AFTER_MS = 2000
+WAKE_ON_CHANGE = False
+
+# Scanning: None = the sleep-paced loop in main(), or "timer" / "pio" for
+# the background engines in scan_engine.py (upload it alongside), which
+# strobe the rows at SCAN_RATE_HZ with µs settling and hand over every
+# scan as one int per row. Only changes are sent, so the UART keeps up.
+SCAN_ENGINE = None
+SCAN_RATE_HZ = 1000
+SETTLE_US = 10
+
+# Sleep-paced loop only: sample each row with one GPIO_IN register read
+# (BulkScanner in scan_engine.py) into a preallocated array instead of
+# one Pin.value() call per cell. Binary frames are then built without
+# any heap allocation, so the loop never stalls for garbage collection.
+BULK_READ = False
+
+# Sleep-paced row-int loop only: scan through GPIO expanders instead
+# (expander.py, upload it alongside), for grids past what the Pico's own
+# pins allow. Each row is a couple of multi-byte bus transfers. Set
+# ROW_COUNT / COL_COUNT to the expander grid.
+#   "mcp23017": MCP23017s on I2C1 (GP26 SDA, GP27 SCL) at 0x20 up, row
+#               chips first
+#   "shift":    74HC595 rows / 74HC165 columns on SPI0 (GP18 SCK, GP19
+#               MOSI, GP20 MISO), 595 RCLK on GP21, 165 SH/LD on GP22
+# None = the Pico's pins (BULK_READ or the per-pin scan).
+SCANNER = None
+I2C_FREQ = 400_000
+SPI_BAUD = 10_000_000
+
+# Debounce (Debouncer in scan_engine.py): a cell only changes once its new
+# level has held for DEBOUNCE_SCANS scans, so contact bounce never costs a
+# frame. Fewer scans are used where that would add more than
+# MAX_DEBOUNCE_MS (e.g. at IDLE_HZ); binary frames report the depth in
+# use in each status frame. 1 = off.
+DEBOUNCE_SCANS = 3
+MAX_DEBOUNCE_MS = 25
 
 # Row pins (outputs): GP1, GP2, GP3, GP4, GP5, GP6
 row_pins = [machine.Pin(i, machine.Pin.OUT) for i in [1, 2, 3, 4, 5, 6]]
@@ -23,12 +97,125 @@ current_grid_state = [1] * (ROW_COUNT * COL_COUNT)
 # Use a buffer to handle data more efficiently
 uart = machine.UART(0, baudrate=115200, tx=machine.Pin(0), rx=machine.Pin(1))
 
+# Preallocated binary frame buffer (30 cells fit in 4 payload bytes)
+frame_writer = FrameWriter(ROW_COUNT, COL_COUNT, timestamps=TIMESTAMPS)
+
+# Masks of the row and column pins, for the all-rows wake check
+ROW_MASK = 0b1111110      # GP1-GP6
+COL_BASE = 7              # GP7-GP11
+COL_MASK = (1 << COL_COUNT) - 1
+
+if ADAPTIVE_RATE and not SCAN_ENGINE:
+    from scan_engine import AdaptiveRate, any_contact
+    scan_rate = AdaptiveRate(ACTIVE_HZ, IDLE_HZ, IDLE_AFTER_MS, WAKE_ON_CHANGE)
+else:
+    scan_rate = None
+
+def scan_hz():
+    """Scans per second in the current mode."""
+    if SCAN_ENGINE:
+        return SCAN_RATE_HZ
+    if scan_rate is not None:
+        return scan_rate.hz
+    return 50
+
+if DEBOUNCE_SCANS > 1:
+    from scan_engine import Debouncer
+    debouncer = Debouncer(ROW_COUNT, COL_COUNT, DEBOUNCE_SCANS, MAX_DEBOUNCE_MS)
+    debouncer.limit(scan_hz())
+    raw_rows = array('L', [COL_MASK] * ROW_COUNT)
+else:
+    debouncer = None
+
 def setup():
     """Initialize the pins"""
     for pin in row_pins:
         pin.value(1)  # Set all rows to HIGH (inactive)
     print("Pico H 5x5 Touch Matrix Optimized and Initialized")
 
+def send_state(grid_state):
+    """Send the full grid state in the configured wire format."""
+    if BINARY_FRAMES:
+        uart.write(frame_writer.keyframe(grid_state, touch=0))
+    else:
+        uart.write(','.join(map(str, grid_state)) + '\n')
+    uart.flush()  # CRITICAL: Ensure data is sent immediately
+
+def send_status():
+    """Report the scan rate and debounce depth (binary frames only)."""
+    if not BINARY_FRAMES or (scan_rate is None and debouncer is None):
+        return
+    mode = MODE_ACTIVE if scan_rate is None else scan_rate.mode
+    depth = 1 if debouncer is None else debouncer.depth
+    uart.write(frame_writer.status(scan_hz(), mode, depth))
+    uart.flush()
+
+def pace(active):
+    """Wait for the next scan; adaptive rate switches on activity."""
+    if scan_rate is None:
+        time.sleep_ms(20)  # Approx 50Hz, well above the 20Hz target
+        return
+    if scan_rate.update(active):
+        if debouncer is not None:
+            debouncer.limit(scan_rate.hz)
+        send_status()
+    scan_rate.wait()
+
+def quiet(scanner=None):
+    """In MODE_WAKE: True while no column sees contact (skip the scan)."""
+    if scan_rate is None or scan_rate.mode != MODE_WAKE:
+        return False
+    if scanner is not None:
+        return not scanner.any_contact()
+    return not any_contact(ROW_MASK, COL_BASE, COL_MASK, SETTLE_US)
+
+def send_changes():
+    """Send only the cells that flipped since last_grid_state."""
+    frame = frame_writer.delta(current_grid_state, last_grid_state, touch=0)
+    if frame is not None:
+        uart.write(frame)
+        uart.flush()
+
+def encoding():
+    """ENC_* of the wire format in use."""
+    if not BINARY_FRAMES:
+        return ENC_CSV
+    return ENC_DELTA if DELTA_FRAMES else ENC_KEYFRAMES
+
+def send_descriptor():
+    """Tell the Pi what this scanner is and how it is sending."""
+    uart.write(frame_writer.descriptor(
+        FIRMWARE_VERSION, scan_hz(), ENCODINGS, encoding(), FIRST_ROW,
+        STRIP_WIDTH, STRIP_GAP))
+    uart.flush()
+
+def keyframe_requested():
+    """Handle commands from the Pi without blocking: answer '?' with a
+    descriptor and switch encoding on a select. True if a keyframe is
+    due (asked for, or the encoding changed)."""
+    global BINARY_FRAMES, DELTA_FRAMES
+    if not uart.any():
+        return False
+    data = uart.read()
+    if data is None:
+        return False
+    # Walk the bytes: MicroPython has no int `in` bytes
+    requested = False
+    describe = False
+    for byte in data:
+        if byte == REQUEST_KEYFRAME:
+            requested = True
+        elif byte == REQUEST_DESCRIPTOR:
+            describe = True
+    selected = select_encoding(data, ENCODINGS)
+    if selected:
+        BINARY_FRAMES = selected != ENC_CSV
+        DELTA_FRAMES = selected == ENC_DELTA
+        requested = True
+    if selected or describe:
+        send_descriptor()
+    return requested
+
 def scan_matrix():
     """
     Scan the 5x5 matrix and update the global current_grid_state.
@@ -40,28 +227,154 @@ def scan_matrix():
         row_pins[r].value(0)  # Set current row to LOW (active)
         time.sleep_us(10)      # Small delay to let the signal settle
         
+        level = 0
         for c in range(COL_COUNT):
             index = r * COL_COUNT + c
             # Reading is inverted: 0 = touch, 1 = no touch
             reading = col_pins[c].value()
             
+            if debouncer is not None:
+                level |= reading << c
             # --- OPTIMIZATION: Directly update the current state list ---
-            if current_grid_state[index] != reading:
+            elif current_grid_state[index] != reading:
                 current_grid_state[index] = reading
                 state_changed = True
+        if debouncer is not None:
+            raw_rows[r] = level
         
         row_pins[r].value(1)  # Reset current row to HIGH (inactive)
+    
+    # Debounced: the state only follows levels that have held
+    if debouncer is not None and debouncer.update(raw_rows):
+        rows = debouncer.rows
+        for r in range(ROW_COUNT):
+            for c in range(COL_COUNT):
+                current_grid_state[r * COL_COUNT + c] = (rows[r] >> c) & 1
+        state_changed = True
         
     return state_changed
 
+def rows_frame(rows, prev):
+    """Frame for engine row ints (bit c = column c level), or None.
+
+    With prev=None the full state is sent, otherwise only a change.
+    """
+    if BINARY_FRAMES and DELTA_FRAMES and prev is not None:
+        return frame_writer.delta_rows(rows, prev, touch_level=0)
+    if prev is not None:
+        for r in range(ROW_COUNT):
+            if rows[r] != prev[r]:
+                break
+        else:
+            return None
+    if BINARY_FRAMES:
+        return frame_writer.keyframe_rows(rows, touch_level=0)
+    return ','.join(['1' if (row >> c) & 1 else '0'
+                     for row in rows for c in range(COL_COUNT)]) + '\n'
+
+def run_engine():
+    """Main loop with a background scan engine: send each change as it lands."""
+    from scan_engine import PioScanner, TimerScanner
+    if SCAN_ENGINE == "pio":
+        engine = PioScanner(1, ROW_COUNT, 7, COL_COUNT, SCAN_RATE_HZ, SETTLE_US)
+    else:
+        engine = TimerScanner([1, 2, 3, 4, 5, 6], 7, COL_COUNT, SCAN_RATE_HZ)
+    sent_rows = array('L', [(1 << COL_COUNT) - 1] * ROW_COUNT)
+    uart.write(rows_frame(sent_rows, None))
+    keyframe_due = time.ticks_add(time.ticks_ms(), 1000)
+    engine.start()
+    while True:
+        rows = engine.acquire()
+        if rows is None:
+            machine.idle()
+            continue
+        if TIMESTAMPS:
+            frame_writer.stamp(*engine.scan_times())
+        if debouncer is not None:
+            debouncer.update(rows)
+            rows = debouncer.rows
+        # Full state once a second (as the loop below) or on request
+        keyframe = (time.ticks_diff(time.ticks_ms(), keyframe_due) >= 0
+                    or keyframe_requested())
+        if keyframe:
+            frame = rows_frame(rows, None)
+            keyframe_due = time.ticks_add(time.ticks_ms(), 1000)
+        else:
+            frame = rows_frame(rows, sent_rows)
+        if frame is not None:
+            uart.write(frame)
+            for r in range(ROW_COUNT):
+                sent_rows[r] = rows[r]
+        if keyframe:
+            send_status()
+        engine.release()
+
+def make_scanner():
+    """Row-int scanner for run_bulk(): the SCANNER expanders or GPIO_IN."""
+    if SCANNER == "mcp23017":
+        from expander import Mcp23017Scanner
+        i2c = machine.I2C(1, sda=machine.Pin(26), scl=machine.Pin(27),
+                          freq=I2C_FREQ)
+        return Mcp23017Scanner(i2c, ROW_COUNT, COL_COUNT, settle_us=SETTLE_US)
+    if SCANNER == "shift":
+        from expander import ShiftScanner
+        spi = machine.SPI(0, baudrate=SPI_BAUD, sck=machine.Pin(18),
+                          mosi=machine.Pin(19), miso=machine.Pin(20))
+        return ShiftScanner(spi, machine.Pin(21, machine.Pin.OUT),
+                            machine.Pin(22, machine.Pin.OUT),
+                            ROW_COUNT, COL_COUNT, SETTLE_US)
+    from scan_engine import BulkScanner
+    return BulkScanner([1, 2, 3, 4, 5, 6], 7, COL_COUNT, SETTLE_US)
+
+def run_bulk():
+    """Main loop with BULK_READ or SCANNER: same pacing as main(), one
+    row int per row."""
+    scanner = make_scanner()
+    sent_rows = array('L', [COL_MASK] * ROW_COUNT)
+    # Kept as is while quiet() skips the scan
+    rows = scanner.rows if debouncer is None else debouncer.rows
+    send_counter = KEYFRAME_INTERVAL  # first scan sends the full state
+    while True:
+        scan_start = time.ticks_us()
+        if not quiet(scanner):
+            rows = scanner.scan()
+            if debouncer is not None:
+                debouncer.update(rows)
+                rows = debouncer.rows
+        if TIMESTAMPS:
+            frame_writer.stamp(scan_start, time.ticks_us())
+        # Active: any cell touched (a release follows a touched scan)
+        active = False
+        for r in range(ROW_COUNT):
+            if rows[r] != COL_MASK:
+                active = True
+        send_counter += 1
+        keyframe = send_counter >= KEYFRAME_INTERVAL or keyframe_requested()
+        if keyframe:
+            frame = rows_frame(rows, None)
+            send_counter = 0
+        else:
+            frame = rows_frame(rows, sent_rows)
+        if frame is not None:
+            uart.write(frame)
+            uart.flush()
+            for r in range(ROW_COUNT):
+                sent_rows[r] = rows[r]
+        if keyframe:
+            send_status()
+        pace(active)
+
 def main():
     """Main loop: scan matrix and send data to Pi 5 only when it changes."""
     setup()
+    if SCAN_ENGINE:
+        run_engine()
+    if BULK_READ or SCANNER:
+        run_bulk()
     
     # Send initial state to sync with Pi 5
-    initial_data_string = ','.join(map(str, last_grid_state))
-    uart.write(initial_data_string + '\n')
-    uart.flush()
+    send_state(last_grid_state)
+    send_status()
     print("Initial state sent")
     
     # Counter for periodic sends
@@ -69,34 +382,36 @@ def main():
     
     while True:
         # Scan the matrix and check if anything has changed
-        state_changed = scan_matrix()
+        scan_start = time.ticks_us()
+        state_changed = False if quiet() else scan_matrix()
+        if TIMESTAMPS:
+            frame_writer.stamp(scan_start, time.ticks_us())
         
         if state_changed:
-            # --- OPTIMIZATION: Construct string and send only if state has changed ---
-            data_string = ','.join(map(str, current_grid_state))
-            
-            # Send the new grid state over UART
-            uart.write(data_string + '\n')
-            uart.flush()  # CRITICAL: Ensure data is sent immediately
+            # --- OPTIMIZATION: Send only if state has changed ---
+            if BINARY_FRAMES and DELTA_FRAMES:
+                send_changes()
+            else:
+                send_state(current_grid_state)
             
             # Debug: Show when data is sent
-            print(f"Sent: {data_string}")
+            if not BINARY_FRAMES:
+                print(f"Sent: {','.join(map(str, current_grid_state))}")
             
             # Update last state
-            last_grid_state[:] = current_grid_state[:]
+            last_grid_state[:] = current_grid_state
         
-        # Send data every 50 iterations (1 second) even if no change
+        # Send a full keyframe every KEYFRAME_INTERVAL iterations (1 second)
+        # even if no change, or right away when the Pi requests one
         send_counter += 1
-        if send_counter >= 50:
-            data_string = ','.join(map(str, current_grid_state))
-            uart.write(data_string + '\n')
-            uart.flush()
-            print(f"Periodic send: {data_string}")
+        if send_counter >= KEYFRAME_INTERVAL or keyframe_requested():
+            send_state(current_grid_state)
+            send_status()
             send_counter = 0
 
-        # The loop can run very fast. A small sleep prevents 100% CPU usage.
-        # Target 20Hz is a 50ms loop time. We can sleep for less to be safe.
-        time.sleep_ms(20) # Approx 50Hz, well above the 20Hz target
+        # The loop can run very fast. A small sleep prevents 100% CPU usage:
+        # 50Hz fixed, or ACTIVE_HZ / IDLE_HZ with ADAPTIVE_RATE
+        pace(state_changed or 0 in current_grid_state)
 
 # Run the main function
 if __name__ == "__main__":
@@ -0,0 +1,416 @@
+# Background matrix scanning engines for the Pico (MicroPython)
+#
+# Rows are strobed without sleep_ms(): either from a hardware timer
+# interrupt (TimerScanner) or by a PIO state machine (PioScanner). Each
+# row is sampled with a single read of the SIO GPIO_IN register, so all
+# columns are captured at once, and stored as one int per row.
+#
+# Frames are double-buffered: the engine fills the back buffer while the
+# main loop holds the front one, and swaps when a scan completes. The main
+# loop always gets the newest complete scan:
+#
+#   engine = TimerScanner(ROW_PINS, COL_BASE, NUM_COLS, rate_hz=1000)
+#   engine.start()
+#   while True:
+#       rows = engine.acquire()      # None until a new scan is ready
+#       if rows is not None:
+#           ...                      # bit c of rows[r] = column c level
+#           engine.release()
+#
+# BulkScanner does the same row reads in a plain blocking scan() for the
+# sleep-paced loops (BULK_READ in the scanner scripts). The expander
+# scanners in expander.py share its interface: rows, scan() and
+# any_contact(). AdaptiveRate paces
+# those loops: fast right after activity, slow once the fabric is quiet,
+# optionally only polling any_contact() with every row driven.
+#
+# Debouncer filters those row ints before anything is sent: a cell only
+# changes once its new level has outweighed the old one for `depth` scans,
+# so contact bounce costs neither UART frames nor redraws on the Pi.
+#
+# Column levels are raw: with pull-ups, 1 = open and 0 = contact.
+# Column pins must be consecutive GPIOs starting at col_base.
+# Upload next to the scanner script:
+#   mpremote connect auto cp scan_engine.py :scan_engine.py
+
+import sys
+import time
+from array import array
+
+import machine
+import micropython
+
+from wire_format import MODE_ACTIVE, MODE_IDLE, MODE_WAKE
+
+# SIO registers (single-cycle IO block)
+SIO_BASE = 0xD0000000
+GPIO_IN = SIO_BASE + 0x004
+if "RP2350" in sys.implementation._machine:
+    GPIO_OUT_SET = SIO_BASE + 0x018
+    GPIO_OUT_CLR = SIO_BASE + 0x020
+else:
+    GPIO_OUT_SET = SIO_BASE + 0x014
+    GPIO_OUT_CLR = SIO_BASE + 0x018
+
+# Buffer states shared with the interrupt handler
+_FREE = 0       # no unread scan
+_READY = 1      # front holds an unread scan
+_READING = 2    # main loop holds the front; the engine must not swap
+
+
+class _DoubleBuffer:
+    """Two row arrays: the engine writes one, the main loop reads the other."""
+
+    def __init__(self, rows, cols):
+        self.num_rows = rows
+        self.num_cols = cols
+        self.col_mask = (1 << cols) - 1
+        typecode = "H" if cols <= 16 else "L"
+        self._bufs = (array(typecode, [0] * rows), array(typecode, [0] * rows))
+        # ticks_us at the start and end of the scan in each buffer
+        self._starts = array("L", [0, 0])
+        self._ends = array("L", [0, 0])
+        self._back = 0
+        self._state = _FREE
+        self.scans = 0        # completed scans
+        self.overwritten = 0  # scans replaced before the main loop saw them
+
+    def _begin(self):
+        # Called by the engine as it drives the first row
+        self._starts[self._back] = time.ticks_us()
+
+    def _complete(self):
+        # Called by the engine with the back buffer full
+        self._ends[self._back] = time.ticks_us()
+        self.scans += 1
+        if self._state == _READING:
+            # Keep scanning into the same back buffer; newest wins
+            self.overwritten += 1
+            return
+        if self._state == _READY:
+            self.overwritten += 1
+        self._back ^= 1
+        self._state = _READY
+
+    def acquire(self):
+        """Newest complete scan (array of row ints) or None; then release()."""
+        if self._state != _READY:
+            return None
+        self._state = _READING
+        return self._bufs[self._back ^ 1]
+
+    def release(self):
+        self._state = _FREE
+
+    def scan_times(self):
+        """(start, end) ticks_us of the scan returned by acquire()."""
+        front = self._back ^ 1
+        return self._starts[front], self._ends[front]
+
+
+class BulkScanner:
+    """Blocking scan: one GPIO_IN read per row into a preallocated array.
+
+    scan() allocates nothing and returns the same array every time, so
+    use (or copy) it before the next call.
+    """
+
+    def __init__(self, row_pins, col_base, num_cols, settle_us=10):
+        self.num_rows = len(row_pins)
+        self.col_base = col_base
+        self.col_mask = (1 << num_cols) - 1
+        self.settle_us = settle_us
+        self.rows = array("H" if num_cols <= 16 else "L", [0] * self.num_rows)
+        self._row_masks = array("L", [1 << p for p in row_pins])
+        for p in row_pins:
+            machine.Pin(p, machine.Pin.OUT, value=1)
+        for c in range(num_cols):
+            machine.Pin(col_base + c, machine.Pin.IN, machine.Pin.PULL_UP)
+
+    @micropython.native
+    def scan(self):
+        rows = self.rows
+        masks = self._row_masks
+        shift = self.col_base
+        col_mask = self.col_mask
+        settle = self.settle_us
+        for r in range(self.num_rows):
+            machine.mem32[GPIO_OUT_CLR] = masks[r]
+            time.sleep_us(settle)
+            rows[r] = (machine.mem32[GPIO_IN] >> shift) & col_mask
+            machine.mem32[GPIO_OUT_SET] = masks[r]
+        return rows
+
+    def any_contact(self):
+        """Drive every row LOW at once; True if any column reads LOW."""
+        row_mask = 0
+        for mask in self._row_masks:
+            row_mask |= mask
+        return any_contact(row_mask, self.col_base, self.col_mask,
+                           self.settle_us)
+
+
+def any_contact(row_mask, col_base, col_mask, settle_us=10):
+    """Drive every row in row_mask LOW at once; True if any column reads LOW."""
+    machine.mem32[GPIO_OUT_CLR] = row_mask
+    time.sleep_us(settle_us)
+    cols = (machine.mem32[GPIO_IN] >> col_base) & col_mask
+    machine.mem32[GPIO_OUT_SET] = row_mask
+    return cols != col_mask
+
+
+class AdaptiveRate:
+    """Scan pacing: active_hz after any activity, idle_hz once quiet.
+
+    Call update() after each scan with whether anything is touched or
+    changed; it returns True when the mode changed, so the caller can send
+    a status frame. wait() then sleeps out the rest of the scan period.
+    With wake=True the quiet mode is MODE_WAKE: the caller polls
+    any_contact() instead of scanning until something touches.
+    """
+
+    def __init__(self, active_hz, idle_hz, idle_after_ms, wake=False):
+        self.active_hz = active_hz
+        self.idle_hz = idle_hz
+        self.idle_after_ms = idle_after_ms
+        self.idle_mode = MODE_WAKE if wake else MODE_IDLE
+        self.mode = MODE_ACTIVE
+        self.hz = active_hz
+        self.period_us = 1_000_000 // active_hz
+        self._last_active = time.ticks_ms()
+        self._due = time.ticks_us()
+
+    def _set(self, mode, hz):
+        self.mode = mode
+        self.hz = hz
+        self.period_us = 1_000_000 // hz
+
+    def update(self, active):
+        if active:
+            self._last_active = time.ticks_ms()
+            if self.mode != MODE_ACTIVE:
+                self._set(MODE_ACTIVE, self.active_hz)
+                # Rescan right away: this is the start of a touch
+                self._due = time.ticks_add(time.ticks_us(), -self.period_us)
+                return True
+        elif (self.mode == MODE_ACTIVE and time.ticks_diff(
+                time.ticks_ms(), self._last_active) >= self.idle_after_ms):
+            self._set(self.idle_mode, self.idle_hz)
+            return True
+        return False
+
+    def wait(self):
+        """Sleep until the next scan is due (not at all if running late)."""
+        self._due = time.ticks_add(self._due, self.period_us)
+        delay = time.ticks_diff(self._due, time.ticks_us())
+        if delay > 0:
+            time.sleep_us(delay)
+        else:
+            self._due = time.ticks_us()
+
+
+class Debouncer:
+    """Integrate-and-threshold debouncing of row ints, per cell.
+
+    Each cell has a counter, all in one preallocated bytearray, that
+    counts up on scans where the raw level differs from the debounced one
+    and back down where they agree. The debounced level flips when the
+    counter reaches `depth`: a clean change goes through depth - 1 scans
+    late, a glitch shorter than that never does. Rows that agree with no
+    counter running are skipped after one comparison.
+
+    limit(hz) caps depth so the added latency stays within max_ms at the
+    current scan rate; call it again when the rate changes.
+    """
+
+    def __init__(self, num_rows, num_cols, depth=3, max_ms=25):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.max_depth = depth
+        self.max_ms = max_ms
+        self.depth = depth
+        typecode = "H" if num_cols <= 16 else "L"
+        # Debounced levels, starting all open
+        self.rows = array(typecode, [(1 << num_cols) - 1] * num_rows)
+        self._counts = bytearray(num_rows * num_cols)
+        # Bit c of _running[r]: the counter of cell (r, c) is above zero
+        self._running = array(typecode, [0] * num_rows)
+        self.glitches = 0   # changes that died out before reaching depth
+
+    def limit(self, hz):
+        """Cap depth for scanning at hz; returns the new depth."""
+        self.depth = max(1, min(self.max_depth, 1 + self.max_ms * hz // 1000))
+        return self.depth
+
+    def latency_ms(self, hz):
+        """Delay added to a clean change at hz scans per second."""
+        return (self.depth - 1) * 1000 // hz
+
+    @micropython.native
+    def update(self, raw):
+        """Debounce one scan of row ints; True if self.rows changed."""
+        rows = self.rows
+        counts = self._counts
+        running = self._running
+        depth = self.depth
+        cols = self.num_cols
+        changed = False
+        for r in range(self.num_rows):
+            diff = raw[r] ^ rows[r]
+            if not diff and not running[r]:
+                continue
+            level = rows[r]
+            still = 0
+            i = r * cols
+            for c in range(cols):
+                bit = 1 << c
+                n = counts[i]
+                if diff & bit:
+                    n += 1
+                    if n >= depth:
+                        level ^= bit
+                        n = 0
+                    else:
+                        still |= bit
+                elif n:
+                    n -= 1
+                    if n:
+                        still |= bit
+                    else:
+                        self.glitches += 1
+                counts[i] = n
+                i += 1
+            running[r] = still
+            if level != rows[r]:
+                rows[r] = level
+                changed = True
+        return changed
+
+
+class TimerScanner(_DoubleBuffer):
+    """Row strobing from a machine.Timer interrupt.
+
+    The timer fires num_rows * rate_hz times per second. Each tick samples
+    the row driven on the previous tick (so it had one tick period to
+    settle), then drives the next row low. The handler runs as a hard
+    interrupt and allocates nothing: register addresses are constants and
+    GPIO_IN values stay small ints (bits 30 and up read as 0).
+    """
+
+    def __init__(self, row_pins, col_base, num_cols, rate_hz=1000):
+        _DoubleBuffer.__init__(self, len(row_pins), num_cols)
+        self.rate_hz = rate_hz
+        self.col_base = col_base
+        self._row_masks = array("L", [1 << p for p in row_pins])
+        self._all_rows = 0
+        for p in row_pins:
+            machine.Pin(p, machine.Pin.OUT, value=1)
+            self._all_rows |= 1 << p
+        for c in range(num_cols):
+            machine.Pin(col_base + c, machine.Pin.IN, machine.Pin.PULL_UP)
+        self._row = 0
+        self._timer = None
+        self._tick_cb = self._tick
+
+    def start(self):
+        machine.mem32[GPIO_OUT_CLR] = self._row_masks[0]
+        self._row = 0
+        self._begin()
+        self._timer = machine.Timer(mode=machine.Timer.PERIODIC,
+                                    freq=self.rate_hz * self.num_rows,
+                                    callback=self._tick_cb, hard=True)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+        machine.mem32[GPIO_OUT_SET] = self._all_rows
+
+    def _tick(self, _timer):
+        row = self._row
+        self._bufs[self._back][row] = (
+            machine.mem32[GPIO_IN] >> self.col_base) & self.col_mask
+        machine.mem32[GPIO_OUT_SET] = self._row_masks[row]
+        row += 1
+        if row == self.num_rows:
+            row = 0
+            self._complete()
+            self._begin()
+        machine.mem32[GPIO_OUT_CLR] = self._row_masks[row]
+        self._row = row
+
+
+def _strobe_program(num_rows, num_cols, settle):
+    # asm_pio swaps the module globals while assembling, so the sizes
+    # reach the program through this closure
+    import rp2
+
+    # out shifts right, so `out` takes the pattern's low num_rows bits
+    # (bit r = row r); in shifts left, so column c lands in bit c
+    @rp2.asm_pio(out_init=(rp2.PIO.OUT_HIGH,) * num_rows,
+                 out_shiftdir=rp2.PIO.SHIFT_RIGHT,
+                 in_shiftdir=rp2.PIO.SHIFT_LEFT)
+    def strobe():
+        pull()                          # row pattern: one bit low
+        out(pins, num_rows)[settle]     # drive it, wait `settle` us
+        in_(pins, num_cols)             # all columns in one read
+        push()
+        mov(pins, invert(null))         # rows back to idle high
+
+    return strobe
+
+
+class PioScanner(_DoubleBuffer):
+    """Row strobing by a PIO state machine, paced by a machine.Timer.
+
+    Row pins must be consecutive GPIOs starting at row_base. The state
+    machine runs at 1 MHz, so `settle_us` (0-31) is exact; the CPU only
+    feeds row patterns into the TX FIFO and takes column words from the
+    RX FIFO. Row patterns hold row r in bit r, LSB first (row_base);
+    column words likewise hold column c in bit c. start() scans rate_hz
+    times per second from a soft timer callback; scan() can also be
+    called directly from the main loop.
+    """
+
+    def __init__(self, row_base, num_rows, col_base, num_cols, rate_hz=1000,
+                 settle_us=10, sm_id=0):
+        import rp2
+        _DoubleBuffer.__init__(self, num_rows, num_cols)
+        self.rate_hz = rate_hz
+        all_rows = (1 << num_rows) - 1
+        self._patterns = array("L", [all_rows ^ (1 << r)
+                                     for r in range(num_rows)])
+        for c in range(num_cols):
+            machine.Pin(col_base + c, machine.Pin.IN, machine.Pin.PULL_UP)
+        settle = min(max(settle_us, 0), 31)
+        self._sm = rp2.StateMachine(
+            sm_id, _strobe_program(num_rows, num_cols, settle), freq=1_000_000,
+            out_base=machine.Pin(row_base), in_base=machine.Pin(col_base))
+        self._sm.active(1)
+        self._timer = None
+        self._scan_cb = self._scan_from_timer
+
+    def scan(self):
+        """Strobe every row once and publish the result."""
+        sm = self._sm
+        rows = self._bufs[self._back]
+        mask = self.col_mask
+        patterns = self._patterns
+        self._begin()
+        for r in range(self.num_rows):
+            sm.put(patterns[r])
+            rows[r] = sm.get() & mask
+        self._complete()
+
+    def _scan_from_timer(self, _timer):
+        self.scan()
+
+    def start(self):
+        self._timer = machine.Timer(mode=machine.Timer.PERIODIC,
+                                    freq=self.rate_hz, callback=self._scan_cb)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+        self._sm.active(0)
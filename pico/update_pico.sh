@@ -9,6 +9,9 @@ sudo systemctl stop sensor.service
 sleep 1
 
 echo "--> Uploading new script (pico_grid.py) to Pico..."
+mpremote connect auto cp wire_format.py :wire_format.py
+mpremote connect auto cp scan_engine.py :scan_engine.py
+mpremote connect auto cp expander.py :expander.py
 mpremote connect auto cp pico_grid.py :main.py
 
 echo "--> Waiting for Pico to reboot (3 seconds)..."
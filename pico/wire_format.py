@@ -0,0 +1,261 @@
+# Binary grid frame encoder for the Pico scanners (MicroPython)
+#
+# Must match ceferss/protocol.py on the host:
+#   sync 0xA5 0x5A | version<<4 | type | seq | rows | cols | len (2, LE)
+#   | payload | CRC-8 (poly 0x07) over everything after the sync bytes
+#
+# Keyframe payload: grid bit-packed row-major, LSB first, 1 = touch.
+# Delta payload: indices of the cells that flipped since the previous
+# frame, 1 byte each (2 bytes LE for grids over 256 cells).
+# Status payload: scan rate in Hz (2 bytes LE), the MODE_* byte and the
+# debounce depth in scans (1 = none); status frames repeat the next
+# sequence number instead of taking one.
+# Descriptor payload (answer to '?'): firmware version major, minor, scan
+# rate in Hz (2 bytes LE), supported ENC_* bits, the ENC_* in use, spare
+# leading rows, strip width and gap in 1/1000 inch (2 bytes LE each, 0 =
+# unknown). Out of sequence like status frames. 'c', 'k', 'd' and 'a'
+# select an encoding (select_encoding()).
+# With FLAG_TIMESTAMP in the type nibble the payload is prefixed with the
+# scan start (4 bytes LE, microseconds, wraps at 2**32) and the scan
+# duration (2 bytes LE, microseconds).
+# Upload next to the scanner script:
+#   mpremote connect auto cp wire_format.py :wire_format.py
+
+import time
+
+SYNC0 = 0xA5
+SYNC1 = 0x5A
+VERSION = 1
+
+TYPE_KEYFRAME = 0x0
+TYPE_DELTA = 0x1
+TYPE_STATUS = 0x2
+TYPE_DESCRIPTOR = 0x7
+FLAG_TIMESTAMP = 0x8
+
+# Scan modes in status frames
+MODE_ACTIVE = 0   # fast scans after recent activity
+MODE_IDLE = 1     # slow full scans
+MODE_WAKE = 2     # slow polls with all rows driven, full scan on contact
+
+# Host -> scanner command: send a keyframe now
+REQUEST_KEYFRAME = ord('K')
+# Host -> scanner command: send a descriptor frame
+REQUEST_DESCRIPTOR = ord('?')
+
+# Encodings in descriptor frames, and the commands selecting them
+ENC_CSV = 0x01        # CSV lines
+ENC_KEYFRAMES = 0x02  # binary keyframes only
+ENC_DELTA = 0x04      # binary keyframes and deltas
+ENC_ANALOG = 0x08     # analog frames (nano_grid.ino only)
+SELECT_COMMANDS = ((ord('c'), ENC_CSV), (ord('k'), ENC_KEYFRAMES),
+                   (ord('d'), ENC_DELTA), (ord('a'), ENC_ANALOG))
+
+HEADER_SIZE = 8
+TIMESTAMP_SIZE = 6
+STATUS_SIZE = 4
+DESCRIPTOR_SIZE = 11
+
+_CRC_TABLE = bytearray(256)
+for _i in range(256):
+    _c = _i
+    for _ in range(8):
+        _c = ((_c << 1) ^ 0x07) & 0xFF if _c & 0x80 else (_c << 1) & 0xFF
+    _CRC_TABLE[_i] = _c
+
+
+def crc8(buf, start, end):
+    crc = 0
+    table = _CRC_TABLE
+    for i in range(start, end):
+        crc = table[crc ^ buf[i]]
+    return crc
+
+
+def select_encoding(data, supported):
+    """ENC_* of the last select command in `data` among `supported`, or 0."""
+    selected = 0
+    for byte in data:
+        for command, encoding in SELECT_COMMANDS:
+            if byte == command and supported & encoding:
+                selected = encoding
+    return selected
+
+
+class FrameWriter:
+    """Builds frames into one preallocated buffer (no allocation per send)."""
+
+    def __init__(self, rows, cols, timestamps=False):
+        self.rows = rows
+        self.cols = cols
+        self.cells = rows * cols
+        self.payload_len = (self.cells + 7) // 8
+        self.index_size = 1 if self.cells <= 256 else 2
+        self.col_mask = (1 << cols) - 1
+        # Timestamped frames carry the last stamp() ahead of the cell data
+        self.flags = FLAG_TIMESTAMP if timestamps else 0
+        self.data_start = HEADER_SIZE + (TIMESTAMP_SIZE if timestamps else 0)
+        self.buf = bytearray(self.data_start
+                             + max(self.payload_len, DESCRIPTOR_SIZE) + 1)
+        # Frame views by end offset, made once per length then reused
+        self._buf_view = memoryview(self.buf)
+        self._views = {}
+        self.seq = 0
+        # 32-bit microsecond clock kept as two 16-bit halves, so extending
+        # ticks_us (which wraps at 2**30) never allocates a long int
+        self._clock_lo = 0
+        self._clock_hi = 0
+        self._last_ticks = None
+        buf = self.buf
+        buf[0] = SYNC0
+        buf[1] = SYNC1
+        buf[4] = rows
+        buf[5] = cols
+
+    def stamp(self, start, end):
+        """Record the scan behind the next frames (time.ticks_us values)."""
+        if self._last_ticks is None:
+            lo = start & 0xFFFF
+            self._clock_hi = (start >> 16) & 0xFFFF
+        else:
+            lo = self._clock_lo + time.ticks_diff(start, self._last_ticks)
+            self._clock_hi = (self._clock_hi + (lo >> 16)) & 0xFFFF
+            lo &= 0xFFFF
+        self._clock_lo = lo
+        self._last_ticks = start
+        duration = min(time.ticks_diff(end, start), 0xFFFF)
+        buf = self.buf
+        buf[HEADER_SIZE] = lo & 0xFF
+        buf[HEADER_SIZE + 1] = lo >> 8
+        buf[HEADER_SIZE + 2] = self._clock_hi & 0xFF
+        buf[HEADER_SIZE + 3] = self._clock_hi >> 8
+        buf[HEADER_SIZE + 4] = duration & 0xFF
+        buf[HEADER_SIZE + 5] = duration >> 8
+
+    def _finish(self, frame_type, length, advance=True):
+        buf = self.buf
+        length += self.data_start - HEADER_SIZE
+        buf[2] = (VERSION << 4) | frame_type | self.flags
+        buf[3] = self.seq
+        buf[6] = length & 0xFF
+        buf[7] = length >> 8
+        end = HEADER_SIZE + length
+        buf[end] = crc8(buf, 2, end)
+        if advance:
+            self.seq = (self.seq + 1) & 0xFF
+        view = self._views.get(end)
+        if view is None:
+            view = self._views[end] = self._buf_view[:end + 1]
+        return view
+
+    def status(self, scan_hz, mode, debounce=1):
+        """Report the scan rate (Hz), MODE_* and debounce depth to the host."""
+        buf = self.buf
+        start = self.data_start
+        buf[start] = scan_hz & 0xFF
+        buf[start + 1] = (scan_hz >> 8) & 0xFF
+        buf[start + 2] = mode
+        buf[start + 3] = debounce
+        return self._finish(TYPE_STATUS, STATUS_SIZE, advance=False)
+
+    def descriptor(self, version, scan_hz, encodings, encoding, first_row=0,
+                   width=0.0, gap=0.0):
+        """Describe the scanner: version (major, minor), rate, ENC_* bits
+        supported and in use, spare leading rows, strip width and gap
+        in inches."""
+        buf = self.buf
+        start = self.data_start
+        width = int(width * 1000 + 0.5)
+        gap = int(gap * 1000 + 0.5)
+        buf[start] = version[0]
+        buf[start + 1] = version[1]
+        buf[start + 2] = scan_hz & 0xFF
+        buf[start + 3] = (scan_hz >> 8) & 0xFF
+        buf[start + 4] = encodings
+        buf[start + 5] = encoding
+        buf[start + 6] = first_row
+        buf[start + 7] = width & 0xFF
+        buf[start + 8] = width >> 8
+        buf[start + 9] = gap & 0xFF
+        buf[start + 10] = gap >> 8
+        return self._finish(TYPE_DESCRIPTOR, DESCRIPTOR_SIZE, advance=False)
+
+    def keyframe(self, cells, touch=0):
+        """Pack a flat row-major cell list; cells equal to `touch` set a bit."""
+        buf = self.buf
+        start = self.data_start
+        for i in range(start, start + self.payload_len):
+            buf[i] = 0
+        for i in range(self.cells):
+            if cells[i] == touch:
+                buf[start + (i >> 3)] |= 1 << (i & 7)
+        return self._finish(TYPE_KEYFRAME, self.payload_len)
+
+    def delta(self, cells, prev, touch=0):
+        """Encode the indices where cells differs from prev.
+
+        Falls back to a keyframe when the change list would not be
+        smaller than the packed grid. Returns None if nothing changed.
+        """
+        buf = self.buf
+        width = self.index_size
+        start = self.data_start
+        limit = start + self.payload_len
+        pos = start
+        for i in range(self.cells):
+            if cells[i] != prev[i]:
+                if pos + width > limit:
+                    return self.keyframe(cells, touch)
+                buf[pos] = i & 0xFF
+                if width == 2:
+                    buf[pos + 1] = i >> 8
+                pos += width
+        if pos == start:
+            return None
+        return self._finish(TYPE_DELTA, pos - start)
+
+    def keyframe_rows(self, rows, touch_level=0):
+        """Pack one int per row (bit c = column c level, see scan_engine.py).
+
+        Cells whose level equals touch_level set a bit.
+        """
+        buf = self.buf
+        start = self.data_start
+        for i in range(start, start + self.payload_len):
+            buf[i] = 0
+        cols = self.cols
+        # XOR so that a set bit always means touch
+        flip = 0 if touch_level else self.col_mask
+        i = 0
+        for r in range(self.rows):
+            touched = rows[r] ^ flip
+            for c in range(cols):
+                if (touched >> c) & 1:
+                    buf[start + (i >> 3)] |= 1 << (i & 7)
+                i += 1
+        return self._finish(TYPE_KEYFRAME, self.payload_len)
+
+    def delta_rows(self, rows, prev, touch_level=0):
+        """Like delta(), for row ints as produced by keyframe_rows()."""
+        buf = self.buf
+        width = self.index_size
+        cols = self.cols
+        start = self.data_start
+        limit = start + self.payload_len
+        pos = start
+        for r in range(self.rows):
+            diff = rows[r] ^ prev[r]
+            if not diff:
+                continue
+            for c in range(cols):
+                if (diff >> c) & 1:
+                    if pos + width > limit:
+                        return self.keyframe_rows(rows, touch_level)
+                    i = r * cols + c
+                    buf[pos] = i & 0xFF
+                    if width == 2:
+                        buf[pos + 1] = i >> 8
+                    pos += width
+        if pos == start:
+            return None
+        return self._finish(TYPE_DELTA, pos - start)
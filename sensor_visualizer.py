@@ -14,49 +14,10 @@ Reports:
     row/column intersections (where touch is actually sensed).
 """
 
-import os
 import tkinter as tk
 from tkinter import ttk
 
-PRESETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                            "designs_info.txt")
-
-
-def load_presets(path=PRESETS_FILE):
-    """Parse designs_info.txt into a list of (name, dict) presets.
-
-    Format: blank-line-separated blocks; first non-empty line is the
-    preset name, remaining lines are 'key: value' pairs.
-    """
-    presets = []
-    if not os.path.exists(path):
-        return presets
-    with open(path) as f:
-        blocks = f.read().split("\n\n")
-    for block in blocks:
-        lines = [ln.strip() for ln in block.splitlines() if ln.strip()]
-        if not lines:
-            continue
-        name = lines[0]
-        data = {}
-        for ln in lines[1:]:
-            if ":" not in ln:
-                continue
-            k, v = ln.split(":", 1)
-            try:
-                data[k.strip()] = float(v.strip())
-            except ValueError:
-                pass
-        try:
-            presets.append((name, {
-                "rows": int(data["rows"]),
-                "cols": int(data["cols"]),
-                "width": data["strip width (in)"],
-                "gap": data["strip gap (in)"],
-            }))
-        except KeyError:
-            continue
-    return presets
+from ceferss.designs import load_presets
 
 
 class SensorGUI: